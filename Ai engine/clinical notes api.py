@@ -2,10 +2,27 @@
 # Flask is used for creating the web API.
 # The transformers library from Hugging Face is used for the summarization model.
 # Torch is the deep learning framework that powers the model.
+import os
+import sys
+import threading
+import time
+
 import torch
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from transformers import BartForConditionalGeneration, BartTokenizer
 
+# Make the shared backend package importable when this script is run directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend import metrics
+from backend.clinical_notes import NoteIndex
+from backend.context_packing import pack_context
+from backend.decoding import deadline_from_budget, get_profile, plan_decoding, trim_partial
+from backend.fhir_loading import load_all_fhir
+from backend.hierarchical_summary import hierarchical_summarize
+from backend.model_loading import load_pretrained
+from backend.singleflight import SingleFlight, flight_key
+from backend.token_store import get_store
+
 # --- Task 1: Install and load the summarization model ---
 # Note: The first time you run this, it will download the pre-trained model
 # and tokenizer from the internet. This may take a few minutes.
@@ -15,14 +32,34 @@ from transformers import BartForConditionalGeneration, BartTokenizer
 # Load the BART tokenizer and model.
 # 'facebook/bart-large-cnn' is a pre-trained model specifically fine-tuned for
 # summarization tasks on the CNN/Daily Mail dataset, making it an excellent choice.
+# Set AI_CLINIC_TINY_MODELS=1 to run offline with a tiny random model of the
+# same architecture (see backend/model_loading.py).
+MODEL_NAME = 'facebook/bart-large-cnn'
 print("Loading BART tokenizer and model...")
-tokenizer = BartTokenizer.from_pretrained('facebook/bart-large-cnn')
-model = BartForConditionalGeneration.from_pretrained('facebook/bart-large-cnn')
+tokenizer, model = load_pretrained(MODEL_NAME, BartForConditionalGeneration, BartTokenizer)
 print("Model loaded successfully.")
 
+# Pre-tokenized note snippets (built offline with `python -m backend.token_store`).
+# Notes that were not ingested yet are tokenized once on first use and kept.
+token_store = get_store(MODEL_NAME, tokenizer)
+
 # --- Flask Application Setup ---
 app = Flask(__name__)
 
+# Name under which this service's spans and counters are reported at /metrics.
+SERVICE = "notes_api"
+
+# Token budget for the notes handed to the summarizer. BART's encoder takes
+# 1024 tokens; anything past that used to be silently truncated.
+SUMMARY_CONTEXT_BUDGET = int(os.environ.get("AI_CLINIC_SUMMARY_CONTEXT_BUDGET", 1024))
+
+# Output length limit for summaries; decoding profiles (backend/decoding.py)
+# may shorten it.
+SUMMARY_MAX_LENGTH = 150
+
+# Identical summarization calls that overlap in time share one generation.
+summarizer_flight = SingleFlight(SERVICE)
+
 # --- Task 2: Implement query understanding (Keyword extraction) ---
 def extract_keywords(query: str) -> list:
     """
@@ -47,71 +84,163 @@ def extract_keywords(query: str) -> list:
     
     return keywords
 
-# --- Task 3: Pull relevant notes from mock FHIR JSON ---
-def get_fhir_notes(keywords: list) -> str:
+# --- Task 3: Pull relevant notes from the FHIR data ---
+# The note index is built on first use from every bundle in the data directory.
+# Only DocumentReference metadata is indexed; the base64 note text is decoded
+# the first time a note is read and kept in a shared, size-bounded cache.
+_note_index = None
+_note_index_lock = threading.Lock()
+
+def get_note_index() -> NoteIndex:
     """
-    Mocks pulling relevant clinical notes from a FHIR-like JSON structure.
-    
-    In a real application, this would involve a database query or an API call
-    to a service that holds electronic health records.
+    Returns the process-wide clinical note index, building it if needed.
+    """
+    global _note_index
+    with _note_index_lock:
+        if _note_index is None:
+            _note_index = NoteIndex.from_bundle(load_all_fhir())
+    return _note_index
+
+def get_fhir_snippets(keywords: list, patient_id: str) -> list:
+    """
+    Pulls one patient's clinical notes (DocumentReferences) that mention any keyword.
     
     Args:
         keywords: A list of keywords to filter the notes by.
+        patient_id: The patient whose notes are searched (required; other
+            patients' notes are never decoded or returned).
         
     Returns:
-        A single string containing all the relevant note text, joined together.
-    """
-    # Mock FHIR data representing a patient's clinical notes.
-    fhir_data = {
-        "resourceType": "Bundle",
-        "entry": [
-            {"resource": {"text": "Patient presented with a history of recurrent headaches and migraines for 3 months."}},
-            {"resource": {"text": "Patient reports severe chest pain radiating to the left arm. Suspected myocardial infarction."}},
-            {"resource": {"text": "Treatment plan involves a regimen of beta-blockers and aspirin for the chest pain."}},
-            {"resource": {"text": "Follow-up scheduled in 2 weeks to review lab results and vitals."}},
-            {"resource": {"text": "Patient has a history of hypertension and Type 2 Diabetes."}}
-        ]
-    }
+        A list of Snippets (resource id + note text), oldest first.
+    """
+    if not keywords:
+        return []
+    return get_note_index().snippets(patient_id, keywords)
+
+def get_fhir_notes(keywords: list, patient_id: str, budget: int = SUMMARY_CONTEXT_BUDGET) -> str:
+    """
+    Pulls the patient's relevant notes and packs them into the summarizer's token budget.
     
-    relevant_notes = []
-    for entry in fhir_data['entry']:
-        note_text = entry['resource']['text'].lower()
-        # Check if any of the keywords are present in the note.
-        if any(keyword in note_text for keyword in keywords):
-            relevant_notes.append(entry['resource']['text'])
-            
-    # Join the relevant notes into a single string for summarization.
-    return " ".join(relevant_notes)
+    Args:
+        keywords: A list of keywords to filter the notes by.
+        patient_id: The patient whose notes are searched (required).
+        budget: Maximum number of BART tokens of note text to return.
+        
+    Returns:
+        The highest-value notes that fit in the budget, joined in record order.
+    """
+    snippets = get_fhir_snippets(keywords, patient_id)
+    return pack_context(snippets, tokenizer, budget, keywords=keywords, count=token_store.count).text
 
 # --- Task 4: Pipe extracted text to the summarizer model ---
-def summarize_notes(text: str) -> str:
+def summarize_notes(text: str, profile: str = None) -> str:
     """
     Uses the BART model to generate a summary of the input text.
     
     Args:
         text: A string containing the combined clinical notes.
+        profile: Decoding profile name ("fast", "balanced", "quality").
         
     Returns:
         A concise summary string.
     """
-    # Tokenize the input text. The max_length is capped to fit the model's
+    return summarize_batch([text], profile)[0]
+
+def summarize_batch(texts: list, profile: str = None) -> list:
+    """
+    Summarizes several texts in a single padded model call.
+    
+    Args:
+        texts: Strings to summarize independently.
+        profile: Decoding profile name; defaults to "quality".
+        
+    Returns:
+        One summary string per input text, in the same order.
+    """
+    # Tokenize the input texts. The max_length is capped to fit the model's
     # input size.
-    inputs = tokenizer([text], max_length=1024, return_tensors='pt', truncation=True)
+    with metrics.span(SERVICE, "tokenization"):
+        inputs = tokenizer(texts, max_length=1024, truncation=True)
+    return summarize_ids(inputs['input_ids'], plan_decoding(SERVICE, SUMMARY_MAX_LENGTH, profile))
+
+def summarize_ids(batch_ids: list, plan=None) -> list:
+    """
+    Summarizes already tokenized inputs in a single padded model call.
+    
+    Args:
+        batch_ids: One list of input token ids (special tokens included) per text.
+        plan: Decoding settings from plan_decoding(); the "quality" profile if omitted.
+        
+    Returns:
+        One summary string per input, in the same order. If the plan's
+        deadline cut generation short, each summary is trimmed back to its
+        last complete sentence and plan.stopped is set.
+    """
+    if plan is None:
+        plan = plan_decoding(SERVICE, SUMMARY_MAX_LENGTH)
+    
+    # A call with the same inputs and profile already running answers this one too,
+    # unless this call has a deadline of its own.
+    key = flight_key(MODEL_NAME, batch_ids, plan.profile.name, plan.max_length) if plan.max_time is None else None
+    summaries, plan.stopped = summarizer_flight.do(key, _generate_summaries, batch_ids, plan)
+    return list(summaries)
+
+def _generate_summaries(batch_ids: list, plan) -> tuple:
+    """One model.generate() call for summarize_ids(); returns (summaries, stopped)."""
+    # Padding lets inputs of different lengths run as one batch.
+    inputs = tokenizer.pad({'input_ids': batch_ids}, return_tensors='pt')
     
     # Generate the summary.
-    # num_beams=4: Uses beam search for better summary quality.
-    # max_length=150: Limits the output summary to a reasonable length.
-    # early_stopping=True: Stops generation when a complete sentence is formed.
-    summary_ids = model.generate(
-        inputs['input_ids'], 
-        num_beams=4, 
-        max_length=150, 
-        early_stopping=True
-    )
-    
-    # Decode the generated token IDs back into a human-readable string.
-    summary = tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-    return summary
+    # The "quality" profile is beam search (num_beams=4, max_length=150,
+    # early_stopping=True); "balanced" and "fast" use fewer beams and
+    # shorter outputs, and a deadline adds max_time.
+    with metrics.span(SERVICE, "generate"):
+        plan.started = time.perf_counter()
+        summary_ids = model.generate(
+            inputs['input_ids'], 
+            attention_mask=inputs['attention_mask'],
+            **plan.kwargs
+        )
+        plan.finish()
+    metrics.record_model_call(SERVICE, batch_size=len(batch_ids), tokens_in=int(inputs['attention_mask'].sum()),
+                              tokens_out=summary_ids.numel())
+    
+    # Decode the generated token IDs back into human-readable strings.
+    with metrics.span(SERVICE, "decode"):
+        summaries = tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
+    if plan.stopped:
+        summaries = [trim_partial(s) for s in summaries]
+    return summaries, plan.stopped
+
+def summarize_long_record(snippets: list, profile: str = None) -> dict:
+    """
+    Summarizes a record of any length with map-reduce summarization.
+    
+    Notes are chunked on note boundaries to fit BART's window, the chunks are
+    summarized in parallel batches, and the chunk summaries are summarized
+    again until a single summary remains. Chunk summaries are cached, so a
+    record that gained one note only recomputes the affected branch.
+    
+    Args:
+        snippets: The record's notes, oldest first.
+        profile: Decoding profile name; defaults to "quality".
+        
+    Returns:
+        A dictionary with the summary and how much work it took.
+    """
+    with metrics.span(SERVICE, "hierarchical_summary"):
+        result = hierarchical_summarize(
+            snippets, lambda texts: summarize_batch(texts, profile), tokenizer,
+            chunk_budget=SUMMARY_CONTEXT_BUDGET - 124,
+            params_key=f"{MODEL_NAME}|{get_profile(profile or 'quality').generate_kwargs(SUMMARY_MAX_LENGTH)}",
+        )
+    return {
+        "summary": result.summary,
+        "levels": result.levels,
+        "chunks": result.chunks,
+        "summaries_computed": result.computed,
+        "summaries_cached": result.cached,
+    }
 
 # --- Task 5: Add mock evidence suggestions ---
 def get_treatment_options() -> list:
@@ -149,42 +278,125 @@ def handle_query():
     """
     This is the main API endpoint that processes a user's query.
     It orchestrates the entire workflow from query to final response.
+    
+    Pass "timings": true in the body (or ?timings=1) to get a per-stage
+    latency breakdown in milliseconds back in the response, and
+    "mode": "hierarchical" to summarize every matching note instead of only
+    the ones that fit in one model window.
+    
+    "profile" picks the decoding profile ("fast", "balanced" or "quality",
+    the default). With "latency_budget_ms" the profile is chosen from the time
+    left and the current queue depth (never better than "profile"), and
+    generation stops early with a shorter summary if the budget runs out.
     """
+    started = time.perf_counter()
     try:
         data = request.json
         query = data.get('query')
+        patient_id = data.get('patient_id')
+        raw_budget = data.get('context_budget', SUMMARY_CONTEXT_BUDGET)
+        try:
+            if isinstance(raw_budget, (bool, float)):
+                raise ValueError
+            budget = min(int(raw_budget), SUMMARY_CONTEXT_BUDGET)
+        except (TypeError, ValueError):
+            return jsonify({"error": "'context_budget' must be an integer"}), 400
+        if budget < 1:
+            return jsonify({"error": "'context_budget' must be positive"}), 400
+        want_timings = request.args.get('timings') == '1' or bool(data.get('timings'))
+        mode = data.get('mode', 'packed')
+        if mode not in ('packed', 'hierarchical'):
+            return jsonify({"error": "'mode' must be 'packed' or 'hierarchical'"}), 400
+        profile = data.get('profile')
+        try:
+            if profile:
+                get_profile(profile)
+            deadline = deadline_from_budget(data.get('latency_budget_ms'), started)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if deadline is not None and mode == 'hierarchical':
+            # Cut-short chunk summaries would be cached as if they were complete.
+            return jsonify({"error": "'latency_budget_ms' is only supported in 'packed' mode"}), 400
         
         if not query:
             return jsonify({"error": "No 'query' key found in request body"}), 400
+        if not patient_id:
+            return jsonify({"error": "No 'patient_id' key found in request body"}), 400
         
-        # Step 1: Extract keywords from the query.
-        keywords = extract_keywords(query)
-        
-        # Step 2: Get relevant notes based on the keywords.
-        extracted_text = get_fhir_notes(keywords)
-        
-        if not extracted_text:
-            return jsonify({"error": "No relevant notes found for the given query."}), 404
-        
-        # Step 3: Summarize the extracted text.
-        summary = summarize_notes(extracted_text)
-        
-        # Step 4: Get mock treatment options with citations.
-        treatment_options = get_treatment_options()
+        with metrics.request_scope(SERVICE) as timings:
+            # Step 1: Extract keywords from the query.
+            with metrics.span(SERVICE, "keyword_extraction"):
+                keywords = extract_keywords(query)
+            
+            # Step 2: Get relevant notes based on the keywords and fill the
+            # summarizer's context window with the most relevant ones.
+            with metrics.span(SERVICE, "note_retrieval"):
+                snippets = get_fhir_snippets(keywords, patient_id)
+            
+            if not snippets:
+                return jsonify({"error": "No relevant notes found for the given query."}), 404
+            
+            # Step 3: Summarize the extracted text.
+            details = None
+            if mode == 'hierarchical':
+                details = summarize_long_record(snippets, profile)
+                decoding = {"profile": profile or 'quality', "stopped_at_deadline": False}
+                summary = details.pop("summary")
+                context_ids = [s.resource_id for s in snippets]
+            else:
+                with metrics.span(SERVICE, "context_packing"):
+                    context = pack_context(snippets, tokenizer, budget, query=query, keywords=keywords,
+                                           count=token_store.count,
+                                           separator_tokens=len(token_store.separator_ids()))
+                # The notes were tokenized at ingest time; the model input is
+                # just their stored token ids concatenated.
+                with metrics.span(SERVICE, "input_assembly"):
+                    chosen = set(context.resource_ids)
+                    input_ids = token_store.assemble([s.text for s in snippets if s.resource_id in chosen],
+                                                     max_length=1024)
+                plan = plan_decoding(SERVICE, SUMMARY_MAX_LENGTH, profile, deadline)
+                summary = summarize_ids([input_ids], plan)[0]
+                decoding = {"profile": plan.profile.name, "stopped_at_deadline": plan.stopped}
+                context_ids = context.resource_ids
+            
+            # Step 4: Get mock treatment options with citations.
+            treatment_options = get_treatment_options()
         
         # Return a structured JSON response.
-        return jsonify({
+        response = {
             "query": query,
             "summary": summary,
+            "context_resource_ids": context_ids,
+            "decoding": decoding,
             "suggested_care_options": treatment_options
-        })
+        }
+        if details:
+            response["summarization"] = details
+        if want_timings:
+            response["timings_ms"] = metrics.timings_ms(timings)
+        return jsonify(response)
         
     except Exception as e:
         # Generic error handling for unexpected issues.
         return jsonify({"error": str(e)}), 500
 
+# --- Observability ---
+@app.after_request
+def count_request(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else metrics.UNMATCHED_ENDPOINT
+    metrics.REQUESTS.inc(SERVICE, endpoint, response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Expose stage timings, queue depth, batch sizes, token counts and cache
+    hit/miss counters in Prometheus text format."""
+    return Response(metrics.render_prometheus(), mimetype=metrics.CONTENT_TYPE)
+
 # --- Start the Flask server ---
 if __name__ == '__main__':
     # Running in debug mode allows for automatic code reloading on changes.
-    # It should be set to False in a production environment.
+    # It should be set to False in a production environment; for production
+    # use `python -m backend.serve notes --workers N`, which runs pre-forked
+    # workers that share a single copy of the model.
     app.run(debug=True)
\ No newline at end of file
@@ -1,10 +1,22 @@
 import streamlit as st
 import sqlite3
 from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+import hashlib
+import os
 import pathlib
 import datetime
+import time
 import pandas as pd
 from typing import List, Dict, Any
+from backend import fhir_loading, metrics
+from backend.cohort import CohortQueryError, CohortTables
+from backend.context_packing import Snippet, TOKEN_LENGTHS, pack_context
+from backend.decoding import deadline_from_budget, plan_decoding, trim_partial
+from backend.fhir_records import load_records
+from backend.model_loading import load_pretrained
+from backend.semantic_cache import SemanticCache
+from backend.singleflight import SingleFlight, flight_key
+from backend.terminology import TerminologyIndex
 
 # ---------------------------
 # DATABASE FUNCTIONS
@@ -34,7 +46,9 @@ def init_db():
             treatment_plan TEXT,
             doctor TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            diagnosis_code TEXT,
+            diagnosis_system TEXT
         )
     """)
     
@@ -47,13 +61,35 @@ def init_db():
             response TEXT,
             model_used TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            context TEXT,
+            truncated INTEGER DEFAULT 0,
             FOREIGN KEY (username) REFERENCES users (username)
         )
     """)
     
+    # Databases created before answers were cached per patient context
+    columns = [row[1] for row in c.execute("PRAGMA table_info(ai_queries)")]
+    if "context" not in columns:
+        c.execute("ALTER TABLE ai_queries ADD COLUMN context TEXT")
+    # ... and before deadline-truncated answers were marked
+    if "truncated" not in columns:
+        c.execute("ALTER TABLE ai_queries ADD COLUMN truncated INTEGER DEFAULT 0")
+    
+    # Databases created before diagnoses were linked to FHIR codes
+    columns = [row[1] for row in c.execute("PRAGMA table_info(patients)")]
+    for column in ("diagnosis_code", "diagnosis_system"):
+        if column not in columns:
+            c.execute(f"ALTER TABLE patients ADD COLUMN {column} TEXT")
+    
     conn.commit()
     conn.close()
 
+@st.cache_resource
+def init_db_once():
+    """Create/migrate the tables once per server process instead of on every rerun"""
+    init_db()
+    return True
+
 def sign_up(username: str, password: str) -> tuple[bool, str]:
     conn = sqlite3.connect("clinic.db")
     c = conn.cursor()
@@ -74,15 +110,17 @@ def login(username: str, password: str) -> bool:
     conn.close()
     return result is not None
 
-def add_patient(name: str, age: int, gender: str, diagnosis: str, symptoms: str, treatment_plan: str, doctor: str):
+def add_patient(name: str, age: int, gender: str, diagnosis: str, symptoms: str, treatment_plan: str, doctor: str,
+                diagnosis_code: str = None, diagnosis_system: str = None):
     conn = sqlite3.connect("clinic.db")
     c = conn.cursor()
     c.execute("""
-        INSERT INTO patients (name, age, gender, diagnosis, symptoms, treatment_plan, doctor)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (name, age, gender, diagnosis, symptoms, treatment_plan, doctor))
+        INSERT INTO patients (name, age, gender, diagnosis, symptoms, treatment_plan, doctor, diagnosis_code, diagnosis_system)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (name, age, gender, diagnosis, symptoms, treatment_plan, doctor, diagnosis_code, diagnosis_system))
     conn.commit()
     conn.close()
+    cached_patients.clear()
 
 def get_patients() -> List[Dict[str, Any]]:
     conn = sqlite3.connect("clinic.db")
@@ -94,18 +132,37 @@ def get_patients() -> List[Dict[str, Any]]:
     return [{
         'id': p[0], 'name': p[1], 'age': p[2], 'gender': p[3],
         'diagnosis': p[4], 'symptoms': p[5], 'treatment_plan': p[6],
-        'doctor': p[7], 'created_at': p[8], 'updated_at': p[9]
+        'doctor': p[7], 'created_at': p[8], 'updated_at': p[9],
+        'diagnosis_code': p[10], 'diagnosis_system': p[11]
     } for p in patients]
 
-def save_ai_query(username: str, query: str, response: str, model: str):
+def save_ai_query(username: str, query: str, response: str, model: str, context: str = "", truncated: bool = False):
     conn = sqlite3.connect("clinic.db")
     c = conn.cursor()
     c.execute("""
-        INSERT INTO ai_queries (username, query, response, model_used)
-        VALUES (?, ?, ?, ?)
-    """, (username, query, response, model))
+        INSERT INTO ai_queries (username, query, response, model_used, context, truncated)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (username, query, response, model, context, int(truncated)))
     conn.commit()
     conn.close()
+    cached_ai_history.clear()
+
+def get_recent_ai_answers(limit: int) -> List[Dict[str, Any]]:
+    """Most recent complete (not deadline-truncated) answers from all users, oldest first (for warming the answer cache)"""
+    conn = sqlite3.connect("clinic.db")
+    c = conn.cursor()
+    c.execute("""
+        SELECT query, response, model_used, context, created_at, username FROM ai_queries
+        WHERE NOT COALESCE(truncated, 0)
+        ORDER BY id DESC LIMIT ?
+    """, (limit,))
+    rows = c.fetchall()
+    conn.close()
+    
+    return [{
+        'query': r[0], 'response': r[1], 'model_used': r[2], 'context': r[3] or '', 'created_at': r[4],
+        'username': r[5]
+    } for r in reversed(rows)]
 
 def get_ai_history(username: str) -> List[Dict[str, Any]]:
     conn = sqlite3.connect("clinic.db")
@@ -119,16 +176,123 @@ def get_ai_history(username: str) -> List[Dict[str, Any]]:
         'model_used': q[4], 'created_at': q[5]
     } for q in queries]
 
+# Read-through caches for the pages. Writes made through add_patient() and
+# save_ai_query() clear them; the TTL bounds staleness from other writers
+# (another server process, a script editing clinic.db).
+QUERY_CACHE_TTL_SECONDS = 60
+
+@st.cache_data(ttl=QUERY_CACHE_TTL_SECONDS, show_spinner=False)
+def cached_patients() -> List[Dict[str, Any]]:
+    return get_patients()
+
+@st.cache_data(ttl=QUERY_CACHE_TTL_SECONDS, show_spinner=False)
+def cached_ai_history(username: str) -> List[Dict[str, Any]]:
+    return get_ai_history(username)
+
 # ---------------------------
 # AI PIPELINE
 # ---------------------------
 @st.cache_resource
 def load_qa_pipeline(model_name="google/flan-t5-small"):
     """Load and cache the AI model pipeline"""
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    tokenizer, model = load_pretrained(model_name, AutoModelForSeq2SeqLM, AutoTokenizer)
     return pipeline("text2text-generation", model=model, tokenizer=tokenizer)
 
+# Name under which the app's spans and counters are reported at /metrics
+SERVICE = "streamlit_app"
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """Serve /metrics once per process when AI_CLINIC_METRICS_PORT is set"""
+    port = os.environ.get("AI_CLINIC_METRICS_PORT")
+    if port:
+        return metrics.start_metrics_server(int(port))
+    return None
+
+# Answers are reused only for the user who asked, unless set to share them
+SHARE_CACHED_ANSWERS = os.environ.get("AI_CLINIC_SEMANTIC_CACHE_SHARED") == "1"
+
+def answer_scope(model_name: str, username: str, context: str) -> str:
+    """Cached answers are only reused for the same model, user and patient record content"""
+    return f"{model_name}|{'*' if SHARE_CACHED_ANSWERS else username}|{context}"
+
+def context_fingerprint(patient: Dict[str, Any], context_ids: List[str]) -> str:
+    """Hash of the record text included in the prompt ("" without one), so an edited record gets new answers"""
+    if not context_ids:
+        return ""
+    fields = [resource_id.rsplit("#", 1)[1] for resource_id in context_ids]
+    text = "\n".join(f"{field}={patient[field]}" for field in fields)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+@st.cache_resource
+def load_semantic_cache():
+    """Process-wide near-duplicate answer cache, warmed from the ai_queries history"""
+    cache = SemanticCache.from_env()
+    for row in get_recent_ai_answers(cache.max_entries):
+        created = datetime.datetime.strptime(row['created_at'], "%Y-%m-%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc)
+        scope = answer_scope(row['model_used'], row['username'], row['context'])
+        cache.add(scope, row['query'], row['response'], created.timestamp())
+    return cache
+
+@st.cache_resource
+def load_cohort_tables():
+    """Per-patient feature tables over the FHIR data directory, built once per process"""
+    if not os.path.isdir(fhir_loading.DATA_DIR):
+        return None
+    return CohortTables.from_records(load_records())
+
+@st.cache_resource
+def load_terminology():
+    """Codes and displays from the FHIR data directory, for diagnosis autocomplete and code search"""
+    if not os.path.isdir(fhir_loading.DATA_DIR):
+        return TerminologyIndex()
+    return TerminologyIndex.from_directory()
+
+@st.cache_resource
+def load_answer_flight():
+    """Process-wide coalescing of identical assistant prompts generated at the same time"""
+    return SingleFlight(SERVICE)
+
+# Token budget for the patient record included in an assistant prompt
+PATIENT_CONTEXT_BUDGET = 384
+
+PATIENT_CONTEXT_FIELDS = [
+    ("diagnosis", "Diagnosis"),
+    ("symptoms", "Symptoms"),
+    ("treatment_plan", "Treatment plan"),
+    ("age", "Age"),
+    ("gender", "Gender"),
+]
+
+def build_prompt(query: str, patient: Dict[str, Any], tokenizer, budget: int = PATIENT_CONTEXT_BUDGET) -> tuple[str, List[str]]:
+    """Build the assistant prompt, packing as much of the patient's record as fits the budget.
+    Returns the prompt and the ids of the record fields that were included."""
+    prompt = f"Medical Query: {query}"
+    if not patient:
+        return prompt, []
+    snippets = [
+        Snippet(f"patients/{patient['id']}#{field}", f"{label}: {patient[field]}.")
+        for field, label in PATIENT_CONTEXT_FIELDS if patient.get(field)
+    ]
+    room = tokenizer.model_max_length - TOKEN_LENGTHS.count(tokenizer, prompt) - TOKEN_LENGTHS.count(tokenizer, "Patient context:")
+    context = pack_context(snippets, tokenizer, min(budget, room), query=query)
+    if not context.text:
+        return prompt, []
+    return f"Patient context: {context.text}\n{prompt}", context.resource_ids
+
+# Output length limit for assistant answers
+ANSWER_MAX_LENGTH = 300
+
+# Decoding profiles offered in the assistant (see backend/decoding.py).
+# "deadline" picks fast/balanced/quality from the latency budget and load.
+DECODING_CHOICES = {
+    "sampled": "Sampled (default, varied answers)",
+    "fast": "Fast (greedy, shorter)",
+    "balanced": "Balanced (2 beams)",
+    "quality": "High quality (4 beams)",
+    "deadline": "Deadline (fit a latency budget)",
+}
+
 # Available models
 AVAILABLE_MODELS = {
     "google/flan-t5-small": "FLAN-T5 Small (Fast, General Purpose)",
@@ -277,12 +441,36 @@ def load_custom_css():
     </style>
     """, unsafe_allow_html=True)
 
+# ---------------------------
+# RENDERING HELPERS
+# ---------------------------
+# Widgets inside a fragment rerun only the fragment, not the whole script.
+# st.fragment needs Streamlit 1.37 (1.33 had it as experimental_fragment);
+# on older versions the decorator is a no-op and interactions rerun the page.
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+PAGE_SIZES = [10, 25, 50, 100]
+
+def paginate(items, key: str):
+    """Render page controls and return only the current page of items, so long lists cost one page per rerun"""
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        page_size = st.selectbox("Per page", PAGE_SIZES, key=f"{key}_page_size")
+    pages = max(1, -(-len(items) // page_size))
+    # A filter or page size change can leave the stored page past the end
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = 1
+    with col2:
+        page = st.number_input("Page", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    start = (page - 1) * page_size
+    with col3:
+        st.caption(f"Showing {min(start + 1, len(items))}–{min(start + page_size, len(items))} of {len(items)}")
+    return items[start:start + page_size]
+
 # ---------------------------
 # LOGIN PAGE
 # ---------------------------
 def show_login_page():
-    load_custom_css()
-    
     # Main header
     st.markdown("""
     <div class='main-header'>
@@ -346,8 +534,6 @@ def show_login_page():
 # DASHBOARD COMPONENTS
 # ---------------------------
 def show_dashboard():
-    load_custom_css()
-    
     # User badge
     st.markdown(f"<div class='user-badge'>👤 {st.session_state.username}</div>", unsafe_allow_html=True)
     
@@ -359,8 +545,8 @@ def show_dashboard():
     """, unsafe_allow_html=True)
     
     # Statistics
-    patients = get_patients()
-    ai_history = get_ai_history(st.session_state.username)
+    patients = cached_patients()
+    ai_history = cached_ai_history(st.session_state.username)
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -426,54 +612,29 @@ def show_dashboard():
             """, unsafe_allow_html=True)
 
 def show_patients_page():
-    load_custom_css()
-    
     st.markdown("# 🧑‍⚕️ Patient Management")
     
     tab1, tab2 = st.tabs(["📋 Patient List", "➕ Add New Patient"])
     
     with tab1:
-        patients = get_patients()
-        
-        if patients:
-            st.markdown(f"### 👥 Total Patients: {len(patients)}")
-            
-            # Search and filter
-            col1, col2 = st.columns([3, 1])
-            with col1:
-                search = st.text_input("🔍 Search patients", placeholder="Search by name, diagnosis...")
-            with col2:
-                gender_filter = st.selectbox("Filter by Gender", ["All", "Male", "Female", "Other"])
-            
-            # Filter patients
-            filtered_patients = patients
-            if search:
-                filtered_patients = [p for p in patients if 
-                                   search.lower() in p['name'].lower() or 
-                                   search.lower() in str(p['diagnosis']).lower()]
-            
-            if gender_filter != "All":
-                filtered_patients = [p for p in filtered_patients if p['gender'] == gender_filter]
-            
-            # Display patients
-            for patient in filtered_patients:
-                with st.expander(f"👤 {patient['name']} - Age {patient['age']} ({patient['gender']})"):
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.write(f"**📋 Diagnosis:** {patient['diagnosis']}")
-                        st.write(f"**🩺 Doctor:** {patient['doctor']}")
-                        st.write(f"**📅 Added:** {patient['created_at']}")
-                    
-                    with col2:
-                        st.write(f"**🤒 Symptoms:** {patient['symptoms']}")
-                        st.write(f"**💊 Treatment:** {patient['treatment_plan']}")
-        else:
-            st.info("No patients found. Add your first patient using the 'Add New Patient' tab.")
+        show_patient_list()
     
     with tab2:
         st.markdown("### ➕ Add New Patient")
         
+        # Diagnosis lookup against the codes used in the FHIR data (outside the
+        # form, which would otherwise only react on submit)
+        terms = load_terminology()
+        term_search = st.text_input("🔎 Look up diagnosis", placeholder="Start typing a condition or SNOMED code...")
+        picked = None
+        if term_search:
+            matches = terms.complete(term_search, limit=10, resource_type="Condition")
+            if matches:
+                picked = st.selectbox("Matching conditions", [None] + matches,
+                                      format_func=lambda c: "Keep typed text" if c is None else c.label())
+            else:
+                st.caption("No coded condition matches; the diagnosis will be stored as free text.")
+        
         with st.form("add_patient"):
             col1, col2 = st.columns(2)
             
@@ -484,22 +645,71 @@ def show_patients_page():
             
             with col2:
                 doctor = st.text_input("🩺 Doctor*", placeholder="Dr. Name")
-                diagnosis = st.text_input("📋 Diagnosis*", placeholder="Primary diagnosis")
+                diagnosis = st.text_input("📋 Diagnosis*", value=picked.short_display if picked else "",
+                                          placeholder="Primary diagnosis")
             
             symptoms = st.text_area("🤒 Symptoms", placeholder="List of symptoms...")
             treatment_plan = st.text_area("💊 Treatment Plan", placeholder="Prescribed treatment...")
             
             if st.form_submit_button("✅ Add Patient", type="primary"):
                 if name and age and gender and doctor and diagnosis:
-                    add_patient(name, age, gender, diagnosis, symptoms, treatment_plan, doctor)
+                    # Keep the code picked in the lookup unless the text was edited
+                    # afterwards; free text is linked to the code with the same name
+                    if picked is not None and diagnosis == picked.short_display:
+                        concept = picked
+                    else:
+                        concept = terms.match_name(diagnosis, "Condition")
+                    add_patient(name, age, gender, diagnosis, symptoms, treatment_plan, doctor,
+                                concept.code if concept else None, concept.system if concept else None)
                     st.success(f"✅ Patient {name} added successfully!")
                     st.rerun()
                 else:
                     st.error("⚠️ Please fill in all required fields (marked with *)")
 
-def show_ai_assistant_page():
-    load_custom_css()
+@fragment
+def show_patient_list():
+    patients = cached_patients()
     
+    if patients:
+        st.markdown(f"### 👥 Total Patients: {len(patients)}")
+        
+        # Search and filter
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            search = st.text_input("🔍 Search patients", placeholder="Search by name, diagnosis or code...")
+        with col2:
+            gender_filter = st.selectbox("Filter by Gender", ["All", "Male", "Female", "Other"])
+        
+        # Filter patients; a search also matches coded diagnoses by code or term
+        filtered_patients = patients
+        if search:
+            codes = load_terminology().codes_for(search, "Condition")
+            filtered_patients = [p for p in patients if 
+                               search.lower() in p['name'].lower() or 
+                               search.lower() in str(p['diagnosis']).lower() or
+                               p['diagnosis_code'] in codes]
+        
+        if gender_filter != "All":
+            filtered_patients = [p for p in filtered_patients if p['gender'] == gender_filter]
+        
+        # Display one page of patients
+        for patient in paginate(filtered_patients, "patient_list"):
+            with st.expander(f"👤 {patient['name']} - Age {patient['age']} ({patient['gender']})"):
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    code = f" `{patient['diagnosis_code']}`" if patient['diagnosis_code'] else ""
+                    st.write(f"**📋 Diagnosis:** {patient['diagnosis']}{code}")
+                    st.write(f"**🩺 Doctor:** {patient['doctor']}")
+                    st.write(f"**📅 Added:** {patient['created_at']}")
+                
+                with col2:
+                    st.write(f"**🤒 Symptoms:** {patient['symptoms']}")
+                    st.write(f"**💊 Treatment:** {patient['treatment_plan']}")
+    else:
+        st.info("No patients found. Add your first patient using the 'Add New Patient' tab.")
+
+def show_ai_assistant_page():
     st.markdown("# 🤖 AI Medical Assistant")
     
     # Model selection
@@ -520,6 +730,16 @@ def show_ai_assistant_page():
         </div>
         """, unsafe_allow_html=True)
         
+        decoding_choice = st.selectbox(
+            "Decoding profile:",
+            list(DECODING_CHOICES.keys()),
+            format_func=lambda x: DECODING_CHOICES[x],
+            help="Trade answer quality for speed"
+        )
+        latency_budget_ms = None
+        if decoding_choice == "deadline":
+            latency_budget_ms = st.number_input("Latency budget (ms):", min_value=100, max_value=60000, value=2000, step=100)
+        
         # Load selected model
         if 'current_model' not in st.session_state or st.session_state.current_model != selected_model:
             with st.spinner(f"Loading {selected_model}..."):
@@ -527,71 +747,137 @@ def show_ai_assistant_page():
                 st.session_state.current_model = selected_model
     
     with col1:
-        st.markdown("### 💬 Ask the AI Assistant")
-        
-        # Quick templates
-        st.markdown("**📝 Quick Templates:**")
-        template_col1, template_col2 = st.columns(2)
-        
-        with template_col1:
-            if st.button("🤒 Symptom Analysis"):
-                st.session_state.query_template = "Analyze these symptoms and suggest possible conditions: "
-        
-        with template_col2:
-            if st.button("💊 Treatment Options"):
-                st.session_state.query_template = "What are the treatment options for: "
-        
-        # Query input
-        query = st.text_area(
-            "Enter your medical query:",
-            value=st.session_state.get('query_template', ''),
-            height=100,
-            placeholder="Ask about symptoms, treatments, medical conditions, drug interactions..."
-        )
-        
-        col_btn1, col_btn2 = st.columns(2)
-        with col_btn1:
-            ask_button = st.button("🔍 Get AI Response", type="primary", use_container_width=True)
-        
-        with col_btn2:
-            clear_button = st.button("🗑️ Clear", use_container_width=True)
-            if clear_button:
-                st.session_state.query_template = ''
-                st.rerun()
-        
-        if ask_button and query.strip():
-            with st.spinner("🤖 AI is thinking..."):
-                try:
-                    result = st.session_state.qa_pipeline(
-                        f"Medical Query: {query}",
-                        max_length=300,
-                        do_sample=True,
-                        temperature=0.7
-                    )
-                    response = result[0]['generated_text']
-                    
-                    # Save to history
-                    save_ai_query(st.session_state.username, query, response, selected_model)
-                    
-                    # Display response
-                    st.markdown(f"""
-                    <div class='ai-response'>
-                        <h4>🤖 AI Response:</h4>
-                        <p>{response}</p>
-                        <small>Model: {selected_model} | Time: {datetime.datetime.now().strftime('%H:%M:%S')}</small>
-                    </div>
-                    """, unsafe_allow_html=True)
+        show_ai_consultation(selected_model, decoding_choice, latency_budget_ms)
+
+@fragment
+def show_ai_consultation(selected_model: str, decoding_choice: str, latency_budget_ms):
+    """Query form, answer and history; asking reruns only this part of the page"""
+    st.markdown("### 💬 Ask the AI Assistant")
+    
+    # Quick templates
+    st.markdown("**📝 Quick Templates:**")
+    template_col1, template_col2 = st.columns(2)
+    
+    with template_col1:
+        if st.button("🤒 Symptom Analysis"):
+            st.session_state.query_template = "Analyze these symptoms and suggest possible conditions: "
+    
+    with template_col2:
+        if st.button("💊 Treatment Options"):
+            st.session_state.query_template = "What are the treatment options for: "
+    
+    # Query input
+    query = st.text_area(
+        "Enter your medical query:",
+        value=st.session_state.get('query_template', ''),
+        height=100,
+        placeholder="Ask about symptoms, treatments, medical conditions, drug interactions..."
+    )
+    
+    # Optional patient record to ground the answer in
+    patient_options = {"None": None}
+    patient_options.update({f"{p['name']} (#{p['id']})": p for p in cached_patients()})
+    context_patient = patient_options[st.selectbox("🧑‍⚕️ Patient context (optional):", list(patient_options))]
+    
+    show_timings = st.checkbox("⏱️ Show timing breakdown", value=False)
+    
+    col_btn1, col_btn2 = st.columns(2)
+    with col_btn1:
+        ask_button = st.button("🔍 Get AI Response", type="primary", use_container_width=True)
+    
+    with col_btn2:
+        clear_button = st.button("🗑️ Clear", use_container_width=True)
+        if clear_button:
+            st.session_state.query_template = ''
+            st.rerun()
+    
+    if ask_button and query.strip():
+        with st.spinner("🤖 AI is thinking..."):
+            try:
+                qa = st.session_state.qa_pipeline
+                answer_cache = load_semantic_cache()
+                deadline = deadline_from_budget(latency_budget_ms)
+                plan = None
+                with metrics.request_scope(SERVICE) as timings:
+                    with metrics.span(SERVICE, "context_packing"):
+                        prompt, context_ids = build_prompt(query, context_patient, qa.tokenizer)
+                    context_key = context_fingerprint(context_patient, context_ids)
+                    scope = answer_scope(selected_model, st.session_state.username, context_key)
                     
-                    st.warning("⚠️ **Disclaimer:** This AI response is for informational purposes only and should not replace professional medical advice.")
+                    # A near-duplicate of an earlier question gets the earlier answer
+                    cache_hit = None
+                    if st.session_state.get('semantic_cache_enabled', True):
+                        with metrics.span(SERVICE, "semantic_cache"):
+                            cache_hit = answer_cache.lookup(scope, query)
                     
-                except Exception as e:
-                    st.error(f"❌ Error generating response: {str(e)}")
+                    if cache_hit:
+                        response = cache_hit.response
+                    else:
+                        profile = "quality" if decoding_choice == "deadline" else decoding_choice
+                        # Deterministic mode never samples, so the same question gets the same answer
+                        if profile == "sampled" and st.session_state.get('deterministic_answers', False):
+                            profile = "greedy"
+                        plan = plan_decoding(SERVICE, ANSWER_MAX_LENGTH, profile, deadline)
+                        
+                        def generate():
+                            with metrics.span(SERVICE, "generate"):
+                                plan.started = time.perf_counter()
+                                result = qa(prompt, **plan.kwargs)
+                                plan.finish()
+                            text = result[0]['generated_text']
+                            if plan.stopped:
+                                text = trim_partial(text)
+                            metrics.record_model_call(SERVICE, batch_size=1,
+                                                      tokens_in=len(qa.tokenizer(prompt)["input_ids"]),
+                                                      tokens_out=len(qa.tokenizer(text)["input_ids"]))
+                            # Deadline-truncated answers are not reused
+                            answer_cache.add(scope, query, text, truncated=plan.stopped)
+                            return text, plan.stopped
+                        
+                        # Someone else asking the same prompt right now shares this generation
+                        # (not under a deadline, which is the asker's own)
+                        key = flight_key(selected_model, prompt, plan.profile.name) if plan.max_time is None else None
+                        response, plan.stopped = load_answer_flight().do(key, generate)
+                        
+                        # Save to history
+                        with metrics.span(SERVICE, "save_history"):
+                            save_ai_query(st.session_state.username, query, response, selected_model,
+                                          context_key, truncated=plan.stopped)
+                
+                # Display response
+                cached_note = " | ⚡ Cached" if cache_hit else ""
+                st.markdown(f"""
+                <div class='ai-response'>
+                    <h4>🤖 AI Response:</h4>
+                    <p>{response}</p>
+                    <small>Model: {selected_model} | Time: {datetime.datetime.now().strftime('%H:%M:%S')}{cached_note}</small>
+                </div>
+                """, unsafe_allow_html=True)
+                
+                if cache_hit:
+                    st.caption(f"⚡ Cached answer to a similar earlier question (similarity {cache_hit.similarity:.2f}): "
+                               f"\"{cache_hit.query}\"")
+                
+                st.warning("⚠️ **Disclaimer:** This AI response is for informational purposes only and should not replace professional medical advice.")
+                
+                if context_ids:
+                    st.caption(f"📎 Patient context used: {', '.join(context_ids)}")
+                
+                if plan and decoding_choice == "deadline":
+                    note = " (stopped early to meet the deadline)" if plan.stopped else ""
+                    st.caption(f"⏱️ Decoding profile: {plan.profile.name}{note}")
+                
+                if show_timings:
+                    st.json(metrics.timings_ms(timings))
+            
+            except Exception as e:
+                st.error(f"❌ Error generating response: {str(e)}")
     
     # AI History
     st.markdown("---")
     st.markdown("### 📚 Recent AI Consultations")
     
-    history = get_ai_history(st.session_state.username)
+    history = cached_ai_history(st.session_state.username)
     if history:
         for i, item in enumerate(history[:5]):  # Show last 5
             with st.expander(f"🔍 Query {i+1}: {item['query'][:50]}..."):
@@ -603,11 +889,9 @@ def show_ai_assistant_page():
         st.info("No AI consultation history found.")
 
 def show_records_page():
-    load_custom_css()
-    
     st.markdown("# 📋 Medical Records")
     
-    patients = get_patients()
+    patients = cached_patients()
     
     if patients:
         # Convert to DataFrame for better display
@@ -628,46 +912,78 @@ def show_records_page():
             common_diagnosis = df['diagnosis'].mode().iloc[0] if 'diagnosis' in df.columns and len(df) > 0 else "N/A"
             st.metric("🏆 Most Common Diagnosis", common_diagnosis)
         
-        # Detailed records table
-        st.markdown("### 📄 Detailed Records")
-        
-        # Display options
-        col1, col2 = st.columns(2)
-        with col1:
-            view_mode = st.radio("View Mode:", ["📊 Table View", "📋 Card View"], horizontal=True)
-        
-        with col2:
-            sort_by = st.selectbox("Sort by:", ["created_at", "name", "age", "diagnosis"])
-        
-        # Sort dataframe
-        df_sorted = df.sort_values(sort_by, ascending=False)
-        
-        if view_mode == "📊 Table View":
-            st.dataframe(
-                df_sorted[['name', 'age', 'gender', 'diagnosis', 'doctor', 'created_at']],
-                use_container_width=True
-            )
-        else:
-            # Card view
-            for _, patient in df_sorted.iterrows():
-                st.markdown(f"""
-                <div class='patient-card'>
-                    <h4>👤 {patient['name']}</h4>
-                    <p><strong>Age:</strong> {patient['age']} | <strong>Gender:</strong> {patient['gender']}</p>
-                    <p><strong>Diagnosis:</strong> {patient['diagnosis']}</p>
-                    <p><strong>Doctor:</strong> {patient['doctor']}</p>
-                    <p><strong>Added:</strong> {patient['created_at']}</p>
-                </div>
-                """, unsafe_allow_html=True)
+        show_detailed_records(df)
     else:
         st.info("📝 No medical records found. Add patients to see their records here.")
 
-def show_settings_page():
-    load_custom_css()
+    show_cohort_query()
+
+@fragment
+def show_detailed_records(df: pd.DataFrame):
+    st.markdown("### 📄 Detailed Records")
+    
+    # Display options
+    col1, col2 = st.columns(2)
+    with col1:
+        view_mode = st.radio("View Mode:", ["📊 Table View", "📋 Card View"], horizontal=True)
     
+    with col2:
+        sort_by = st.selectbox("Sort by:", ["created_at", "name", "age", "diagnosis"])
+    
+    # Sort dataframe
+    df_sorted = df.sort_values(sort_by, ascending=False)
+    
+    if view_mode == "📊 Table View":
+        # st.dataframe only draws the rows in view
+        st.dataframe(
+            df_sorted[['name', 'age', 'gender', 'diagnosis', 'doctor', 'created_at']],
+            use_container_width=True
+        )
+    else:
+        # Card view, one page at a time
+        for patient in paginate(df_sorted, "record_cards").to_dict("records"):
+            st.markdown(f"""
+            <div class='patient-card'>
+                <h4>👤 {patient['name']}</h4>
+                <p><strong>Age:</strong> {patient['age']} | <strong>Gender:</strong> {patient['gender']}</p>
+                <p><strong>Diagnosis:</strong> {patient['diagnosis']}</p>
+                <p><strong>Doctor:</strong> {patient['doctor']}</p>
+                <p><strong>Added:</strong> {patient['created_at']}</p>
+            </div>
+            """, unsafe_allow_html=True)
+
+@fragment
+def show_cohort_query():
+    st.markdown("### 🔎 Cohort Query")
+    tables = load_cohort_tables()
+    if tables is None:
+        st.info(f"No FHIR data found in '{fhir_loading.DATA_DIR}'.")
+        return
+    expression = st.text_input(
+        "Find patients matching:",
+        placeholder='condition("diabetes") and lab("a1c") > 9 and not medication("metformin")',
+        help="condition(\"...\"), medication(\"...\") (active), lab(\"...\") (latest value), age, gender, deceased; "
+             "combine with and / or / not"
+    )
+    if not expression:
+        st.caption(f"{len(tables)} FHIR patients loaded.")
+        return
+    start = time.perf_counter()
+    try:
+        cohort = tables.query(expression)
+    except CohortQueryError as e:
+        st.error(f"❌ {e}")
+        return
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    st.metric("👥 Matching Patients", f"{cohort.count} of {len(tables)}")
+    st.caption(f"Query took {elapsed_ms:.1f} ms")
+    if cohort.count:
+        st.dataframe(pd.DataFrame({"patient_id": cohort.patient_ids(limit=1000)}), use_container_width=True)
+
+def show_settings_page():
     st.markdown("# ⚙️ Settings")
     
-    tab1, tab2, tab3 = st.tabs(["👤 Profile", "🤖 AI Models", "🔐 Security"])
+    tab1, tab2, tab3, tab4 = st.tabs(["👤 Profile", "🤖 AI Models", "⚡ Answer Cache", "🔐 Security"])
     
     with tab1:
         st.markdown("### 👤 User Profile")
@@ -691,6 +1007,32 @@ def show_settings_page():
             """, unsafe_allow_html=True)
     
     with tab3:
+        st.markdown("### ⚡ Answer Cache")
+        st.info("Near-duplicates of your earlier questions to the same model (about the same patient record, with the same numbers, negations and clinical terms) reuse the earlier answer instead of generating a new one.")
+        answer_cache = load_semantic_cache()
+        
+        st.session_state.semantic_cache_enabled = st.checkbox(
+            "Reuse answers to similar questions", value=st.session_state.get('semantic_cache_enabled', True))
+        st.session_state.deterministic_answers = st.checkbox(
+            "Deterministic answers (no sampling)", value=st.session_state.get('deterministic_answers', False),
+            help="Generate greedily so repeated questions get identical answers")
+        
+        threshold = st.slider("Similarity threshold", 0.5, 1.0, float(answer_cache.threshold), 0.01)
+        max_entries = st.number_input("Max cached answers", min_value=10, max_value=100000, value=answer_cache.max_entries, step=100)
+        ttl_hours = st.number_input("Expire after (hours)", min_value=1, max_value=24 * 365, value=int(answer_cache.ttl_seconds // 3600))
+        answer_cache.configure(threshold=threshold, max_entries=int(max_entries), ttl_seconds=ttl_hours * 3600)
+        
+        st.caption(f"{len(answer_cache)} answers cached · "
+                   f"{load_answer_flight().saved()} generations saved by joining an identical one in progress")
+        col_inv1, col_inv2 = st.columns(2)
+        with col_inv1:
+            invalidate_model = st.selectbox("Model", ["All models"] + list(AVAILABLE_MODELS.keys()))
+        with col_inv2:
+            if st.button("🗑️ Invalidate cached answers"):
+                dropped = answer_cache.invalidate(None if invalidate_model == "All models" else f"{invalidate_model}|")
+                st.success(f"Dropped {dropped} cached answers")
+    
+    with tab4:
         st.markdown("### 🔐 Security Settings")
         st.warning("🔒 Your session is secure and encrypted.")
         st.info("💾 All patient data is stored locally and encrypted.")
@@ -712,8 +1054,15 @@ def main():
         initial_sidebar_state="collapsed"
     )
     
-    # Initialize database
-    init_db()
+    # Styles are injected from this one place, once per script run, rather
+    # than by every page. Fragment reruns don't reach here at all; a
+    # session_state guard would drop them, because Streamlit removes elements
+    # a full rerun doesn't render again
+    load_custom_css()
+    
+    # Initialize database (once per process)
+    init_db_once()
+    start_metrics_endpoint()
     
     # Initialize session state
     if "logged_in" not in st.session_state:
@@ -0,0 +1,163 @@
+import base64
+import binascii
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import List
+
+from backend import metrics
+from backend.context_packing import Snippet
+from backend.fhir_loading import reference_id
+
+# Clinical narrative in Synthea bundles lives in base64 DocumentReference
+# attachments. Note metadata is indexed eagerly; the text is only decoded the
+# first time it is needed and then kept in a shared, size-bounded cache.
+
+
+@dataclass
+class NoteMeta:
+    note_id: str
+    patient_id: str
+    date: str
+    note_type: str
+    encounter_id: str
+    content_type: str
+    _data: str  # still-encoded attachment payload
+
+    @property
+    def encoded_size(self) -> int:
+        return len(self._data)
+
+
+class NoteTextCache:
+    """LRU of note id -> decoded text, bounded by total characters held."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._texts = OrderedDict()
+        self._lock = threading.Lock()
+        # Striped locks so two threads asking for the same note decode it once.
+        self._decode_locks = [threading.Lock() for _ in range(64)]
+
+    def get_or_decode(self, note: NoteMeta) -> str:
+        text = self._get(note.note_id)
+        if text is not None:
+            metrics.record_cache("note_text", True)
+            return text
+        with self._decode_locks[hash(note.note_id) % len(self._decode_locks)]:
+            text = self._get(note.note_id)
+            metrics.record_cache("note_text", text is not None)
+            if text is None:
+                text = decode_attachment(note._data)
+                self._put(note.note_id, text)
+        return text
+
+    def _get(self, key: str):
+        with self._lock:
+            text = self._texts.get(key)
+            if text is not None:
+                self._texts.move_to_end(key)
+            return text
+
+    def _put(self, key: str, text: str):
+        if len(text) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._texts:
+                return
+            self._texts[key] = text
+            self.size += len(text)
+            while self.size > self.max_bytes:
+                _, evicted = self._texts.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._texts
+
+    def clear(self):
+        with self._lock:
+            self._texts.clear()
+            self.size = 0
+
+
+NOTE_TEXT_CACHE = NoteTextCache(int(os.environ.get("AI_CLINIC_NOTE_CACHE_MB", 64)) * 1024 * 1024)
+
+
+def decode_attachment(data: str) -> str:
+    try:
+        return base64.b64decode(data).decode("utf-8", errors="replace")
+    except (binascii.Error, ValueError):
+        return ""
+
+
+class NoteIndex:
+    """Metadata index over DocumentReference notes; text is decoded on demand."""
+
+    def __init__(self, cache: NoteTextCache = NOTE_TEXT_CACHE):
+        self.cache = cache
+        self._notes = {}
+        self._by_patient = defaultdict(list)
+
+    @classmethod
+    def from_bundle(cls, bundle: dict, cache: NoteTextCache = NOTE_TEXT_CACHE) -> "NoteIndex":
+        index = cls(cache)
+        for entry in bundle.get("entry", []):
+            index.add(entry.get("resource", {}))
+        return index
+
+    def add(self, resource: dict):
+        if resource.get("resourceType") != "DocumentReference":
+            return
+        attachment = next((c.get("attachment", {}) for c in resource.get("content", [])
+                           if c.get("attachment", {}).get("data")), None)
+        if attachment is None:
+            return
+        context = resource.get("context", {})
+        doc_type = resource.get("type", {})
+        codings = doc_type.get("coding") or [{}]
+        encounters = context.get("encounter") or [{}]
+        note = NoteMeta(
+            note_id=resource.get("id"),
+            patient_id=reference_id(resource.get("subject", {}).get("reference")),
+            date=resource.get("date") or context.get("period", {}).get("start", ""),
+            note_type=doc_type.get("text") or codings[0].get("display", "Clinical note"),
+            encounter_id=reference_id(encounters[0].get("reference")),
+            content_type=attachment.get("contentType", "text/plain"),
+            _data=attachment["data"],
+        )
+        if note.note_id not in self._notes:
+            self._by_patient[note.patient_id].append(note)
+        self._notes[note.note_id] = note
+
+    def list_notes(self, patient_id: str = None) -> List[NoteMeta]:
+        """Notes oldest first, without decoding anything."""
+        notes = self._by_patient.get(patient_id, []) if patient_id else list(self._notes.values())
+        return sorted(notes, key=lambda n: n.date)
+
+    def get(self, note_id: str) -> NoteMeta:
+        return self._notes.get(note_id)
+
+    def text(self, note_id: str) -> str:
+        return self.cache.get_or_decode(self._notes[note_id])
+
+    def snippets(self, patient_id: str, keywords: List[str] = None) -> List[Snippet]:
+        """One patient's notes as Snippets (oldest first), optionally only those mentioning a keyword.
+
+        Notes are selected by patient from the metadata first, so only that
+        patient's notes are ever decoded.
+        """
+        if not patient_id:
+            raise ValueError("patient_id is required")
+        phrases = [k.lower() for k in (keywords or [])]
+        found = []
+        for note in self.list_notes(patient_id):
+            text = self.text(note.note_id)
+            if phrases and not any(p in text.lower() for p in phrases):
+                continue
+            found.append(Snippet(f"DocumentReference/{note.note_id}", text.strip()))
+        return found
+
+    def __len__(self):
+        return len(self._notes)
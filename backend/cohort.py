@@ -0,0 +1,272 @@
+import ast
+import datetime
+import operator
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+from backend.fhir_records import (ConditionRecord, MedicationRequestRecord, ObservationRecord, PatientRecord,
+                                  RecordSet)
+
+# Population queries over every loaded patient.
+#
+# The records are turned once into columnar tables with one row per patient:
+# demographics as arrays, each condition and each active medication as a
+# packed bitmap (one bit per patient), and each lab as the sparse
+# (patient, latest value) pairs of the patients that have it. A query such as
+#
+#     condition("diabetes") and lab("a1c") > 9 and not medication("metformin")
+#
+# is parsed with ast (only the forms below are allowed, nothing is evaluated as
+# Python) and compiled into bitmap and/or/not and vectorized comparisons, so
+# its cost depends on the number of patients and terms, not on the number of
+# resources behind them.
+#
+#   condition("term")           unresolved condition whose display contains term (or whose code is term)
+#   medication("term")          active medication request matching term
+#   lab("term") <op> number     latest value of a matching observation; lab("term") alone: has one
+#   age, gender, deceased       demographics; compare with <, <=, >, >=, ==, !=
+#   and, or, not, parentheses
+
+_COMPARISONS = {
+    ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+}
+# a < x  ->  x > a
+_FLIPPED = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq, ast.NotEq: ast.NotEq}
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class CohortQueryError(ValueError):
+    pass
+
+
+def _normalize(term: str) -> str:
+    return " ".join(term.lower().split())
+
+
+class CohortTables:
+    """Columnar per-patient features for cohort queries."""
+
+    def __init__(self, patient_ids: list, birth_dates: list, genders: list, deceased: list,
+                 conditions: dict, medications: dict, labs: dict, as_of: datetime.date = None):
+        """
+        Args:
+            patient_ids: Row order of every table.
+            conditions, medications: key -> list of row numbers.
+            labs: key -> {row: (timestamp, value)} (latest per patient).
+            as_of: Date ages are computed at (default: today).
+        """
+        self.patient_ids = np.array(patient_ids, dtype=object)
+        self.size = len(patient_ids)
+        as_of = as_of or datetime.date.today()
+        self.age = np.array([(as_of - b).days / 365.25 if b else np.nan for b in birth_dates], dtype=np.float64)
+        self.gender = np.array([g or "" for g in genders], dtype=str)
+        self.deceased = np.array(deceased, dtype=bool)
+        self._all = self._pack(np.ones(self.size, dtype=bool))
+        self._conditions = {key: self._from_rows(rows) for key, rows in conditions.items()}
+        self._medications = {key: self._from_rows(rows) for key, rows in medications.items()}
+        self._labs = {}
+        for key, latest in labs.items():
+            rows = np.fromiter(latest.keys(), dtype=np.int64, count=len(latest))
+            times = np.fromiter((t for t, _ in latest.values()), dtype=np.float64, count=len(latest))
+            values = np.fromiter((v for _, v in latest.values()), dtype=np.float64, count=len(latest))
+            self._labs[key] = (rows, times, values)
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_records(cls, records: RecordSet, as_of: datetime.date = None) -> "CohortTables":
+        rows = {}
+        birth_dates, genders, deceased = [], [], []
+        for patient_id, patient_records in records.by_patient.items():
+            if patient_id is None:
+                continue
+            rows[patient_id] = len(rows)
+            patient = next((r for r in patient_records if isinstance(r, PatientRecord)), None)
+            birth_dates.append(patient.birth_date if patient else None)
+            genders.append(patient.gender if patient else None)
+            deceased.append(bool(patient and patient.deceased))
+        conditions, medications, labs = defaultdict(set), defaultdict(set), defaultdict(dict)
+        for r in records.records:
+            row = rows.get(r.patient_id)
+            if row is None:
+                continue
+            if isinstance(r, ConditionRecord) and r.abatement is None:
+                for key in filter(None, (r.display, r.code)):
+                    conditions[_normalize(key)].add(row)
+            elif isinstance(r, MedicationRequestRecord) and r.status == "active":
+                for key in filter(None, (r.display, r.code)):
+                    medications[_normalize(key)].add(row)
+            elif isinstance(r, ObservationRecord) and isinstance(r.value, (int, float)) and r.display:
+                when = r.effective.timestamp() if r.effective else float("-inf")
+                for key in filter(None, (r.display, r.code)):
+                    latest = labs[_normalize(key)]
+                    if row not in latest or when >= latest[row][0]:
+                        latest[row] = (when, float(r.value))
+        return cls(list(rows), birth_dates, genders, deceased,
+                   {k: sorted(v) for k, v in conditions.items()}, {k: sorted(v) for k, v in medications.items()},
+                   labs, as_of)
+
+    # --- bitmaps ---
+
+    def _pack(self, mask: np.ndarray) -> np.ndarray:
+        return np.packbits(mask)
+
+    def _from_rows(self, rows) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        mask[np.asarray(rows, dtype=np.int64)] = True
+        return self._pack(mask)
+
+    def _union(self, table: dict, term: str) -> np.ndarray:
+        term = _normalize(term)
+        bitmap = np.zeros_like(self._all)
+        for key, keyed in table.items():
+            if term in key:
+                bitmap |= keyed
+        return bitmap
+
+    def _lab(self, term: str) -> tuple:
+        """(rows, values) of the latest observation per patient across every lab matching term."""
+        term = _normalize(term)
+        matches = [self._labs[key] for key in self._labs if term in key]
+        if not matches:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        if len(matches) == 1:
+            return matches[0][0], matches[0][2]
+        rows = np.concatenate([m[0] for m in matches])
+        times = np.concatenate([m[1] for m in matches])
+        values = np.concatenate([m[2] for m in matches])
+        order = np.lexsort((times, rows))
+        rows, values = rows[order], values[order]
+        last = np.append(rows[1:] != rows[:-1], True)  # last (latest) entry of each patient
+        return rows[last], values[last]
+
+    # --- query compilation ---
+
+    def compile(self, expression: str):
+        """Compile a query into a function returning a packed bitmap of matching patients."""
+        with self._lock:
+            compiled = self._compiled.get(expression)
+            if compiled is not None:
+                self._compiled.move_to_end(expression)
+                return compiled
+        try:
+            tree = ast.parse(expression.strip(), mode="eval")
+        except SyntaxError as e:
+            raise CohortQueryError(f"Invalid cohort query: {e.msg}") from None
+        compiled = self._compile_node(tree.body)
+        with self._lock:
+            self._compiled[expression] = compiled
+            if len(self._compiled) > 256:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def _compile_node(self, node):
+        if isinstance(node, ast.BoolOp):
+            parts = [self._compile_node(v) for v in node.values]
+            if isinstance(node.op, ast.And):
+                def run():
+                    bitmap = parts[0]()
+                    for part in parts[1:]:
+                        bitmap = bitmap & part()
+                    return bitmap
+            else:
+                def run():
+                    bitmap = parts[0]()
+                    for part in parts[1:]:
+                        bitmap = bitmap | part()
+                    return bitmap
+            return run
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            inner = self._compile_node(node.operand)
+            return lambda: ~inner() & self._all
+        if isinstance(node, ast.Compare):
+            parts = []
+            left = node.left
+            for op, right in zip(node.ops, node.comparators):
+                parts.append(self._compile_comparison(left, op, right))
+                left = right
+            if len(parts) == 1:
+                return parts[0]
+            return lambda: np.bitwise_and.reduce([part() for part in parts])
+        if isinstance(node, ast.Call):
+            name, term = self._call(node)
+            if name == "condition":
+                return lambda: self._union(self._conditions, term)
+            if name == "medication":
+                return lambda: self._union(self._medications, term)
+            return lambda: self._from_rows(self._lab(term)[0])
+        if isinstance(node, ast.Name) and node.id == "deceased":
+            return lambda: self._pack(self.deceased)
+        raise CohortQueryError(f"Unsupported expression: {ast.unparse(node)}")
+
+    def _call(self, node: ast.Call) -> tuple:
+        if not (isinstance(node.func, ast.Name) and node.func.id in ("condition", "medication", "lab")):
+            raise CohortQueryError(f"Unknown function: {ast.unparse(node.func)}")
+        if len(node.args) != 1 or node.keywords or not isinstance(node.args[0], ast.Constant) \
+                or not isinstance(node.args[0].value, str):
+            raise CohortQueryError(f"{node.func.id}() takes one quoted term")
+        return node.func.id, node.args[0].value
+
+    def _compile_comparison(self, left, op, right):
+        if isinstance(left, ast.Constant) and not isinstance(right, ast.Constant):
+            left, right, op = right, left, _FLIPPED[type(op)]()
+        compare = _COMPARISONS.get(type(op))
+        if compare is None or not isinstance(right, ast.Constant):
+            raise CohortQueryError(f"Unsupported comparison: {ast.unparse(left)} ... {ast.unparse(right)}")
+        value = right.value
+        if isinstance(left, ast.Name) and left.id == "gender":
+            if not isinstance(value, str) or compare not in (operator.eq, operator.ne):
+                raise CohortQueryError("gender can only be compared with == or != to a quoted value")
+            return lambda: self._pack(compare(self.gender, value.lower()))
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise CohortQueryError(f"Expected a number, got {ast.unparse(right)}")
+        if isinstance(left, ast.Name) and left.id == "age":
+            return lambda: self._pack(compare(self.age, value))
+        if isinstance(left, ast.Call) and self._call(left)[0] == "lab":
+            term = left.args[0].value
+
+            def run():
+                rows, values = self._lab(term)
+                return self._from_rows(rows[compare(values, value)])
+            return run
+        raise CohortQueryError(f"Cannot compare {ast.unparse(left)}; use lab(...), age or gender")
+
+    # --- results ---
+
+    def query(self, expression: str) -> "Cohort":
+        return Cohort(self, self.compile(expression)())
+
+    def __len__(self):
+        return self.size
+
+
+class Cohort:
+    """Patients matching a query, as a packed bitmap over CohortTables rows."""
+
+    def __init__(self, tables: CohortTables, bitmap: np.ndarray):
+        self.tables = tables
+        self.bitmap = bitmap
+
+    @property
+    def count(self) -> int:
+        return int(_POPCOUNT[self.bitmap].sum(dtype=np.int64))
+
+    def rows(self) -> np.ndarray:
+        return np.flatnonzero(np.unpackbits(self.bitmap, count=self.tables.size))
+
+    def patient_ids(self, limit: int = None) -> list:
+        rows = self.rows()
+        return self.tables.patient_ids[rows[:limit] if limit else rows].tolist()
+
+    def __and__(self, other: "Cohort") -> "Cohort":
+        return Cohort(self.tables, self.bitmap & other.bitmap)
+
+    def __or__(self, other: "Cohort") -> "Cohort":
+        return Cohort(self.tables, self.bitmap | other.bitmap)
+
+    def __len__(self):
+        return self.count
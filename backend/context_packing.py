@@ -0,0 +1,122 @@
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List
+
+from backend import metrics
+
+# Fill a model's context window with the most useful snippets instead of
+# concatenating everything and letting the tokenizer cut off the tail.
+
+
+@dataclass
+class Snippet:
+    resource_id: str
+    text: str
+    score: float = 0.0  # prior relevance from the retriever, if any
+
+
+@dataclass
+class PackedContext:
+    text: str
+    resource_ids: List[str] = field(default_factory=list)
+    tokens_used: int = 0  # including special tokens and separators
+    budget: int = 0
+    dropped_ids: List[str] = field(default_factory=list)
+
+
+def tokenizer_key(tokenizer) -> tuple:
+    """Stable identity of a tokenizer for caching (id() can be reused once it is collected)."""
+    return type(tokenizer).__name__, getattr(tokenizer, "name_or_path", ""), len(tokenizer)
+
+
+class TokenLengthCache:
+    """Bounded LRU of token counts keyed by (tokenizer name/path, text)."""
+
+    def __init__(self, max_entries: int = 50_000):
+        self.max_entries = max_entries
+        self._lengths = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, tokenizer, text: str) -> int:
+        key = (tokenizer_key(tokenizer), text)
+        with self._lock:
+            length = self._lengths.get(key)
+            if length is not None:
+                self._lengths.move_to_end(key)
+        metrics.record_cache("token_length", length is not None)
+        if length is None:
+            length = len(tokenizer(text, add_special_tokens=False)["input_ids"])
+            with self._lock:
+                self._lengths[key] = length
+                if len(self._lengths) > self.max_entries:
+                    self._lengths.popitem(last=False)
+        return length
+
+
+TOKEN_LENGTHS = TokenLengthCache()
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _terms(text: str) -> set:
+    return set(_WORD.findall(text.lower()))
+
+
+def rank_snippets(snippets: List[Snippet], query: str = None, keywords: List[str] = None) -> List[Snippet]:
+    """Order snippets by relevance: the retriever's score plus query/keyword overlap.
+
+    Keyword phrases that occur verbatim weigh more than single shared words.
+    The sort is stable, so ties keep their original (e.g. chronological) order.
+    """
+    query_terms = _terms(query) if query else set()
+    phrases = [k.lower() for k in (keywords or [])]
+
+    def score(snippet: Snippet) -> float:
+        lowered = snippet.text.lower()
+        overlap = len(query_terms & _terms(lowered)) if query_terms else 0
+        phrase_hits = sum(2 for phrase in phrases if phrase in lowered)
+        return snippet.score + overlap + phrase_hits
+
+    return sorted(snippets, key=score, reverse=True)
+
+
+def pack_context(snippets: List[Snippet], tokenizer, budget: int, query: str = None, keywords: List[str] = None,
+                 separator: str = " ", keep_order: bool = True, count=None,
+                 separator_tokens: int = None) -> PackedContext:
+    """Greedily pack the highest-ranked snippets into at most `budget` tokens.
+
+    The budget covers the whole tokenized input: the special tokens the
+    tokenizer adds, every snippet, and a separator between snippets (counted
+    with its whitespace, which can over- but never under-count). Token counts
+    come from the model's own tokenizer (cached per text). Snippets that don't
+    fit are skipped rather than truncated, so smaller lower-ranked ones can
+    still use the remaining room. With keep_order the packed text follows the
+    original snippet order rather than the ranking. `count` replaces the shared
+    length cache, e.g. with a TokenStore's pre-tokenized counts, and
+    `separator_tokens` the separator's cost when the caller joins token ids
+    with its own separator ids.
+    """
+    if count is None:
+        count = lambda text: TOKEN_LENGTHS.count(tokenizer, text)
+    if separator_tokens is None:
+        separator_tokens = count(separator) if separator else 0
+    chosen, dropped = set(), []
+    used = tokenizer.num_special_tokens_to_add()
+    for snippet in rank_snippets(snippets, query, keywords):
+        cost = count(snippet.text) + (separator_tokens if chosen else 0)
+        if used + cost <= budget:
+            chosen.add(id(snippet))
+            used += cost
+        else:
+            dropped.append(snippet.resource_id)
+    ordered = snippets if keep_order else rank_snippets(snippets, query, keywords)
+    included = [s for s in ordered if id(s) in chosen]
+    return PackedContext(
+        text=separator.join(s.text for s in included),
+        resource_ids=[s.resource_id for s in included],
+        tokens_used=used,
+        budget=budget,
+        dropped_ids=dropped,
+    )
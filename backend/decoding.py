@@ -0,0 +1,165 @@
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from backend import metrics
+
+# Named decoding profiles for generate(), so callers can trade quality for
+# speed per request, and a deadline mode that picks the profile from the time
+# left and the current queue depth.
+#
+# In deadline mode generation also gets `max_time`: transformers stops decoding
+# when it runs out and returns the sequence produced so far, which is then cut
+# back to its last complete sentence.
+
+
+@dataclass(frozen=True)
+class DecodingProfile:
+    name: str
+    num_beams: int = 1
+    do_sample: bool = False
+    temperature: float = 1.0
+    length_factor: float = 1.0  # fraction of the caller's max_length
+    cost: float = 1.0           # relative latency, used by the deadline mode
+
+    def generate_kwargs(self, max_length: int) -> dict:
+        kwargs = {"max_length": max(8, int(max_length * self.length_factor)), "num_beams": self.num_beams,
+                  "do_sample": self.do_sample}
+        if self.do_sample:
+            kwargs["temperature"] = self.temperature
+        if self.num_beams > 1:
+            kwargs["early_stopping"] = True
+        return kwargs
+
+
+PROFILES = {
+    "fast": DecodingProfile("fast", num_beams=1, length_factor=0.6, cost=0.6),
+    "greedy": DecodingProfile("greedy", num_beams=1, cost=1.0),
+    "balanced": DecodingProfile("balanced", num_beams=2, cost=2.0),
+    "quality": DecodingProfile("quality", num_beams=4, cost=4.0),
+    # The assistant's original behaviour: sampled, one sequence.
+    "sampled": DecodingProfile("sampled", do_sample=True, temperature=0.7, cost=1.0),
+}
+
+# Profiles the deadline mode may pick, best first.
+DEADLINE_LADDER = ["quality", "balanced", "fast"]
+
+# Share of the remaining time the chosen profile is expected to use; the rest
+# absorbs estimate error and the decode/response work after generation.
+SAFETY_MARGIN = 0.8
+
+
+def get_profile(name: str) -> DecodingProfile:
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown decoding profile '{name}'; expected one of {', '.join(PROFILES)}") from None
+
+
+class LatencyModel:
+    """Running estimate of generation seconds per (cost unit x output token), per service."""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._unit = {}
+        self._lock = threading.Lock()
+
+    def observe(self, service: str, profile: DecodingProfile, max_length: int, seconds: float):
+        unit = seconds / (profile.cost * max_length)
+        with self._lock:
+            previous = self._unit.get(service)
+            self._unit[service] = unit if previous is None else previous + self.alpha * (unit - previous)
+
+    def estimate(self, service: str, profile: DecodingProfile, max_length: int) -> Optional[float]:
+        unit = self._unit.get(service)
+        return None if unit is None else unit * profile.cost * max_length
+
+
+LATENCY = LatencyModel()
+
+
+@dataclass
+class DecodePlan:
+    service: str
+    profile: DecodingProfile
+    max_length: int
+    kwargs: dict
+    max_time: Optional[float] = None  # seconds; only set in deadline mode
+    started: float = field(default_factory=time.perf_counter)
+    stopped: bool = False             # set by finish(): the deadline cut generation short
+
+    def finish(self) -> bool:
+        """Record how long generation took; True if the deadline cut it short."""
+        elapsed = time.perf_counter() - self.started
+        self.stopped = self.max_time is not None and elapsed >= self.max_time * 0.95
+        # A cut-short run says nothing about how long a full decode takes.
+        if not self.stopped:
+            LATENCY.observe(self.service, self.profile, self.max_length, elapsed)
+        metrics.DECODES.inc(self.service, self.profile.name, "deadline" if self.stopped else "complete")
+        return self.stopped
+
+
+def choose_profile(service: str, remaining: float, max_length: int, queue_depth: int = 1,
+                   ceiling: str = DEADLINE_LADDER[0]) -> DecodingProfile:
+    """Best profile (no better than `ceiling`) expected to finish in the remaining seconds.
+
+    Requests in flight share the same CPU threads, so the time available to
+    this one is divided by the queue depth.
+    """
+    available = remaining * SAFETY_MARGIN / max(1, queue_depth)
+    ladder = DEADLINE_LADDER[DEADLINE_LADDER.index(ceiling):] if ceiling in DEADLINE_LADDER else DEADLINE_LADDER
+    for name in ladder:
+        estimate = LATENCY.estimate(service, PROFILES[name], max_length)
+        if estimate is not None and estimate <= available:
+            return PROFILES[name]
+    return PROFILES[ladder[-1]]
+
+
+def plan_decoding(service: str, max_length: int, profile: str = None, deadline: float = None,
+                  default: str = "quality") -> DecodePlan:
+    """Generation settings for one call.
+
+    Args:
+        service: Service name, for the latency estimates and metrics.
+        max_length: The caller's output length limit.
+        profile: Named profile; in deadline mode the best profile allowed.
+        deadline: time.perf_counter() value by which the output is due; enables deadline mode.
+        default: Profile used when none is given.
+    """
+    name = profile or default
+    chosen = get_profile(name)
+    max_time = None
+    if deadline is not None:
+        remaining = max(0.0, deadline - time.perf_counter())
+        chosen = choose_profile(service, remaining, max_length, metrics.queue_depth(service), ceiling=name)
+        max_time = max(0.05, remaining * SAFETY_MARGIN)
+    kwargs = chosen.generate_kwargs(max_length)
+    if max_time is not None:
+        kwargs["max_time"] = max_time
+    return DecodePlan(service, chosen, max_length, kwargs, max_time)
+
+
+def deadline_from_budget(latency_budget_ms, started: float = None) -> Optional[float]:
+    """perf_counter() deadline for a per-request latency budget in ms (None if no budget)."""
+    if latency_budget_ms is None:
+        return None
+    if isinstance(latency_budget_ms, bool):
+        raise ValueError("latency_budget_ms must be a number")
+    try:
+        budget = float(latency_budget_ms)
+    except (TypeError, ValueError):
+        raise ValueError("latency_budget_ms must be a number") from None
+    if not 0 < budget < float("inf"):
+        raise ValueError("latency_budget_ms must be positive")
+    return (started if started is not None else time.perf_counter()) + budget / 1000.0
+
+
+_SENTENCE_END = re.compile(r"[.!?](?=\s|$)")
+
+
+def trim_partial(text: str) -> str:
+    """Cut an interrupted generation back to its last complete sentence, if it has one."""
+    ends = list(_SENTENCE_END.finditer(text))
+    return text[:ends[-1].end()] if ends else text.strip()
@@ -4,6 +4,14 @@ import json
 
 DATA_DIR = "data"  # folder where all FHIR JSON files are stored
 
+def reference_id(reference):
+    """Resource id from a reference like "urn:uuid:<id>" or "Patient/<id>"."""
+    if not reference:
+        return None
+    if reference.startswith("urn:uuid:"):
+        return reference[len("urn:uuid:"):]
+    return reference.rsplit("/", 1)[-1]
+
 def load_all_fhir():
     """Dynamically load all FHIR resources from all JSON files into a single virtual FHIR Bundle.
     Handles both FHIR Bundles and single resources."""
@@ -26,10 +34,18 @@ def load_all_fhir():
     print(f"✅ Loaded {len(bundle['entry'])} resources into bundle")
     return bundle
 
-def summarize_bundle(bundle):
+def summarize_bundle(bundle, include_notes=0):
     """
     Turn a FHIR bundle into a compact doctor-friendly summary.
+    include_notes > 0 appends the text of that many most recent clinical notes
+    (decoded lazily through the shared note cache).
+    Also accepts the compact records from backend.fhir_records.load_records().
     """
+    from backend.fhir_records import RecordSet, summarize_records
+    if isinstance(bundle, RecordSet):
+        if include_notes:
+            raise ValueError("include_notes needs the raw bundle; compact records don't keep notes")
+        return summarize_records(bundle)
     summary = []
     for entry in bundle.get("entry", []):
         res = entry.get("resource", {})
@@ -51,5 +67,10 @@ def summarize_bundle(bundle):
             unit = res.get("valueQuantity", {}).get("unit")
             if code and value:
                 summary.append(f"Lab/Observation: {code} = {value} {unit or ''}")
+    if include_notes:
+        from backend.clinical_notes import NoteIndex
+        index = NoteIndex.from_bundle(bundle)
+        for note in index.list_notes()[-include_notes:]:
+            summary.append(f"Note ({note.note_type}, {note.date[:10]}): {index.text(note.note_id).strip()}")
     return "\n".join(summary)
 
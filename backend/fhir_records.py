@@ -0,0 +1,273 @@
+import json
+import os
+import sys
+from datetime import date, datetime
+from typing import Iterator, Optional
+
+from backend.fhir_loading import reference_id
+
+# Compact, slotted records for the core clinical resources. A Synthea resource
+# dict carries every nested coding, extension and reference as separate dicts
+# and strings; these records keep only what the app reads, with codes, systems,
+# displays and ids interned (a few hundred distinct codes cover the whole
+# corpus) and timestamps parsed once at load time.
+
+
+def _intern(value) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else None
+
+
+# fromisoformat() builds a new tzinfo per call; share one per UTC offset.
+_TIMEZONES = {}
+
+
+def parse_instant(value) -> Optional[datetime]:
+    """FHIR dateTime/instant -> datetime (None if missing or unparsable)."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=_TIMEZONES.setdefault(parsed.utcoffset(), parsed.tzinfo))
+    return parsed
+
+
+def parse_date(value) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return None
+
+
+def _coding(concept: dict) -> tuple:
+    """(code, system, display) of a CodeableConcept's first coding; display falls back to the concept text."""
+    concept = concept or {}
+    coding = (concept.get("coding") or [{}])[0]
+    display = concept.get("text") or coding.get("display")
+    return _intern(coding.get("code")), _intern(coding.get("system")), _intern(display)
+
+
+def _ref(resource: dict, name: str) -> Optional[str]:
+    return _intern(reference_id((resource.get(name) or {}).get("reference")))
+
+
+class Record:
+    __slots__ = ("id", "patient_id")
+    resource_type = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self._fields())
+        return f"{type(self).__name__}({fields})"
+
+    @classmethod
+    def _fields(cls):
+        return [name for klass in reversed(cls.__mro__) for name in getattr(klass, "__slots__", ())]
+
+    @property
+    def reference(self) -> str:
+        return f"{self.resource_type}/{self.id}"
+
+
+class PatientRecord(Record):
+    __slots__ = ("name_text", "given", "family", "gender", "birth_date", "deceased")
+    resource_type = "Patient"
+
+    @classmethod
+    def from_resource(cls, res: dict) -> "PatientRecord":
+        self = cls()
+        self.id = self.patient_id = _intern(res.get("id"))
+        name = (res.get("name") or [{}])[0]
+        self.name_text = name.get("text")
+        self.given = " ".join(name.get("given", [])) or None
+        self.family = name.get("family")
+        self.gender = _intern(res.get("gender"))
+        self.birth_date = parse_date(res.get("birthDate"))
+        self.deceased = parse_instant(res.get("deceasedDateTime"))
+        return self
+
+
+class CodedRecord(Record):
+    __slots__ = ("code", "system", "display", "encounter_id")
+
+    def _set_common(self, res: dict, concept: dict):
+        self.id = _intern(res.get("id"))
+        self.patient_id = _ref(res, "subject") or _ref(res, "patient")
+        self.code, self.system, self.display = _coding(concept)
+        self.encounter_id = _ref(res, "encounter") or _ref(res, "context")
+
+
+class ConditionRecord(CodedRecord):
+    __slots__ = ("clinical_status", "onset", "abatement")
+    resource_type = "Condition"
+
+    @classmethod
+    def from_resource(cls, res: dict) -> "ConditionRecord":
+        self = cls()
+        self._set_common(res, res.get("code"))
+        self.clinical_status = _coding(res.get("clinicalStatus"))[0]
+        self.onset = parse_instant(res.get("onsetDateTime"))
+        self.abatement = parse_instant(res.get("abatementDateTime"))
+        return self
+
+
+class ObservationRecord(CodedRecord):
+    __slots__ = ("category", "value", "unit", "value_text", "effective")
+    resource_type = "Observation"
+
+    @classmethod
+    def from_resource(cls, res: dict) -> "ObservationRecord":
+        self = cls()
+        self._set_common(res, res.get("code"))
+        self.category = _coding((res.get("category") or [{}])[0])[0]
+        quantity = res.get("valueQuantity") or {}
+        self.value = quantity.get("value")
+        self.unit = _intern(quantity.get("unit"))
+        self.value_text = _coding(res.get("valueCodeableConcept"))[2] if "valueCodeableConcept" in res else res.get("valueString")
+        self.effective = parse_instant(res.get("effectiveDateTime") or res.get("issued"))
+        return self
+
+
+class MedicationRequestRecord(CodedRecord):
+    __slots__ = ("status", "authored_on")
+    resource_type = "MedicationRequest"
+
+    @classmethod
+    def from_resource(cls, res: dict) -> "MedicationRequestRecord":
+        self = cls()
+        self._set_common(res, res.get("medicationCodeableConcept"))
+        self.status = _intern(res.get("status"))
+        self.authored_on = parse_instant(res.get("authoredOn"))
+        return self
+
+
+class EncounterRecord(CodedRecord):
+    __slots__ = ("class_code", "start", "end")
+    resource_type = "Encounter"
+
+    @classmethod
+    def from_resource(cls, res: dict) -> "EncounterRecord":
+        self = cls()
+        self._set_common(res, (res.get("type") or [{}])[0])
+        self.encounter_id = self.id
+        self.class_code = _intern((res.get("class") or {}).get("code"))
+        period = res.get("period") or {}
+        self.start = parse_instant(period.get("start"))
+        self.end = parse_instant(period.get("end"))
+        return self
+
+
+class ProcedureRecord(CodedRecord):
+    __slots__ = ("performed",)
+    resource_type = "Procedure"
+
+    @classmethod
+    def from_resource(cls, res: dict) -> "ProcedureRecord":
+        self = cls()
+        self._set_common(res, res.get("code"))
+        self.performed = parse_instant(res.get("performedDateTime") or (res.get("performedPeriod") or {}).get("start"))
+        return self
+
+
+class ImmunizationRecord(CodedRecord):
+    __slots__ = ("occurrence",)
+    resource_type = "Immunization"
+
+    @classmethod
+    def from_resource(cls, res: dict) -> "ImmunizationRecord":
+        self = cls()
+        self._set_common(res, res.get("vaccineCode"))
+        self.occurrence = parse_instant(res.get("occurrenceDateTime"))
+        return self
+
+
+RECORD_TYPES = {cls.resource_type: cls for cls in (
+    PatientRecord, ConditionRecord, ObservationRecord, MedicationRequestRecord,
+    EncounterRecord, ProcedureRecord, ImmunizationRecord,
+)}
+
+
+class RecordSet:
+    """Records in load order, plus a per-patient index."""
+
+    def __init__(self):
+        self.records = []
+        self.by_patient = {}
+
+    def add_resource(self, resource: dict) -> Optional[Record]:
+        cls = RECORD_TYPES.get(resource.get("resourceType"))
+        if cls is None:
+            return None
+        record = cls.from_resource(resource)
+        self.records.append(record)
+        self.by_patient.setdefault(record.patient_id, []).append(record)
+        return record
+
+    @classmethod
+    def from_bundle(cls, bundle: dict) -> "RecordSet":
+        records = cls()
+        for entry in bundle.get("entry", []):
+            records.add_resource(entry.get("resource", {}))
+        return records
+
+    def of_type(self, record_cls, patient_id: str = None) -> Iterator[Record]:
+        source = self.by_patient.get(patient_id, []) if patient_id else self.records
+        return (r for r in source if isinstance(r, record_cls))
+
+    def patients(self) -> Iterator[PatientRecord]:
+        return self.of_type(PatientRecord)
+
+    def __len__(self):
+        return len(self.records)
+
+
+def summarize_records(records: RecordSet) -> str:
+    """summarize_bundle() over compact records; same lines, same order."""
+    summary = []
+    for r in records.records:
+        if isinstance(r, PatientRecord):
+            dob = r.birth_date.isoformat() if r.birth_date else "Unknown"
+            summary.append(f"Patient: {r.name_text or 'Unknown'}, Gender: {r.gender or 'Unknown'}, DOB: {dob}")
+        elif isinstance(r, ConditionRecord):
+            summary.append(f"Condition: {r.display or 'Unknown condition'}")
+        elif isinstance(r, MedicationRequestRecord):
+            summary.append(f"Medication: {r.display or 'Unknown medication'}")
+        elif isinstance(r, ObservationRecord):
+            if r.display and r.value:
+                summary.append(f"Lab/Observation: {r.display} = {r.value} {r.unit or ''}")
+    return "\n".join(summary)
+
+
+def load_records(data_dir: str = None) -> RecordSet:
+    """Load every FHIR file in the data directory straight into compact records.
+
+    Each file's JSON is converted and dropped before the next one is read, so
+    the raw dict tree of the whole corpus is never held in memory at once.
+    Resource types without a record class (Claim, ExplanationOfBenefit, ...)
+    are skipped; use load_all_fhir() when those are needed.
+    """
+    from backend import fhir_loading
+
+    data_dir = data_dir or fhir_loading.DATA_DIR
+    records = RecordSet()
+    for file in os.listdir(data_dir):
+        if not file.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(data_dir, file), "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"❌ Error reading {file}: {e}")
+            continue
+        if data.get("resourceType") == "Bundle" and "entry" in data:
+            for entry in data["entry"]:
+                if "resource" in entry:
+                    records.add_resource(entry["resource"])
+        else:
+            records.add_resource(data)
+        del data
+    print(f"✅ Loaded {len(records)} compact records")
+    return records
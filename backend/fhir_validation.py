@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from backend import metrics
+
+# Validation of FHIR input for the APIs.
+#
+# "light" checks and extracts only the fields the pipeline reads, and is
+# tolerant of the small deviations Synthea output has (missing names, a bare
+# string where a list is expected). "strict" builds the full fhir.resources
+# model first, which rejects anything that isn't valid FHIR R4.
+#
+# Results are cached by (mode, resource id, version): meta.versionId when the
+# resource has one, or a version tag supplied by the caller (e.g. the patient
+# store's content hash). Without either, strict results are cached by a hash of
+# the content and light results are not cached (extracting is cheaper than
+# hashing).
+
+MODES = ("light", "strict")
+DEFAULT_MODE = os.environ.get("AI_CLINIC_FHIR_VALIDATION", "light")
+
+
+class FHIRValidationError(ValueError):
+    pass
+
+
+class ValidationCache:
+    """Bounded, thread-safe LRU of validation results."""
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+        metrics.record_cache("fhir_validation", value is not None)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            if len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+VALIDATED = ValidationCache()
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _extract_patient_light(resource: dict) -> dict:
+    if resource.get("resourceType", "Patient") != "Patient":
+        raise FHIRValidationError(f"Expected a Patient resource, got {resource.get('resourceType')!r}")
+    names = [n for n in _as_list(resource.get("name")) if isinstance(n, dict)]
+    given = [g for g in _as_list(names[0].get("given")) if isinstance(g, str) and g] if names else []
+    return {"patient_name": given[0] if given else "Unknown"}
+
+
+def _extract_patient_strict(resource: dict) -> dict:
+    from fhir.resources.patient import Patient
+
+    try:
+        patient = Patient(**resource)
+    except (ValueError, TypeError) as e:  # pydantic's ValidationError is a ValueError
+        raise FHIRValidationError(f"Invalid Patient resource: {e}") from None
+    name = patient.name[0] if patient.name else None
+    return {"patient_name": name.given[0] if name is not None and name.given else "Unknown"}
+
+
+def _cache_key(mode: str, resource: dict, version: str = None):
+    resource_id = resource.get("id")
+    meta = resource.get("meta")
+    version = (meta.get("versionId") if isinstance(meta, dict) else None) or version
+    if resource_id and version:
+        return (mode, resource_id, version)
+    if mode == "strict":
+        return (mode, hashlib.sha1(json.dumps(resource, sort_keys=True).encode("utf-8")).hexdigest())
+    return None
+
+
+def validate_patient(resource: dict, mode: str = None, version: str = None) -> dict:
+    """Check a Patient resource and return the fields the pipeline uses.
+
+    Args:
+        resource: The Patient as a dict.
+        mode: "light" or "strict"; defaults to AI_CLINIC_FHIR_VALIDATION.
+        version: Version tag to cache by when the resource has no meta.versionId.
+
+    Raises:
+        FHIRValidationError: The resource is not usable (or, in strict mode, not valid FHIR).
+    """
+    mode = mode or DEFAULT_MODE
+    if mode not in MODES:
+        raise ValueError(f"Unknown validation mode '{mode}'; expected one of {', '.join(MODES)}")
+    if not isinstance(resource, dict):
+        raise FHIRValidationError("Patient must be a JSON object")
+    key = _cache_key(mode, resource, version)
+    if key is not None:
+        cached = VALIDATED.get(key)
+        if cached is not None:
+            return dict(cached)
+    info = _extract_patient_strict(resource) if mode == "strict" else _extract_patient_light(resource)
+    if key is not None:
+        VALIDATED.put(key, info)
+    return dict(info)
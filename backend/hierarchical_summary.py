@@ -0,0 +1,154 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List
+
+from backend import metrics
+from backend.context_packing import TOKEN_LENGTHS, Snippet
+
+# Map-reduce summarization for records that don't fit in one encoder window:
+# notes are packed into chunks on note boundaries, chunks are summarized in
+# batches, and the summaries are summarized again until one is left.
+#
+# Every node is cached by a hash of its input text. Chunks are packed greedily
+# left to right, so appending a note (records are passed in date order) only
+# changes the last chunk, and only the last group at each level above it has
+# to be recomputed.
+
+
+class SummaryCache:
+    """Bounded, thread-safe LRU of node hash -> summary text."""
+
+    def __init__(self, max_entries: int = 20_000):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+        metrics.record_cache("chunk_summary", value is not None)
+        return value
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._items[key] = value
+            if len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+CHUNK_SUMMARIES = SummaryCache()
+
+
+@dataclass
+class HierarchicalSummary:
+    summary: str
+    levels: int          # number of summarization levels that were needed
+    chunks: int          # leaf chunks the record was split into
+    computed: int        # summaries actually generated on this call
+    cached: int          # summaries reused from the cache
+
+
+def _split_oversized(snippet: Snippet, tokenizer, budget: int) -> List[Snippet]:
+    """Split a single note that exceeds the chunk budget on paragraph, then sentence boundaries."""
+    pieces, current = [], ""
+    for part in re.split(r"(?<=\n\n)|(?<=[.!?])\s+", snippet.text):
+        if not part:
+            continue
+        candidate = f"{current} {part}".strip() if current else part
+        if current and TOKEN_LENGTHS.count(tokenizer, candidate) > budget:
+            pieces.append(current)
+            current = part
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    return [Snippet(f"{snippet.resource_id}#part{i + 1}", text, snippet.score) for i, text in enumerate(pieces)]
+
+
+def chunk_notes(notes: List[Snippet], tokenizer, chunk_budget: int) -> List[List[Snippet]]:
+    """Greedily pack notes, in order, into chunks of at most chunk_budget tokens."""
+    chunks, current, used = [], [], 0
+    for note in notes:
+        parts = [note]
+        if TOKEN_LENGTHS.count(tokenizer, note.text) > chunk_budget:
+            parts = _split_oversized(note, tokenizer, chunk_budget)
+        for part in parts:
+            cost = TOKEN_LENGTHS.count(tokenizer, part.text)
+            if current and used + cost > chunk_budget:
+                chunks.append(current)
+                current, used = [], 0
+            current.append(part)
+            used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _group(texts: List[str], tokenizer, budget: int, fan_in: int) -> List[List[str]]:
+    """Pack consecutive summaries into groups for the next level (always at least two per group)."""
+    groups, current, used = [], [], 0
+    for text in texts:
+        cost = TOKEN_LENGTHS.count(tokenizer, text)
+        if len(current) >= 2 and (used + cost > budget or len(current) >= fan_in):
+            groups.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += cost
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
+    return groups
+
+
+def _node_key(level: int, text: str, params_key: str) -> str:
+    return hashlib.sha256(f"{params_key}|{level}|{text}".encode("utf-8")).hexdigest()
+
+
+def hierarchical_summarize(notes: List[Snippet], summarize_batch: Callable[[List[str]], List[str]], tokenizer,
+                           chunk_budget: int = 900, fan_in: int = 6, batch_size: int = 4, workers: int = 2,
+                           params_key: str = "", cache: SummaryCache = CHUNK_SUMMARIES) -> HierarchicalSummary:
+    """Summarize an arbitrarily long record.
+
+    Args:
+        notes: Snippets in chronological order.
+        summarize_batch: Summarizes a list of texts in one model call.
+        tokenizer: The summarizer's tokenizer, used for token budgets.
+        chunk_budget: Max input tokens per node; keep it under the encoder window.
+        fan_in: Max summaries combined into one node at the reduce levels.
+        batch_size: Texts per summarize_batch call.
+        workers: summarize_batch calls run concurrently.
+        params_key: Anything that changes the output (model, decoding settings),
+            so cached nodes are never reused across different settings.
+    """
+    if not notes:
+        return HierarchicalSummary("", 0, 0, 0, 0)
+    chunks = chunk_notes(notes, tokenizer, chunk_budget)
+    texts = [" ".join(s.text for s in chunk) for chunk in chunks]
+    level, computed, cached = 0, 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            keys = [_node_key(level, text, params_key) for text in texts]
+            summaries = [cache.get(key) for key in keys]
+            missing = [i for i, s in enumerate(summaries) if s is None]
+            cached += len(texts) - len(missing)
+            batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+            for batch, results in zip(batches, pool.map(lambda b: summarize_batch([texts[i] for i in b]), batches)):
+                for i, summary in zip(batch, results):
+                    summaries[i] = summary
+                    cache.put(keys[i], summary)
+            computed += len(missing)
+            level += 1
+            if len(summaries) == 1:
+                return HierarchicalSummary(summaries[0], level, len(chunks), computed, cached)
+            texts = [" ".join(group) for group in _group(summaries, tokenizer, chunk_budget, fan_in)]
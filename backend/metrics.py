@@ -0,0 +1,212 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lightweight, dependency-free metrics for the API services and the Streamlit app.
+# Values are exposed in the Prometheus text exposition format at /metrics.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels: tuple) -> tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(v) for v in labels)
+
+    def _label_str(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, None, v) for key, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def observe(self, *labels, value: float):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, n = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, n + 1)
+
+    def count(self, *labels) -> int:
+        return self._values.get(self._key(labels), (None, 0.0, 0))[2]
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._values.items()):
+                for bound, c in zip(self.buckets, counts):
+                    out.append((self.name + "_bucket", key, {"le": repr(bound)}, c))
+                out.append((self.name + "_bucket", key, {"le": "+Inf"}, n))
+                out.append((self.name + "_sum", key, None, total))
+                out.append((self.name + "_count", key, None, n))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: _Metric):
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{metric._label_str(key, extra)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# The endpoint label is the matched route template (e.g. /patients/{patient_id}), never
+# the raw path, so ids in URLs can't create unbounded series.
+REQUESTS = Counter("ai_clinic_requests_total", "Requests handled, by service, endpoint and status.",
+                   ["service", "endpoint", "status"])
+UNMATCHED_ENDPOINT = "<unmatched>"
+IN_FLIGHT = Gauge("ai_clinic_in_flight_requests", "Requests currently being processed (queue depth).", ["service"])
+STAGE_SECONDS = Histogram("ai_clinic_stage_seconds", "Time spent in each pipeline stage.", ["service", "stage"])
+BATCH_SIZE = Histogram("ai_clinic_model_batch_size", "Inputs per model call.", ["service"],
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+TOKENS = Counter("ai_clinic_tokens_total", "Tokens fed to (in) and produced by (out) the models.",
+                 ["service", "direction"])
+CACHE_REQUESTS = Counter("ai_clinic_cache_requests_total", "Cache lookups, by cache and hit/miss.",
+                         ["cache", "result"])
+DECODES = Counter("ai_clinic_decodes_total", "Generation calls, by decoding profile and whether they finished "
+                  "or were stopped at the deadline.", ["service", "profile", "outcome"])
+COALESCED = Counter("ai_clinic_coalesced_calls_total", "Model calls by role: leaders ran the model, followers "
+                    "joined an identical call already in flight (one computation saved each).", ["service", "role"])
+
+# Per-request stage breakdown, only populated inside request_scope().
+_breakdown = contextvars.ContextVar("ai_clinic_timings", default=None)
+
+
+@contextmanager
+def span(service: str, stage: str):
+    """Time one pipeline stage; also recorded in the current request's breakdown."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(service, stage, value=elapsed)
+        breakdown = _breakdown.get()
+        if breakdown is not None:
+            breakdown[stage] = breakdown.get(stage, 0.0) + elapsed * 1000
+
+
+@contextmanager
+def request_scope(service: str):
+    """Track one request: in-flight gauge, total time, and a dict of stage -> ms."""
+    breakdown = {}
+    token = _breakdown.set(breakdown)
+    IN_FLIGHT.inc(service)
+    start = time.perf_counter()
+    try:
+        yield breakdown
+    finally:
+        elapsed = time.perf_counter() - start
+        IN_FLIGHT.dec(service)
+        STAGE_SECONDS.observe(service, "total", value=elapsed)
+        breakdown["total"] = elapsed * 1000
+        _breakdown.reset(token)
+
+
+def timings_ms(breakdown: dict) -> dict:
+    """Rounded copy of a request breakdown for inclusion in a response body."""
+    return {stage: round(ms, 3) for stage, ms in breakdown.items()}
+
+
+def record_model_call(service: str, batch_size: int, tokens_in: int, tokens_out: int):
+    BATCH_SIZE.observe(service, value=batch_size)
+    TOKENS.inc(service, "in", amount=tokens_in)
+    TOKENS.inc(service, "out", amount=tokens_out)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+def queue_depth(service: str) -> int:
+    return int(IN_FLIGHT.value(service))
+
+
+def render_prometheus() -> str:
+    return REGISTRY.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread, for processes without their own HTTP API (Streamlit)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    return server
@@ -0,0 +1,174 @@
+import os
+import re
+
+# "1"    -> always build tiny randomly initialized models (offline benchmarks, load tests)
+# "auto" -> try the real weights first, fall back to tiny models if they can't be loaded
+# unset  -> real weights only; a download/cache failure is raised as usual
+TINY_MODELS_ENV = "AI_CLINIC_TINY_MODELS"
+
+# Directory of memory-mapped weight files. When set, loaded weights are saved
+# there once and every process maps the same file, so the OS page cache holds
+# a single copy no matter how many workers serve the model.
+MMAP_WEIGHTS_ENV = "AI_CLINIC_MMAP_WEIGHTS"
+
+# Text the tiny tokenizers are trained on. Only needs to cover the kind of
+# vocabulary the services see; the weights are random anyway.
+_TOKENIZER_CORPUS = [
+    "Patient reports severe chest pain radiating to the left arm. Suspected myocardial infarction.",
+    "Treatment plan involves a regimen of beta-blockers and aspirin for the chest pain.",
+    "Patient has a history of hypertension and Type 2 Diabetes.",
+    "Follow-up scheduled in 2 weeks to review lab results and vitals.",
+    "Hemoglobin A1c/Hemoglobin.total in Blood = 9.2 % Body mass index (BMI) [Ratio] = 31.4 kg/m2",
+    "# Chief Complaint\nNo complaints.\n# History of Present Illness\n# Assessment and Plan\n## Plan",
+    "Medical Query: What are the treatment options for asthma? Analyze these symptoms and suggest possible conditions:",
+    "Patient name: John. Question: Is metformin appropriate for chronic kidney disease stage 3?",
+]
+
+_SPECIAL_TOKENS = {
+    "bart": {"bos_token": "<s>", "eos_token": "</s>", "pad_token": "<pad>", "unk_token": "<unk>", "mask_token": "<mask>"},
+    "bert": {"cls_token": "[CLS]", "sep_token": "[SEP]", "pad_token": "[PAD]", "unk_token": "[UNK]", "mask_token": "[MASK]"},
+    "t5": {"eos_token": "</s>", "pad_token": "<pad>", "unk_token": "<unk>"},
+    "gpt2": {"bos_token": "<|endoftext|>", "eos_token": "<|endoftext|>", "unk_token": "<|endoftext|>"},
+}
+
+# How each family wraps a single sequence / a pair of sequences.
+_TEMPLATES = {
+    "bart": ("<s> $A </s>", "<s> $A </s> </s> $B </s>"),
+    "bert": ("[CLS] $A [SEP]", "[CLS] $A [SEP] $B:1 [SEP]:1"),
+    "t5": ("$A </s>", "$A </s> $B </s>"),
+    "gpt2": ("$A", "$A $B"),
+}
+
+
+def model_family(model_name: str) -> str:
+    """Map a hub model id to the architecture family used for tiny stand-ins."""
+    name = model_name.lower()
+    if "bart" in name:
+        return "bart"
+    if "t5" in name:
+        return "t5"
+    if "gpt" in name:
+        return "gpt2"
+    return "bert"
+
+
+def build_tiny_tokenizer(family: str, vocab_size: int = 2000):
+    """Train a small byte-level BPE tokenizer that behaves like the family's real tokenizer."""
+    from tokenizers import Tokenizer, models, pre_tokenizers, decoders, processors, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    specials = _SPECIAL_TOKENS[family]
+    special_list = list(dict.fromkeys(specials.values()))
+    tok = Tokenizer(models.BPE(unk_token=specials["unk_token"]))
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=True)
+    tok.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=special_list,
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tok.train_from_iterator(_TOKENIZER_CORPUS, trainer=trainer)
+    single, pair = _TEMPLATES[family]
+    used = [t for t in special_list if t in single or t in pair]
+    tok.post_processor = processors.TemplateProcessing(
+        single=single, pair=pair, special_tokens=[(t, tok.token_to_id(t)) for t in used]
+    )
+    return PreTrainedTokenizerFast(tokenizer_object=tok, model_max_length=1024 if family == "bart" else 512, **specials)
+
+
+def build_tiny_config(family: str, tokenizer):
+    """Small config of the same architecture as the real model (2 layers, 64 hidden)."""
+    from transformers import BartConfig, BertConfig, GPT2Config, T5Config
+
+    vocab_size = len(tokenizer)
+    if family == "bart":
+        return BartConfig(vocab_size=vocab_size, d_model=64, encoder_layers=2, decoder_layers=2,
+                          encoder_attention_heads=2, decoder_attention_heads=2,
+                          encoder_ffn_dim=128, decoder_ffn_dim=128, max_position_embeddings=1024,
+                          pad_token_id=tokenizer.pad_token_id, bos_token_id=tokenizer.bos_token_id,
+                          eos_token_id=tokenizer.eos_token_id, decoder_start_token_id=tokenizer.eos_token_id,
+                          forced_bos_token_id=tokenizer.bos_token_id)
+    if family == "t5":
+        return T5Config(vocab_size=vocab_size, d_model=64, d_kv=16, d_ff=128, num_layers=2, num_heads=4,
+                        pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id,
+                        decoder_start_token_id=tokenizer.pad_token_id)
+    if family == "gpt2":
+        return GPT2Config(vocab_size=vocab_size, n_embd=64, n_layer=2, n_head=2, n_positions=512,
+                          bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id)
+    return BertConfig(vocab_size=vocab_size, hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+                      intermediate_size=128, max_position_embeddings=512, pad_token_id=tokenizer.pad_token_id)
+
+
+def load_tiny(model_name: str, model_cls):
+    """Tiny randomly initialized (tokenizer, model) with the same architecture as model_name."""
+    import torch
+
+    family = model_family(model_name)
+    torch.manual_seed(0)
+    tokenizer = build_tiny_tokenizer(family)
+    config = build_tiny_config(family, tokenizer)
+    # Auto* classes build from a config via from_config; concrete classes take it directly.
+    model = model_cls.from_config(config) if hasattr(model_cls, "from_config") else model_cls(config)
+    model.eval()
+    return tokenizer, model
+
+
+def load_tokenizer(model_name: str):
+    """Load only the tokenizer for model_name, honouring AI_CLINIC_TINY_MODELS."""
+    from transformers import AutoTokenizer
+
+    mode = os.environ.get(TINY_MODELS_ENV, "")
+    if mode != "1":
+        try:
+            return AutoTokenizer.from_pretrained(model_name)
+        except OSError:
+            if mode != "auto":
+                raise
+    return build_tiny_tokenizer(model_family(model_name))
+
+
+def mmap_weights(model, weights_name: str, directory: str):
+    """Re-point the model's parameters at a memory-mapped copy of its weights.
+
+    The weights are written to <directory>/<weights_name>.pt the first time;
+    later loads (and other processes) map that file read-only instead of each
+    holding a private copy.
+    """
+    import torch
+
+    path = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]+", "--", weights_name) + ".pt")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        torch.save(model.state_dict(), path + ".tmp")
+        os.replace(path + ".tmp", path)
+    state = torch.load(path, mmap=True, weights_only=True, map_location="cpu")
+    model.load_state_dict(state, assign=True)
+    if hasattr(model, "tie_weights"):
+        model.tie_weights()  # assign=True replaces tied parameters one by one
+    model.eval()
+    return model
+
+
+def load_pretrained(model_name: str, model_cls, tokenizer_cls=None):
+    """Load (tokenizer, model), honouring AI_CLINIC_TINY_MODELS for offline runs
+    and AI_CLINIC_MMAP_WEIGHTS for memory-mapped weights."""
+    if tokenizer_cls is None:
+        from transformers import AutoTokenizer
+        tokenizer_cls = AutoTokenizer
+    mode = os.environ.get(TINY_MODELS_ENV, "")
+    weights_name = f"{model_name}-{model_cls.__name__}"
+    if mode == "1":
+        print(f"Using tiny random stand-in for {model_name}")
+        tokenizer, model = load_tiny(model_name, model_cls)
+        weights_name += "-tiny"
+    else:
+        try:
+            tokenizer = tokenizer_cls.from_pretrained(model_name)
+            model = model_cls.from_pretrained(model_name)
+        except OSError:
+            if mode != "auto":
+                raise
+            print(f"⚠️ Could not load {model_name}; using tiny random stand-in")
+            tokenizer, model = load_tiny(model_name, model_cls)
+            weights_name += "-tiny"
+    mmap_dir = os.environ.get(MMAP_WEIGHTS_ENV)
+    if mmap_dir:
+        model = mmap_weights(model, weights_name, mmap_dir)
+    return tokenizer, model
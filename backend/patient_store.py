@@ -0,0 +1,223 @@
+import base64
+import bisect
+import hashlib
+import json
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from backend.fhir_loading import reference_id
+from backend.timeline import to_timestamp
+
+# Read-only index of the loaded FHIR data by patient and resource type, for
+# the REST API. Each (patient, type) list is kept sorted by (time, id), so
+# _since filters and cursor pages are bisections and a cursor stays valid
+# while new resources are added. Times are epoch seconds, so dates with
+# different UTC offsets, and date-only values next to dateTimes, compare by
+# the instant they denote rather than as strings.
+
+# Fields that point from a resource to its patient, in order of preference.
+_PATIENT_FIELDS = ("subject", "patient", "beneficiary")
+
+# Clinical date used for ordering and _since when a resource has no
+# meta.lastUpdated (Synthea bundles don't set it).
+_DATE_FIELDS = ("effectiveDateTime", "issued", "authoredOn", "recordedDate", "onsetDateTime", "occurrenceDateTime",
+                "performedDateTime", "date", "created", "birthDate")
+_PERIOD_FIELDS = ("period", "effectivePeriod", "performedPeriod", "billablePeriod")
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+
+def resource_date(resource: dict) -> str:
+    last_updated = resource.get("meta", {}).get("lastUpdated")
+    if last_updated:
+        return last_updated
+    for name in _DATE_FIELDS:
+        if resource.get(name):
+            return resource[name]
+    for name in _PERIOD_FIELDS:
+        start = resource.get(name, {}).get("start")
+        if start:
+            return start
+    return ""
+
+
+def resource_time(resource: dict) -> float:
+    """resource_date() in epoch seconds; undated resources sort first."""
+    timestamp = to_timestamp(resource_date(resource))
+    return float("-inf") if timestamp is None else timestamp
+
+
+def patient_of(resource: dict) -> Optional[str]:
+    if resource.get("resourceType") == "Patient":
+        return resource.get("id")
+    for name in _PATIENT_FIELDS:
+        ref = resource.get(name)
+        if isinstance(ref, dict) and ref.get("reference"):
+            return reference_id(ref["reference"])
+    return None
+
+
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, resource_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return float(timestamp), str(resource_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor") from None
+
+
+@dataclass
+class Page:
+    resources: List[dict]
+    total: int                      # matches for the query, across all pages
+    next_cursor: Optional[str]
+    etag: str
+    keys: List[tuple] = field(default_factory=list, repr=False)
+
+
+class PatientStore:
+    def __init__(self):
+        self._patients = {}
+        self._keys = defaultdict(list)       # (patient id, type) -> sorted [(time, id)]
+        self._resources = defaultdict(dict)  # (patient id, type) -> {id: resource}
+        self._versions = {}                  # (type, id) -> version tag, computed on first use
+        self._timeline = None                # built on first use, dropped on add
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bundle(cls, bundle: dict) -> "PatientStore":
+        store = cls()
+        for entry in bundle.get("entry", []):
+            store.add(entry.get("resource", {}))
+        return store
+
+    def add(self, resource: dict):
+        patient_id = patient_of(resource)
+        resource_type = resource.get("resourceType")
+        resource_id = resource.get("id")
+        if not (patient_id and resource_type and resource_id):
+            return
+        slot = (patient_id, resource_type)
+        with self._lock:
+            previous = self._resources[slot].get(resource_id)
+            if previous is not None:
+                keys = self._keys[slot]
+                del keys[bisect.bisect_left(keys, (resource_time(previous), resource_id))]
+            self._resources[slot][resource_id] = resource
+            bisect.insort(self._keys[slot], (resource_time(resource), resource_id))
+            self._versions.pop((resource_type, resource_id), None)
+            self._timeline = None
+            if resource_type == "Patient":
+                self._patients[patient_id] = resource
+
+    def patient(self, patient_id: str) -> Optional[dict]:
+        return self._patients.get(patient_id)
+
+    def read(self, patient_id: str, resource_type: str, resource_id: str) -> Optional[dict]:
+        return self._resources.get((patient_id, resource_type), {}).get(resource_id)
+
+    def resources(self, patient_id: str) -> List[dict]:
+        """Every indexed resource of a patient."""
+        with self._lock:
+            return [r for (p, _), by_id in self._resources.items() if p == patient_id for r in by_id.values()]
+
+    def timeline(self):
+        """Temporal index (backend.timeline.Timeline) over every stored resource."""
+        from backend.timeline import Timeline
+
+        with self._lock:
+            if self._timeline is None:
+                self._timeline = Timeline.from_resources(r for by_id in self._resources.values() for r in by_id.values())
+            return self._timeline
+
+    def resource_types(self, patient_id: str) -> List[str]:
+        return sorted(t for (p, t), keys in self._keys.items() if p == patient_id and keys)
+
+    def version(self, resource: dict) -> str:
+        """meta.versionId (+ lastUpdated) if present, else a hash of the resource content."""
+        key = (resource.get("resourceType"), resource.get("id"))
+        tag = self._versions.get(key)
+        if tag is None:
+            meta = resource.get("meta", {})
+            if meta.get("versionId"):
+                tag = f"{meta['versionId']}:{meta.get('lastUpdated', '')}"
+            else:
+                tag = hashlib.sha1(json.dumps(resource, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+            self._versions[key] = tag
+        return tag
+
+    def etag(self, resources: List[dict], *parts) -> str:
+        digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8"))
+        for resource in resources:
+            digest.update(f"|{resource.get('resourceType')}/{resource.get('id')}@{self.version(resource)}".encode("utf-8"))
+        return f'W/"{digest.hexdigest()}"'
+
+    def search(self, patient_id: str, resource_type: str, since: str = None, count: int = DEFAULT_PAGE_SIZE,
+               cursor: str = None) -> Page:
+        """One page of a patient's resources of a type, oldest first.
+
+        Args:
+            since: Only resources dated at or after this ISO date/time.
+            count: Page size (capped at MAX_PAGE_SIZE).
+            cursor: next_cursor of the previous page.
+        """
+        count = max(1, min(int(count), MAX_PAGE_SIZE))
+        since_time = to_timestamp(since) if since else None
+        if since and since_time is None:
+            raise ValueError(f"Invalid _since date: {since}")
+        slot = (patient_id, resource_type)
+        with self._lock:
+            keys = self._keys.get(slot, [])
+            first = bisect.bisect_left(keys, (since_time, "")) if since else 0
+            start = max(first, bisect.bisect_right(keys, decode_cursor(cursor))) if cursor else first
+            page_keys = keys[start:start + count]
+            resources = [self._resources[slot][resource_id] for _, resource_id in page_keys]
+            total = len(keys) - first
+            has_more = start + count < len(keys)
+        next_cursor = encode_cursor(page_keys[-1]) if has_more and page_keys else None
+        etag = self.etag(resources, patient_id, resource_type, since, count, cursor, total)
+        return Page(resources, total, next_cursor, etag, page_keys)
+
+    def __len__(self):
+        return sum(len(keys) for keys in self._keys.values())
+
+
+def resource_url(resource: dict, base_url: str = "") -> str:
+    """URL the API serves a resource at (GET /patients/{patient}/{type}/{id})."""
+    return f"{base_url}patients/{patient_of(resource)}/{resource['resourceType']}/{resource['id']}"
+
+
+def to_bundle(page: Page, self_url: str, next_url: str = None, base_url: str = "") -> dict:
+    """FHIR searchset Bundle for a page; entry fullUrls are the API's own read URLs."""
+    links = [{"relation": "self", "url": self_url}]
+    if next_url:
+        links.append({"relation": "next", "url": next_url})
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": page.total,
+        "link": links,
+        "entry": [{"fullUrl": resource_url(r, base_url), "resource": r} for r in page.resources],
+    }
+
+
+def content_etag(content) -> str:
+    """Weak ETag of a JSON response body, for responses not built from stored resource versions."""
+    return f'W/"{hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check with weak comparison, as HTTP requires for GET."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    strip = lambda tag: tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()
+    return any(strip(tag) == strip(etag) for tag in if_none_match.split(","))
@@ -0,0 +1,269 @@
+"""
+Materialized per-patient summaries in clinic.db.
+
+Summaries are computed when FHIR data is ingested or changes instead of on
+the request path: a worker pool reads the changed bundle files, groups their
+resources by patient, and writes a text summary (summarize_bundle) with a hash
+of the patient's source resources. A patient whose hash is unchanged is not
+rewritten, and files whose size and mtime are unchanged are not even read.
+Rows of patients whose source file is gone, or no longer contains them, are
+deleted. Model-generated summaries are optional, only regenerated for
+patients whose source hash changed, and run as concurrent batches.
+
+Resources are summarized in a canonical order (summary_text), so a patient's
+summary depends only on its resources, not on how a file or store lists them.
+
+Serving a summary is then a primary-key lookup (get_summary).
+
+Usage:
+    python -m backend.patient_summaries
+    python -m backend.patient_summaries --workers 4 --with-model
+    python -m backend.patient_summaries --watch 60      # keep refreshing as files change
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+from backend import fhir_loading
+from backend.patient_store import patient_of
+from backend.timeline import resource_interval
+
+DB_PATH = os.environ.get("AI_CLINIC_DB", "clinic.db")
+
+
+def init_summary_tables(db_path: str = DB_PATH):
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS patient_summaries (
+            patient_id TEXT PRIMARY KEY,
+            source_hash TEXT NOT NULL,
+            source_file TEXT,
+            text_summary TEXT,
+            model_summary TEXT,
+            model_name TEXT,
+            model_source_hash TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Files already materialized, so unchanged files are skipped without reading them
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS summary_sources (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+
+def source_hash(resources: list) -> str:
+    """Order-independent hash of a patient's resources."""
+    digest = hashlib.sha256()
+    for resource in sorted(resources, key=lambda r: (r.get("resourceType", ""), r.get("id", ""))):
+        digest.update(json.dumps(resource, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _summary_order(resource: dict) -> tuple:
+    interval = resource_interval(resource)
+    return (resource.get("resourceType") != "Patient", interval[0] if interval else float("inf"),
+            resource.get("resourceType", ""), resource.get("id", ""))
+
+
+def summary_text(resources: list) -> str:
+    """Text summary of a patient's resources: the Patient first, then the rest oldest first."""
+    ordered = sorted(resources, key=_summary_order)
+    return fhir_loading.summarize_bundle({"entry": [{"resource": r} for r in ordered]})
+
+
+def _summarize_file(path: str) -> list:
+    """Worker: [(patient_id, source_hash, text_summary)] for every patient in one file."""
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"❌ Error reading {os.path.basename(path)}: {e}")
+        return []
+    entries = data.get("entry", []) if data.get("resourceType") == "Bundle" else [{"resource": data}]
+    by_patient = defaultdict(list)
+    for entry in entries:
+        resource = entry.get("resource")
+        if resource:
+            patient_id = patient_of(resource)
+            if patient_id:
+                by_patient[patient_id].append(resource)
+    results = []
+    for patient_id, resources in by_patient.items():
+        results.append((patient_id, source_hash(resources), summary_text(resources)))
+    return results
+
+
+def json_files(data_dir: str) -> list:
+    """Absolute paths of the JSON files in the data directory."""
+    return [os.path.abspath(os.path.join(data_dir, f)) for f in sorted(os.listdir(data_dir)) if f.endswith(".json")]
+
+
+def changed_files(data_dir: str, db_path: str = DB_PATH) -> list:
+    """(path, size, mtime) of JSON files that are new or changed since they were last materialized."""
+    conn = sqlite3.connect(db_path)
+    seen = {path: (size, mtime) for path, size, mtime in conn.execute("SELECT path, size, mtime FROM summary_sources")}
+    conn.close()
+    changed = []
+    for path in json_files(data_dir):
+        stat = os.stat(path)
+        if seen.get(path) != (stat.st_size, stat.st_mtime):
+            changed.append((path, stat.st_size, stat.st_mtime))
+    return changed
+
+
+def prune_summaries(conn: sqlite3.Connection, present: list) -> int:
+    """Delete summaries and file records whose source file no longer exists; returns patients removed."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS present_files (path TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM present_files")
+    conn.executemany("INSERT OR IGNORE INTO present_files (path) VALUES (?)", [(p,) for p in present])
+    removed = conn.execute("""
+        DELETE FROM patient_summaries WHERE source_file IS NULL OR source_file NOT IN (SELECT path FROM present_files)
+    """).rowcount
+    conn.execute("DELETE FROM summary_sources WHERE path NOT IN (SELECT path FROM present_files)")
+    conn.commit()
+    return removed
+
+
+def refresh_summaries(data_dir: str = None, db_path: str = DB_PATH, workers: int = None) -> dict:
+    """Recompute text summaries for patients in new or changed files and drop those whose source is gone.
+
+    Returns counts of files read and patients written / left unchanged / removed.
+    """
+    data_dir = data_dir or fhir_loading.DATA_DIR
+    init_summary_tables(db_path)
+    files = changed_files(data_dir, db_path)
+    stats = {"files": len(files), "updated": 0, "unchanged": 0, "removed": 0}
+    conn = sqlite3.connect(db_path)
+    if not files:
+        stats["removed"] = prune_summaries(conn, json_files(data_dir))
+        conn.close()
+        return stats
+    known = {patient_id: (digest, source_file) for patient_id, digest, source_file
+             in conn.execute("SELECT patient_id, source_hash, source_file FROM patient_summaries")}
+    with Pool(workers) as pool:
+        for (path, size, mtime), results in zip(files, pool.imap(_summarize_file, [f[0] for f in files])):
+            for patient_id, digest, summary in results:
+                if known.get(patient_id, (None,))[0] == digest:
+                    stats["unchanged"] += 1
+                    if known[patient_id][1] != path:  # same resources, moved to another file
+                        conn.execute("UPDATE patient_summaries SET source_file = ? WHERE patient_id = ?", (path, patient_id))
+                        known[patient_id] = (digest, path)
+                    continue
+                conn.execute("""
+                    INSERT INTO patient_summaries (patient_id, source_hash, source_file, text_summary, updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(patient_id) DO UPDATE SET
+                        source_hash = excluded.source_hash, source_file = excluded.source_file,
+                        text_summary = excluded.text_summary, updated_at = CURRENT_TIMESTAMP
+                """, (patient_id, digest, path, summary))
+                known[patient_id] = (digest, path)
+                stats["updated"] += 1
+            # Patients this file no longer contains
+            current = [patient_id for patient_id, _, _ in results]
+            stats["removed"] += conn.execute(f"""
+                DELETE FROM patient_summaries WHERE source_file = ? AND patient_id NOT IN ({",".join("?" * len(current))})
+            """, [path] + current).rowcount
+            conn.execute("INSERT OR REPLACE INTO summary_sources (path, size, mtime) VALUES (?, ?, ?)", (path, size, mtime))
+            conn.commit()  # per file, so an interrupted run resumes where it stopped
+    stats["removed"] += prune_summaries(conn, json_files(data_dir))
+    conn.close()
+    return stats
+
+
+def refresh_model_summaries(summarize_batch, model_name: str, db_path: str = DB_PATH, batch_size: int = 8,
+                            workers: int = 2) -> int:
+    """Generate model summaries for patients whose source changed since their last one.
+
+    Args:
+        summarize_batch: Callable mapping a list of texts to a list of summaries.
+        model_name: Stored with each summary; a different model regenerates everything.
+        workers: Batches generated concurrently. Threads share the one loaded
+            model; a process pool would load a copy per worker.
+    """
+    conn = sqlite3.connect(db_path)
+    pending = conn.execute("""
+        SELECT patient_id, source_hash, text_summary FROM patient_summaries
+        WHERE model_source_hash IS NOT source_hash OR model_name IS NOT ?
+    """, (model_name,)).fetchall()
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    generate = lambda batch: summarize_batch([text or "" for _, _, text in batch])
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for batch, summaries in zip(batches, pool.map(generate, batches)):
+            conn.executemany("""
+                UPDATE patient_summaries SET model_summary = ?, model_name = ?, model_source_hash = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE patient_id = ? AND source_hash = ?
+            """, [(summary, model_name, digest, patient_id, digest)
+                  for (patient_id, digest, _), summary in zip(batch, summaries)])
+            conn.commit()
+    conn.close()
+    return len(pending)
+
+
+def get_summary(patient_id: str, db_path: str = DB_PATH) -> dict:
+    """Materialized summary for one patient, or None if it hasn't been computed."""
+    if not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("""
+            SELECT patient_id, source_hash, text_summary, model_summary, model_name, model_source_hash, updated_at
+            FROM patient_summaries WHERE patient_id = ?
+        """, (patient_id,)).fetchone()
+    except sqlite3.OperationalError:  # table not created yet
+        row = None
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {
+        'patient_id': row[0], 'source_hash': row[1], 'text_summary': row[2],
+        'model_summary': row[3] if row[5] == row[1] else None, 'model_name': row[4], 'updated_at': row[6]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialize per-patient summaries into clinic.db.")
+    parser.add_argument("--data-dir", default=fhir_loading.DATA_DIR)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--workers", type=int, default=None, help="default: one per core")
+    parser.add_argument("--with-model", action="store_true", help="also generate BART summaries")
+    parser.add_argument("--model-workers", type=int, default=2, help="model summary batches generated concurrently")
+    parser.add_argument("--watch", type=float, metavar="SECONDS", help="re-check for changed files this often")
+    args = parser.parse_args()
+
+    summarize_batch, model_name = None, None
+    if args.with_model:
+        from backend.service_loading import NOTES_API_PATH, load_service_module
+        notes_api = load_service_module(NOTES_API_PATH, "clinical_notes_api")
+        summarize_batch, model_name = notes_api.summarize_batch, notes_api.MODEL_NAME
+
+    while True:
+        started = time.perf_counter()
+        stats = refresh_summaries(args.data_dir, args.db, args.workers)
+        generated = refresh_model_summaries(summarize_batch, model_name, args.db,
+                                            workers=args.model_workers) if summarize_batch else 0
+        if stats["files"] or stats["removed"] or generated or not args.watch:
+            print(f"✅ {stats['files']} files read, {stats['updated']} summaries updated, "
+                  f"{stats['unchanged']} unchanged, {stats['removed']} removed, {generated} model summaries "
+                  f"({time.perf_counter() - started:.1f}s)")
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Optional
+
+from backend import metrics
+
+# Near-duplicate answer cache for the assistant. Queries are embedded as sparse,
+# L2-normalized bags of content words and character trigrams, so rewordings that
+# differ in word order, filler words, plurals or punctuation ("What are the
+# treatment options for asthma?" / "asthma treatment option") land close
+# together while a different condition or drug does not. Lookups go
+# through an inverted index from feature to entries, so only entries sharing at
+# least one feature with the query are scored.
+#
+# Similarity alone cannot tell "type 1" from "type 2" diabetes or "with" from
+# "without warfarin", so a candidate only counts as a hit when its key terms
+# (numbers, negations and every content word other than generic question
+# filler) are exactly those of the query; the similarity threshold then only
+# absorbs word order, filler words, plurals and punctuation.
+#
+# Entries are scoped (model + user + patient record content); an answer is only
+# ever reused for the same scope.
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+_STOPWORDS = frozenset("""
+    a an and any are as at be can could do does for from give how i in is it me my of on or please should
+    tell that the there this to was what when which who why will with would you your about available possible
+""".split())
+
+# Question filler that may differ between two askings of the same question.
+_FILLER = frozenset("""
+    explain describe list know need tell information info detail best common usual typical main way
+    thing option like also much many more most some get used use help overview
+""".split())
+
+_NUMBER_WORDS = {
+    "zero": "0", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+    "six": "6", "seven": "7", "eight": "8", "nine": "9", "ten": "10",
+}
+
+TRIGRAM_WEIGHT = 0.35
+
+
+def _stem(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def embed(text: str) -> dict:
+    """Sparse unit vector (feature -> weight) for a query."""
+    words = [_stem(w) for w in _WORD.findall(text.lower()) if w not in _STOPWORDS]
+    vector = defaultdict(float)
+    for word in words:
+        vector["w:" + word] += 1.0
+        padded = f"^{word}$"
+        for i in range(len(padded) - 2):
+            vector["c:" + padded[i:i + 3]] += TRIGRAM_WEIGHT
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {f: v / norm for f, v in vector.items()} if norm else {}
+
+
+def key_terms(text: str) -> frozenset:
+    """Words two queries must share for one's answer to be reused for the other."""
+    words = (_stem(w) for w in _WORD.findall(text.lower()) if w not in _STOPWORDS)
+    return frozenset(_NUMBER_WORDS.get(w, w) for w in words if w not in _FILLER)
+
+
+@dataclass
+class CachedAnswer:
+    entry_id: int
+    scope: str
+    query: str
+    response: str
+    created_at: float  # epoch seconds
+    vector: dict
+    terms: frozenset
+
+
+@dataclass
+class CacheHit:
+    response: str
+    query: str          # the earlier query the answer was generated for
+    similarity: float
+    created_at: float
+
+
+class SemanticCache:
+    """Thread-safe, size- and TTL-bounded nearest-neighbour cache of answers."""
+
+    def __init__(self, threshold: float = 0.9, max_entries: int = 5000, ttl_seconds: float = 7 * 24 * 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()        # entry id -> CachedAnswer, least recently used first
+        self._postings = defaultdict(set)    # (scope, feature) -> entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "SemanticCache":
+        return cls(
+            threshold=float(os.environ.get("AI_CLINIC_SEMANTIC_CACHE_THRESHOLD", 0.9)),
+            max_entries=int(os.environ.get("AI_CLINIC_SEMANTIC_CACHE_SIZE", 5000)),
+            ttl_seconds=float(os.environ.get("AI_CLINIC_SEMANTIC_CACHE_TTL_HOURS", 168)) * 3600,
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def configure(self, threshold: float = None, max_entries: int = None, ttl_seconds: float = None):
+        with self._lock:
+            if threshold is not None:
+                self.threshold = threshold
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if ttl_seconds is not None:
+                self.ttl_seconds = ttl_seconds
+            self._evict(time.time())
+
+    def lookup(self, scope: str, query: str, now: float = None) -> Optional[CacheHit]:
+        """Most similar unexpired answer in scope at or above the threshold with the same key terms."""
+        now = time.time() if now is None else now
+        vector = embed(query)
+        terms = key_terms(query)
+        scores = defaultdict(float)
+        with self._lock:
+            for feature, weight in vector.items():
+                for entry_id in self._postings.get((scope, feature), ()):
+                    scores[entry_id] += weight * self._entries[entry_id].vector[feature]
+            best = None
+            for entry_id, score in sorted(scores.items(), key=lambda kv: kv[1], reverse=True):
+                if score < self.threshold:
+                    break
+                entry = self._entries[entry_id]
+                if now - entry.created_at > self.ttl_seconds:
+                    self._remove(entry_id)
+                    continue
+                if entry.terms != terms:
+                    continue
+                self._entries.move_to_end(entry_id)
+                best = CacheHit(entry.response, entry.query, min(score, 1.0), entry.created_at)
+                break
+        metrics.record_cache("semantic_answer", best is not None)
+        return best
+
+    def add(self, scope: str, query: str, response: str, created_at: float = None, truncated: bool = False):
+        """Cache an answer; truncated (e.g. cut short at a deadline) answers are never stored."""
+        vector = embed(query)
+        if not vector or not response or truncated:
+            return
+        created_at = time.time() if created_at is None else created_at
+        with self._lock:
+            entry = CachedAnswer(self._next_id, scope, query, response, created_at, vector, key_terms(query))
+            self._next_id += 1
+            self._entries[entry.entry_id] = entry
+            for feature in vector:
+                self._postings[(scope, feature)].add(entry.entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, scope_prefix: str = None) -> int:
+        """Drop every entry, or those whose scope starts with scope_prefix (e.g. a model id)."""
+        with self._lock:
+            doomed = [i for i, e in self._entries.items() if scope_prefix is None or e.scope.startswith(scope_prefix)]
+            for entry_id in doomed:
+                self._remove(entry_id)
+        return len(doomed)
+
+    def _evict(self, now: float):
+        # Expired entries are otherwise only dropped when a lookup reaches them.
+        expired = [i for i, e in self._entries.items() if now - e.created_at > self.ttl_seconds]
+        for entry_id in expired:
+            self._remove(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        for feature in entry.vector:
+            ids = self._postings.get((entry.scope, feature))
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._postings[(entry.scope, feature)]
@@ -0,0 +1,198 @@
+"""
+Pre-forking multi-worker launcher for the notes API (Flask) and the
+ClinicalBERT API (FastAPI).
+
+The parent process loads the service module - and with it the model weights,
+the note index, the patient store and the token store - once, then forks the workers. Workers
+share those pages copy-on-write: model inference never writes to the weight
+tensors, and gc.freeze() keeps the garbage collector from touching the
+parent's objects, so an extra worker costs little more than its own request
+state. With --mmap-weights the weights are additionally served from a
+memory-mapped file (see backend/model_loading.py), which keeps them shared
+even if a worker is restarted or started without fork.
+
+Every worker accepts connections on the same listening socket and caps its
+PyTorch thread pool, so N workers x T threads never oversubscribes the cores.
+Each worker keeps its own /metrics counters.
+
+Usage:
+    python -m backend.serve notes --workers 4 --port 5000
+    python -m backend.serve clinicalbert --workers 2 --threads-per-worker 4 --port 8000 --mmap-weights weights
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+from backend.model_loading import MMAP_WEIGHTS_ENV
+from backend.service_loading import CLINICALBERT_API_PATH, NOTES_API_PATH, load_service_module
+
+SERVICES = {
+    # name: (script, module name, interface)
+    "notes": (NOTES_API_PATH, "clinical_notes_api", "wsgi"),
+    "clinicalbert": (CLINICALBERT_API_PATH, "clinicalbert_api", "asgi"),
+}
+
+_THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def default_threads(workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def cap_threads(threads: int):
+    """Limit the BLAS/OpenMP pools; must run before torch is imported to fully apply."""
+    for var in _THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    # Rust tokenizers spawn their own pool and warn (or deadlock) when used across fork.
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    if "torch" in sys.modules:
+        import torch
+        torch.set_num_threads(threads)
+
+
+def load_service(name: str):
+    """Import the service and build everything it would otherwise build lazily per worker."""
+    path, module_name, _ = SERVICES[name]
+    module = load_service_module(path, module_name)
+    for builder in ("get_note_index", "get_patient_store"):
+        if hasattr(module, builder):
+            getattr(module, builder)()
+    return module
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve_worker(module, interface: str, sock: socket.socket, threads: int):
+    """Worker body: serve requests from the shared socket until terminated."""
+    cap_threads(threads)
+    if interface == "wsgi":
+        from werkzeug.serving import make_server
+        host, port = sock.getsockname()[:2]
+        make_server(host, port, module.app, threaded=True, fd=sock.fileno()).serve_forever()
+    else:
+        import uvicorn
+        uvicorn.Server(uvicorn.Config(module.app, fd=sock.fileno(), log_level="warning")).run()
+
+
+def proportional_set_size_mb(pid: int) -> float:
+    """PSS of a process: its private pages plus its share of pages shared with other processes."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def report_memory(pids: list):
+    for pid in [os.getpid()] + pids:
+        pss = proportional_set_size_mb(pid)
+        if pss is not None:
+            role = "parent" if pid == os.getpid() else "worker"
+            print(f"   {role} {pid}: PSS {pss:.1f} MB")
+
+
+class Prefork:
+    """Fork and supervise workers; a worker that dies is replaced."""
+
+    def __init__(self, module, interface: str, sock: socket.socket, workers: int, threads: int):
+        self.module = module
+        self.interface = interface
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            # The parent's handlers forward signals to workers; a worker just exits.
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                serve_worker(self.module, self.interface, self.sock, self.threads)
+            finally:
+                os._exit(0)
+        self.children[pid] = time.time()
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self, memory_report_after: float = None):
+        # Everything loaded so far is treated as permanent: the collector won't
+        # walk (and so won't write to) these objects in the workers.
+        gc.collect()
+        gc.freeze()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        print(f"✅ {self.workers} workers x {self.threads} threads on {self.sock.getsockname()[0]}:{self.sock.getsockname()[1]}")
+        reported = memory_report_after is None
+        started = time.time()
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                if not reported and time.time() - started >= memory_report_after:
+                    report_memory(list(self.children))
+                    reported = True
+                time.sleep(0.2)
+                continue
+            started_at = self.children.pop(pid, None)
+            if started_at is not None and not self.stopping:
+                print(f"⚠️ Worker {pid} exited with status {status}; restarting")
+                if time.time() - started_at < 1.0:
+                    time.sleep(1.0)  # don't spin if workers die at startup
+                self.spawn()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an AI-Clinic API with pre-forked workers sharing one model copy.")
+    parser.add_argument("service", choices=sorted(SERVICES))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="default: 5000 for notes, 8000 for clinicalbert")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads-per-worker", type=int, default=None, help="default: cores // workers")
+    parser.add_argument("--mmap-weights", metavar="DIR", help="serve weights from memory-mapped files in DIR")
+    parser.add_argument("--memory-report", type=float, metavar="SECONDS", default=None,
+                        help="print each process's PSS this many seconds after start (Linux)")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        parser.error("pre-fork serving needs a POSIX system; run the service directly instead")
+    threads = args.threads_per_worker or default_threads(args.workers)
+    port = args.port or (5000 if args.service == "notes" else 8000)
+
+    # Thread caps and weight mapping have to be in place before the model loads.
+    cap_threads(threads)
+    if args.mmap_weights:
+        os.environ[MMAP_WEIGHTS_ENV] = args.mmap_weights
+    sock = bind_socket(args.host, port)
+    module = load_service(args.service)
+    Prefork(module, SERVICES[args.service][2], sock, args.workers, threads).run(args.memory_report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import importlib.util
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The service scripts have spaces in their file names, so they can't be imported
+# with a plain import statement.
+NOTES_API_PATH = os.path.join(REPO_ROOT, "Ai engine", "clinical notes api.py")
+CLINICALBERT_API_PATH = os.path.join(REPO_ROOT, "clinicalbert api2.py")
+STREAMLIT_APP_PATH = os.path.join(REPO_ROOT, "app.py")
+
+
+def load_service_module(path: str, name: str = None):
+    """Import a service script by path and return the module.
+
+    The module is registered in sys.modules so repeated calls return the same
+    instance (and its models are only loaded once per process).
+    """
+    name = name or os.path.splitext(os.path.basename(path))[0].replace(" ", "_")
+    if name in sys.modules:
+        return sys.modules[name]
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import json
+import threading
+
+from backend import metrics
+
+# Coalescing of identical model calls that are in flight at the same time.
+#
+# When several clinicians ask the same thing at once (same patient, same quick
+# template, same /query body), the first caller runs the model and everyone
+# who arrives with the same key before it finishes waits for that result
+# instead of starting another generation. Nothing is kept once the call
+# returns; answers that should outlive the call belong in a cache.
+#
+# Followers get the leader's result object itself, so callers must treat it as
+# read-only. If the leader raises, every follower gets the same exception.
+#
+# Calls with a per-request deadline are not coalesced (pass key=None): a
+# follower could otherwise wait past its own deadline behind a looser one, or
+# get an answer truncated by a tighter one.
+
+
+def flight_key(*parts) -> str:
+    """Key for a call: strings are whitespace-normalized, everything else is JSON-encoded."""
+    normalized = [" ".join(p.split()) if isinstance(p, str) else p for p in parts]
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """One in-flight computation per key; duplicates wait for its result."""
+
+    def __init__(self, service: str):
+        self.service = service
+        self._calls = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn, *args, **kwargs):
+        """fn(*args, **kwargs), unless a call with this key is already running; then its result.
+
+        With key None the call always runs on its own.
+        """
+        if key is None:
+            return fn(*args, **kwargs)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            metrics.COALESCED.inc(self.service, "follower")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        metrics.COALESCED.inc(self.service, "leader")
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key: str, fn, *args):
+        """Coroutine version of do(); the leader runs fn in a worker thread so the event loop stays free."""
+        if key is None:
+            return await asyncio.to_thread(fn, *args)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+            if leader:
+                future = self._futures[key] = loop.create_future()
+        if not leader:
+            metrics.COALESCED.inc(self.service, "follower")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():  # this request was cancelled, not the leader's
+                    raise
+                return await self.do_async(key, fn, *args)
+        metrics.COALESCED.inc(self.service, "leader")
+        try:
+            result = await asyncio.to_thread(fn, *args)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved; followers still get it
+            raise
+        finally:
+            with self._lock:
+                self._futures.pop(key, None)
+
+    def saved(self) -> int:
+        """Model calls avoided so far by joining an identical call in flight."""
+        return int(metrics.COALESCED.value(self.service, "follower"))
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._futures)
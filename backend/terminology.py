@@ -0,0 +1,205 @@
+import bisect
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+# Terminology index built from the codings in the ingested FHIR data.
+#
+# Every distinct (system, code) becomes a Concept, with the displays and
+# CodeableConcept texts seen for it as its names (synonyms). Autocomplete is a
+# sorted array of (normalized key, concept) pairs: each name is indexed from
+# the start of every word, so "mell" finds "Diabetes mellitus type 2", and the
+# code itself is a key too. A prefix query is one bisection plus a scan of the
+# matching run, which keeps it well under a millisecond for the few thousand
+# codes a Synthea corpus carries.
+
+SYSTEM_NAMES = {
+    "http://snomed.info/sct": "SNOMED CT",
+    "http://loinc.org": "LOINC",
+    "http://www.nlm.nih.gov/research/umls/rxnorm": "RxNorm",
+    "http://hl7.org/fhir/sid/cvx": "CVX",
+}
+
+# CodeableConcept fields that name what a resource is about (not its status or category)
+_CONCEPT_FIELDS = ("code", "medicationCodeableConcept", "vaccineCode", "type", "reasonCode")
+
+_WORD_START = re.compile(r"(?:^|(?<=[\s(\[/,-]))\w")
+# SNOMED CT semantic tag, e.g. "Diabetes mellitus type 2 (disorder)"
+_SEMANTIC_TAG = re.compile(r"\s*\((?:disorder|finding|procedure|situation|observable entity|regime/therapy)\)$",
+                           re.IGNORECASE)
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+@dataclass(eq=False)
+class Concept:
+    system: str
+    code: str
+    display: str
+    synonyms: List[str] = field(default_factory=list)
+    resource_types: set = field(default_factory=set)
+    count: int = 0  # times the code occurs in the data
+
+    @property
+    def system_name(self) -> str:
+        return SYSTEM_NAMES.get(self.system, self.system)
+
+    @property
+    def short_display(self) -> str:
+        """Display without a SNOMED semantic tag, as a clinician would type it."""
+        return _SEMANTIC_TAG.sub("", self.display)
+
+    def label(self) -> str:
+        return f"{self.display} ({self.system_name} {self.code})"
+
+
+class TerminologyIndex:
+    def __init__(self):
+        self._concepts = {}     # (system, code) -> Concept
+        self._by_code = {}      # code -> Concept (first system seen)
+        self._by_name = {}      # normalized name -> [Concept]
+        self._keys = []         # sorted normalized keys
+        self._key_concepts = []  # concept for each key
+        self._key_whole = []    # key is the start of a whole name (not a later word)
+        self._dirty = False
+
+    # --- building ---
+
+    def add_coding(self, coding: dict, text: str = None, resource_type: str = None):
+        system, code = coding.get("system"), coding.get("code")
+        if not code:
+            return
+        concept = self._concepts.get((system, code))
+        if concept is None:
+            display = coding.get("display") or text or code
+            concept = self._concepts[(system, code)] = Concept(system, code, display)
+            self._by_code.setdefault(code, concept)
+        for name in (coding.get("display"), text):
+            if name and name != concept.display and name not in concept.synonyms:
+                concept.synonyms.append(name)
+        if resource_type:
+            concept.resource_types.add(resource_type)
+        concept.count += 1
+        self._dirty = True
+
+    def add_resource(self, resource: dict):
+        resource_type = resource.get("resourceType")
+        for name in _CONCEPT_FIELDS:
+            value = resource.get(name)
+            for concept in (value if isinstance(value, list) else [value]):
+                if isinstance(concept, dict):
+                    for coding in concept.get("coding") or []:
+                        if isinstance(coding, dict):
+                            self.add_coding(coding, concept.get("text"), resource_type)
+
+    @classmethod
+    def from_bundle(cls, bundle: dict) -> "TerminologyIndex":
+        index = cls()
+        for entry in bundle.get("entry", []):
+            index.add_resource(entry.get("resource", {}))
+        return index
+
+    @classmethod
+    def from_directory(cls, data_dir: str = None) -> "TerminologyIndex":
+        """Index every FHIR file in the data directory, one file in memory at a time."""
+        from backend import fhir_loading
+
+        data_dir = data_dir or fhir_loading.DATA_DIR
+        index = cls()
+        for file in os.listdir(data_dir):
+            if not file.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(data_dir, file), "r") as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"❌ Error reading {file}: {e}")
+                continue
+            if data.get("resourceType") == "Bundle":
+                for entry in data.get("entry", []):
+                    index.add_resource(entry.get("resource", {}))
+            else:
+                index.add_resource(data)
+        index._build()
+        print(f"✅ Indexed {len(index)} codes")
+        return index
+
+    def _build(self):
+        entries = []
+        by_name = {}
+        for concept in self._concepts.values():
+            for name in [concept.display] + concept.synonyms:
+                normalized = normalize(name)
+                untagged = _SEMANTIC_TAG.sub("", normalized)
+                for exact in {normalized, untagged}:
+                    if concept not in by_name.setdefault(exact, []):
+                        by_name[exact].append(concept)
+                # Word starts come from the name without its semantic tag, so
+                # "dis" does not match every "(disorder)"
+                entries.extend((untagged[m.start():], concept, m.start() == 0)
+                               for m in _WORD_START.finditer(untagged))
+            entries.append((concept.code.lower(), concept, True))
+        entries.sort(key=lambda entry: entry[0])
+        self._keys = [key for key, _, _ in entries]
+        self._key_concepts = [concept for _, concept, _ in entries]
+        self._key_whole = [whole for _, _, whole in entries]
+        self._by_name = by_name
+        self._dirty = False
+
+    # --- lookups ---
+
+    def complete(self, prefix: str, limit: int = 10, resource_type: str = None, max_scan: int = 2000) -> List[Concept]:
+        """Concepts with a name word or code starting with prefix; name/code-start matches first, then the most used.
+
+        Args:
+            resource_type: Only codes seen on this resource type (e.g. "Condition").
+            max_scan: Upper bound on index keys looked at, for very short prefixes.
+        """
+        if self._dirty:
+            self._build()
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self._keys, prefix)
+        found = {}
+        for i in range(start, min(start + max_scan, len(self._keys))):
+            key = self._keys[i]
+            if not key.startswith(prefix):
+                break
+            concept = self._key_concepts[i]
+            if resource_type and resource_type not in concept.resource_types:
+                continue
+            whole = self._key_whole[i]
+            rank = found.get(id(concept))
+            if rank is None or whole > rank[0]:
+                found[id(concept)] = (whole, concept)
+        ranked = sorted(found.values(), key=lambda r: (not r[0], -r[1].count, r[1].display))
+        return [concept for _, concept in ranked[:limit]]
+
+    def get(self, code: str, system: str = None) -> Optional[Concept]:
+        if system is not None:
+            return self._concepts.get((system, code))
+        return self._by_code.get(code)
+
+    def match_name(self, text: str, resource_type: str = None) -> Optional[Concept]:
+        """The most used concept whose display or synonym is exactly text (ignoring case, spacing and a SNOMED tag)."""
+        if self._dirty:
+            self._build()
+        candidates = [c for c in self._by_name.get(normalize(text or ""), [])
+                      if not resource_type or resource_type in c.resource_types]
+        return max(candidates, key=lambda c: c.count, default=None)
+
+    def codes_for(self, text: str, resource_type: str = None, limit: int = 50) -> set:
+        """Codes a search string refers to: a code typed as-is, or concepts whose names start with it."""
+        codes = {c.code for c in self.complete(text, limit=limit, resource_type=resource_type)}
+        concept = self.get(text.strip())
+        if concept is not None and (not resource_type or resource_type in concept.resource_types):
+            codes.add(concept.code)
+        return codes
+
+    def __len__(self):
+        return len(self._concepts)
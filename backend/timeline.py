@@ -0,0 +1,195 @@
+import bisect
+from datetime import date, datetime, timezone
+from typing import Iterable, List, Optional
+
+from backend.fhir_records import (ConditionRecord, EncounterRecord, ImmunizationRecord, MedicationRequestRecord,
+                                  ObservationRecord, ProcedureRecord, RecordSet, parse_instant)
+
+# Per-patient temporal index over FHIR resources (or compact records).
+#
+# Every dated item becomes an interval [start, end] in epoch seconds: an
+# Encounter's period, a Condition from onset to abatement (open-ended while it
+# is still active), and a single instant for Observations, Procedures,
+# MedicationRequests and the like. Intervals are sorted by start and laid out
+# as an implicit balanced tree (the middle of each range is its root) with the
+# maximum end of every subtree, so an overlap query skips whole subtrees that
+# end before the window and never visits anything that starts after it.
+# A sorted start list per resource type answers "N most recent of type X" with
+# one bisection.
+
+OPEN_END = float("inf")
+
+# Condition clinicalStatus codes that mean "still going"
+_ACTIVE_STATUSES = ("active", "recurrence", "relapse")
+
+_PERIOD_FIELDS = ("period", "effectivePeriod", "performedPeriod", "onsetPeriod")
+_INSTANT_FIELDS = ("effectiveDateTime", "onsetDateTime", "performedDateTime", "occurrenceDateTime", "authoredOn",
+                   "recordedDate", "issued", "date", "created")
+
+
+def to_timestamp(value) -> Optional[float]:
+    """datetime, date, ISO string or number -> epoch seconds (naive times are taken as UTC)."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = parse_instant(value)
+        if value is None:
+            return None
+    elif isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def resource_interval(resource: dict) -> Optional[tuple]:
+    """(start, end) of a FHIR resource dict in epoch seconds, or None if it isn't dated."""
+    if resource.get("resourceType") == "Patient":
+        return None
+    start = end = None
+    for name in _PERIOD_FIELDS:
+        period = resource.get(name)
+        if isinstance(period, dict) and period.get("start"):
+            start, end = to_timestamp(period["start"]), to_timestamp(period.get("end"))
+            break
+    if start is None:
+        for name in _INSTANT_FIELDS:
+            if resource.get(name):
+                start = to_timestamp(resource[name])
+                if start is not None:
+                    break
+    if start is None:
+        return None
+    if resource.get("resourceType") == "Condition":
+        end = to_timestamp(resource.get("abatementDateTime"))
+        if end is None:
+            coding = ((resource.get("clinicalStatus") or {}).get("coding") or [{}])[0]
+            end = OPEN_END if coding.get("code") in _ACTIVE_STATUSES else start
+    return start, end if end is not None and end >= start else start
+
+
+def record_interval(record) -> Optional[tuple]:
+    """(start, end) of a compact record, or None if it isn't dated."""
+    if isinstance(record, EncounterRecord):
+        start, end = to_timestamp(record.start), to_timestamp(record.end)
+    elif isinstance(record, ConditionRecord):
+        start, end = to_timestamp(record.onset), to_timestamp(record.abatement)
+        if start is not None and end is None:
+            end = OPEN_END if record.clinical_status in _ACTIVE_STATUSES else start
+    elif isinstance(record, ObservationRecord):
+        start = end = to_timestamp(record.effective)
+    elif isinstance(record, MedicationRequestRecord):
+        start = end = to_timestamp(record.authored_on)
+    elif isinstance(record, ProcedureRecord):
+        start = end = to_timestamp(record.performed)
+    elif isinstance(record, ImmunizationRecord):
+        start = end = to_timestamp(record.occurrence)
+    else:
+        return None
+    if start is None:
+        return None
+    return start, end if end is not None and end >= start else start
+
+
+class PatientTimeline:
+    """Static interval index of one patient's dated items."""
+
+    def __init__(self, entries: Iterable[tuple]):
+        """entries: (start, end, resource type, item) tuples, in any order."""
+        entries = sorted(entries, key=lambda e: (e[0], e[1]))
+        self.starts = [e[0] for e in entries]
+        self.ends = [e[1] for e in entries]
+        self.types = [e[2] for e in entries]
+        self.items = [e[3] for e in entries]
+        self._max_end = [0.0] * len(entries)
+        self._build(0, len(entries))
+        self._by_type = {}  # type -> ([start], [item]), both sorted by start
+        for start, _, resource_type, item in entries:
+            starts, items = self._by_type.setdefault(resource_type, ([], []))
+            starts.append(start)
+            items.append(item)
+
+    def _build(self, lo: int, hi: int) -> float:
+        if lo >= hi:
+            return -OPEN_END
+        mid = (lo + hi) // 2
+        self._max_end[mid] = max(self.ends[mid], self._build(lo, mid), self._build(mid + 1, hi))
+        return self._max_end[mid]
+
+    def overlapping(self, start=None, end=None, types=None) -> list:
+        """Items whose interval overlaps [start, end] (either side open if None), oldest first."""
+        t0 = to_timestamp(start) if start is not None else -OPEN_END
+        t1 = to_timestamp(end) if end is not None else OPEN_END
+        found = []
+        stack = [(0, len(self.starts))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self._max_end[mid] < t0:  # everything under this node ended before the window
+                continue
+            stack.append((lo, mid))
+            if self.starts[mid] <= t1:
+                if self.ends[mid] >= t0 and (types is None or self.types[mid] in types):
+                    found.append(mid)
+                stack.append((mid + 1, hi))
+        return [self.items[i] for i in sorted(found)]
+
+    def most_recent(self, resource_type: str, n: int = 1, before=None) -> list:
+        """Newest n items of a type that started at or before `before` (default: any time), newest first."""
+        starts, items = self._by_type.get(resource_type, ([], []))
+        stop = bisect.bisect_right(starts, to_timestamp(before)) if before is not None else len(starts)
+        return items[max(0, stop - n):stop][::-1]
+
+    def resource_types(self) -> List[str]:
+        return sorted(self._by_type)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class Timeline:
+    """PatientTimeline per patient."""
+
+    def __init__(self, entries: Iterable[tuple] = ()):
+        """entries: (patient id, start, end, resource type, item) tuples."""
+        by_patient = {}
+        for patient_id, start, end, resource_type, item in entries:
+            by_patient.setdefault(patient_id, []).append((start, end, resource_type, item))
+        self._patients = {patient_id: PatientTimeline(e) for patient_id, e in by_patient.items()}
+
+    @classmethod
+    def from_resources(cls, resources: Iterable[dict]) -> "Timeline":
+        from backend.patient_store import patient_of
+
+        def entries():
+            for resource in resources:
+                interval = resource_interval(resource)
+                patient_id = patient_of(resource)
+                if interval and patient_id:
+                    yield patient_id, interval[0], interval[1], resource.get("resourceType"), resource
+        return cls(entries())
+
+    @classmethod
+    def from_records(cls, records: RecordSet) -> "Timeline":
+        def entries():
+            for record in records.records:
+                interval = record_interval(record)
+                if interval and record.patient_id:
+                    yield record.patient_id, interval[0], interval[1], record.resource_type, record
+        return cls(entries())
+
+    def patient(self, patient_id: str) -> PatientTimeline:
+        return self._patients.get(patient_id) or PatientTimeline(())
+
+    def overlapping(self, patient_id: str, start=None, end=None, types=None) -> list:
+        return self.patient(patient_id).overlapping(start, end, types)
+
+    def most_recent(self, patient_id: str, resource_type: str, n: int = 1, before=None) -> list:
+        return self.patient(patient_id).most_recent(resource_type, n, before)
+
+    def __len__(self):
+        return sum(len(p) for p in self._patients.values())
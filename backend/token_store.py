@@ -0,0 +1,267 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+
+from backend import metrics
+
+# Token ids of the FHIR-derived snippets, computed once per tokenizer at
+# ingest time. Ids live back to back in a single int32 arena with an
+# (offset, length) index, so request-time input assembly is a concatenation of
+# array slices followed by the tokenizer's special tokens.
+#
+# Snippets are content-addressed (hash of the text), so a note whose text
+# changes is simply tokenized again and identical texts are stored once.
+# Snippets are tokenized without special tokens; WordPiece and byte-level BPE
+# both split on whitespace first, so concatenating separately tokenized
+# snippets gives the same ids as tokenizing the joined text up to the
+# word-boundary marker on the first token of each snippet.
+#
+# Only the ingested corpus is permanent. Texts first seen at request time
+# (questions, notes added after the last ingest) go to a scratch LRU of
+# RUNTIME_ENTRIES texts, so a long-running service does not grow the arena
+# with every query it is asked.
+
+TOKEN_STORE_DIR = os.environ.get("AI_CLINIC_TOKEN_STORE", "token_store")
+RUNTIME_ENTRIES = int(os.environ.get("AI_CLINIC_TOKEN_STORE_RUNTIME_ENTRIES", 10000))
+
+# Which texts each service assembles from its store, so ingest fills each
+# arena with what is actually read: note text for the BART summarizer and the
+# patient header /clinical-query puts before the question for ClinicalBERT.
+INGEST_SOURCES = {
+    "emilyalsentzer/Bio_ClinicalBERT": "patient_headers",
+    "facebook/bart-large-cnn": "notes",
+}
+
+# Tokenizers the ingest stage builds arenas for by default.
+DEFAULT_MODELS = list(INGEST_SOURCES)
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Hash of the vocabulary, so an arena is never read with the wrong tokenizer."""
+    vocab = sorted(tokenizer.get_vocab().items())
+    return hashlib.sha256(json.dumps(vocab).encode("utf-8")).hexdigest()[:16]
+
+
+def patient_header(patient_name: str) -> str:
+    """Patient text /clinical-query assembles before the question."""
+    return f"Patient name: {patient_name}."
+
+
+def _file_stem(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "--", model_name)
+
+
+class TokenStore:
+    """Token ids of every ingested snippet for one tokenizer."""
+
+    def __init__(self, tokenizer, model_name: str, runtime_entries: int = RUNTIME_ENTRIES):
+        self.tokenizer = tokenizer
+        self.model_name = model_name
+        self.runtime_entries = runtime_entries
+        self._mmap = None
+        self._base = memoryview(array("i"))  # ids loaded from disk (read-only, memory-mapped)
+        self._tail = array("i")              # ids ingested since the arena was opened
+        self._index = {}                     # text key -> (offset, length), permanent corpus
+        self._scratch = OrderedDict()        # text key -> ids, runtime texts (LRU)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, text: str) -> bool:
+        return text_key(text) in self._index
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self._base) + len(self._tail)
+
+    def _lookup(self, key: str):
+        """Stored ids of a text key as an array slice, or None."""
+        span = self._index.get(key)
+        if span is not None:
+            offset, length = span
+            base = len(self._base)
+            if offset >= base:
+                return self._tail[offset - base:offset - base + length]
+            return self._base[offset:offset + length]
+        with self._lock:
+            ids = self._scratch.get(key)
+            if ids is not None:
+                self._scratch.move_to_end(key)
+            return ids
+
+    def _tokenize(self, text: str, permanent: bool):
+        key = text_key(text)
+        ids = self._lookup(key)
+        metrics.record_cache("token_store", ids is not None)
+        if ids is not None:
+            return ids
+        ids = array("i", self.tokenizer(text, add_special_tokens=False)["input_ids"])
+        with self._lock:
+            if permanent:
+                if key not in self._index:
+                    self._index[key] = (self.n_tokens, len(ids))
+                    self._tail.extend(ids)
+                self._scratch.pop(key, None)
+            elif self.runtime_entries > 0:
+                self._scratch[key] = ids
+                while len(self._scratch) > self.runtime_entries:
+                    self._scratch.popitem(last=False)
+        return ids
+
+    def add(self, text: str, permanent: bool = False) -> int:
+        """Tokenize and store text unless it is already stored; returns its token count.
+
+        Permanent texts become part of the corpus that save() writes; others
+        are kept in the bounded runtime LRU.
+        """
+        return len(self._tokenize(text, permanent))
+
+    def count(self, text: str) -> int:
+        """Token count of text (without special tokens), tokenizing it only if it is not stored."""
+        return self.add(text)
+
+    def ids(self, text: str) -> list:
+        return self._tokenize(text, False).tolist()
+
+    def separator_ids(self, separator: str = "\n") -> list:
+        """Ids inserted between snippets by assemble(); whitespace-only for WordPiece tokenizers."""
+        return self.ids(separator) if separator else []
+
+    def assemble(self, texts: list, max_length: int = None, separator: str = "\n", suffix_ids: list = None) -> list:
+        """Model input ids for texts joined by separator, with suffix_ids appended.
+
+        The body is cut to leave room for the special tokens, then wrapped with
+        them exactly as tokenizer(..., truncation=True) would.
+        """
+        separator_ids = self.separator_ids(separator)
+        body = []
+        for text in texts:
+            if body and separator_ids:
+                body.extend(separator_ids)
+            body.extend(self.ids(text))
+        if suffix_ids:
+            body.extend(suffix_ids)
+        if max_length is not None:
+            body = body[:max(0, max_length - self.tokenizer.num_special_tokens_to_add())]
+        return self.tokenizer.build_inputs_with_special_tokens(body)
+
+    # --- persistence ---
+    def paths(self, directory: str) -> tuple:
+        stem = os.path.join(directory, _file_stem(self.model_name))
+        return stem + ".ids", stem + ".json"
+
+    def save(self, directory: str = TOKEN_STORE_DIR):
+        """Write the arena (int32, native byte order) and its index next to each other."""
+        os.makedirs(directory, exist_ok=True)
+        ids_path, index_path = self.paths(directory)
+        with self._lock:
+            with open(ids_path + ".tmp", "wb") as f:
+                f.write(self._base.tobytes())
+                self._tail.tofile(f)
+            meta = {"model": self.model_name, "fingerprint": tokenizer_fingerprint(self.tokenizer),
+                    "itemsize": array("i").itemsize, "n_tokens": self.n_tokens, "entries": self._index}
+            with open(index_path + ".tmp", "w") as f:
+                json.dump(meta, f)
+        os.replace(ids_path + ".tmp", ids_path)
+        os.replace(index_path + ".tmp", index_path)
+
+    @classmethod
+    def open(cls, tokenizer, model_name: str, directory: str = TOKEN_STORE_DIR) -> "TokenStore":
+        """Memory-map a saved arena; returns an empty store if there is none for this tokenizer."""
+        store = cls(tokenizer, model_name)
+        ids_path, index_path = store.paths(directory)
+        if not (os.path.exists(ids_path) and os.path.exists(index_path)):
+            return store
+        with open(index_path) as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") != tokenizer_fingerprint(tokenizer) or meta.get("itemsize") != array("i").itemsize:
+            print(f"⚠️ Token store for {model_name} was built with a different tokenizer; ignoring it")
+            return store
+        if meta["n_tokens"]:
+            with open(ids_path, "rb") as f:
+                store._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            store._base = memoryview(store._mmap).cast("i")[:meta["n_tokens"]]
+        store._index = {key: tuple(span) for key, span in meta["entries"].items()}
+        return store
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_store(model_name: str, tokenizer, directory: str = TOKEN_STORE_DIR) -> TokenStore:
+    """Process-wide store for a tokenizer, opened from disk on first use."""
+    with _STORES_LOCK:
+        store = _STORES.get(model_name)
+        if store is None or store.tokenizer is not tokenizer:
+            store = _STORES[model_name] = TokenStore.open(tokenizer, model_name, directory)
+        return store
+
+
+def ingest(store: TokenStore, texts) -> int:
+    """Tokenize every text not yet in the store; returns how many were new."""
+    before = len(store)
+    for text in texts:
+        store.add(text, permanent=True)
+    return len(store) - before
+
+
+def note_texts(bundle: dict) -> list:
+    from backend.clinical_notes import NoteIndex
+
+    index = NoteIndex.from_bundle(bundle)
+    return [index.text(note.note_id).strip() for note in index.list_notes()]
+
+
+def patient_header_texts(bundle: dict) -> list:
+    from backend.fhir_validation import FHIRValidationError, validate_patient
+
+    headers = []
+    for entry in bundle.get("entry", []):
+        resource = entry.get("resource", {})
+        if resource.get("resourceType") != "Patient":
+            continue
+        try:
+            headers.append(patient_header(validate_patient(resource, "light")["patient_name"]))
+        except FHIRValidationError:
+            continue
+    return list(dict.fromkeys(headers))
+
+
+_SOURCE_TEXTS = {"notes": note_texts, "patient_headers": patient_header_texts}
+
+
+def main():
+    from backend import fhir_loading
+    from backend.model_loading import load_tokenizer
+
+    parser = argparse.ArgumentParser(description="Pre-tokenize the FHIR-derived texts each service assembles.")
+    parser.add_argument("--data-dir", default=fhir_loading.DATA_DIR)
+    parser.add_argument("--out", default=TOKEN_STORE_DIR)
+    parser.add_argument("--models", nargs="+", default=DEFAULT_MODELS, choices=list(INGEST_SOURCES))
+    args = parser.parse_args()
+
+    fhir_loading.DATA_DIR = args.data_dir
+    bundle = fhir_loading.load_all_fhir()
+    for model_name in args.models:
+        texts = _SOURCE_TEXTS[INGEST_SOURCES[model_name]](bundle)
+        tokenizer = load_tokenizer(model_name)
+        store = TokenStore.open(tokenizer, model_name, args.out)
+        added = ingest(store, texts)
+        store.save(args.out)
+        print(f"✅ {model_name}: {len(store)} snippets, {store.n_tokens} tokens ({added} new) -> {store.paths(args.out)[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""
+Concurrent load generator for the Flask /query and FastAPI /clinical-query services.
+
+Requests are either replayed from a JSONL log or synthesized. Each line of a
+replay file may be
+    {"target": "notes" | "clinicalbert", "body": {...}}   a recorded request body
+    {"query": "..."} / {"question": "..."}                 just the text
+    {"title": "...", "body": "..."}                        any text record (title is used)
+and is sent to the target(s) selected with --target. /query requires a
+patient_id: requests without one get --patient-id (default: the patient with
+the most notes in the FHIR data directory).
+
+Two arrival models are supported:
+    closed loop  --concurrency N: N workers each send the next request as soon as the previous one returns
+    open loop    --rate R: Poisson arrivals at R req/s, independent of how fast the server answers;
+                 latency is measured from the scheduled send time so queueing is not hidden
+A --ramp of "value:seconds" stages steps the rate (open loop) or concurrency (closed loop),
+and the report includes the saturation throughput: the best stage that stayed within
+the error and latency SLO.
+
+--standin starts both services in-process on free ports with tiny random models
+(AI_CLINIC_TINY_MODELS=1), so the harness runs on any laptop without weights.
+
+Usage:
+    python benchmarks/loadtest.py --standin --rate 5 --duration 30
+    python benchmarks/loadtest.py --replay requests.jsonl --target notes --ramp 2:20,4:20,8:20,16:20
+    python benchmarks/loadtest.py --notes-url http://host:5000/query --concurrency 16 --duration 60 --out run.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from backend.model_loading import TINY_MODELS_ENV
+
+SAMPLE_FHIR_RECORD = {"patient": {"resourceType": "Patient", "name": [{"given": ["Audrie782"], "family": "Kub800"}]}}
+
+QUERY_TEMPLATES = [
+    "What is the recommended treatment for {} chest pain?",
+    "Summarize the chest pain history for this {} patient",
+    "Which treatment options fit a {} patient with diabetes?",
+    "Is the current treatment plan adequate for {} hypertension?",
+]
+QUERY_QUALIFIERS = ["elderly", "diabetic", "post-operative", "pediatric", "obese", "smoking", "pregnant"]
+
+# Upper bounds (ms) of the latency histogram buckets, roughly log spaced.
+HISTOGRAM_BOUNDS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+
+# ---------------------------
+# WORKLOAD
+# ---------------------------
+def _text_of(record: dict) -> str:
+    for key in ("query", "question", "title"):
+        if isinstance(record.get(key), str) and record[key].strip():
+            return record[key]
+    if isinstance(record.get("body"), str):
+        return record["body"][:500]
+    return None
+
+
+def build_body(target: str, text: str, patient_id: str = None) -> dict:
+    if target == "notes":
+        return {"query": text, "patient_id": patient_id}
+    return {"fhir_record": SAMPLE_FHIR_RECORD, "question": text}
+
+
+def default_patient_id(data_dir: str = None) -> str:
+    """The patient with the most clinical notes, so /query has notes to retrieve."""
+    from collections import Counter
+
+    from backend import fhir_loading
+    from backend.clinical_notes import NoteIndex
+
+    if data_dir:
+        fhir_loading.DATA_DIR = data_dir
+    index = NoteIndex.from_bundle(fhir_loading.load_all_fhir())
+    counts = Counter(note.patient_id for note in index.list_notes())
+    if not counts:
+        raise ValueError("No clinical notes found; pass --patient-id")
+    return counts.most_common(1)[0][0]
+
+
+def load_replay(path: str, targets: list, patient_id: str = None) -> list:
+    """Read a JSONL request log into a list of (target, body) pairs."""
+    workload = []
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record.get("body"), dict):
+                target = record.get("target", targets[0])
+                if target in targets:
+                    body = dict(record["body"])
+                    if target == "notes" and not body.get("patient_id"):
+                        body["patient_id"] = patient_id
+                    workload.append((target, body))
+                continue
+            text = _text_of(record)
+            if text:
+                record_patient = record.get("patient_id") or patient_id
+                workload.extend((target, build_body(target, text, record_patient)) for target in targets)
+    if not workload:
+        raise ValueError(f"No usable requests in {path}")
+    return workload
+
+
+def synthesize(n: int, targets: list, seed: int = 0, patient_id: str = None) -> list:
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(n):
+        text = rng.choice(QUERY_TEMPLATES).format(rng.choice(QUERY_QUALIFIERS))
+        target = rng.choice(targets)
+        workload.append((target, build_body(target, text, patient_id)))
+    return workload
+
+
+# ---------------------------
+# CLIENT
+# ---------------------------
+def send(url: str, body: dict, timeout: float):
+    """POST one JSON request. Returns (ok, status, error)."""
+    data = json.dumps(body).encode("utf-8")
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            return True, resp.status, None
+    except urllib.error.HTTPError as e:
+        return False, e.code, f"HTTP {e.code}"
+    except (urllib.error.URLError, OSError) as e:
+        return False, None, type(e).__name__
+
+
+class StageRecorder:
+    """Thread-safe collection of per-request outcomes for one load stage."""
+
+    def __init__(self, name: str, offered: float):
+        self.name = name
+        self.offered = offered
+        self.latencies = []
+        self.errors = {}
+        self.sent = 0
+        self.started = time.perf_counter()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms: float, ok: bool, error: str):
+        with self._lock:
+            self.sent += 1
+            if ok:
+                self.latencies.append(latency_ms)
+            else:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        lat = sorted(self.latencies)
+        pct = lambda p: round(lat[min(len(lat) - 1, max(0, math.ceil(p / 100 * len(lat)) - 1))], 2) if lat else None
+        histogram, previous = {}, 0
+        for bound in HISTOGRAM_BOUNDS + [float("inf")]:
+            label = f"<={bound}ms" if bound != float("inf") else f">{HISTOGRAM_BOUNDS[-1]}ms"
+            histogram[label] = sum(1 for v in lat if previous < v <= bound)
+            previous = bound
+        n_errors = sum(self.errors.values())
+        return {
+            "stage": self.name,
+            "offered": self.offered,
+            "duration_s": round(elapsed, 2),
+            "sent": self.sent,
+            "ok": len(lat),
+            "errors": self.errors,
+            "error_rate": round(n_errors / self.sent, 4) if self.sent else 0.0,
+            "throughput_rps": round(len(lat) / elapsed, 3) if elapsed else 0.0,
+            "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+            "max_ms": round(lat[-1], 2) if lat else None,
+            "histogram": histogram,
+        }
+
+
+def run_closed_loop(workload, urls, concurrency: int, duration: float, timeout: float, stage: StageRecorder):
+    deadline = time.perf_counter() + duration
+    counter = iter(range(10 ** 12))
+    lock = threading.Lock()
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with lock:
+                target, body = workload[next(counter) % len(workload)]
+            t0 = time.perf_counter()
+            ok, _, error = send(urls[target], body, timeout)
+            stage.record((time.perf_counter() - t0) * 1000, ok, error)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stage.finished = time.perf_counter()
+
+
+def run_open_loop(workload, urls, rate: float, duration: float, timeout: float, stage: StageRecorder,
+                  max_inflight: int, rng: random.Random):
+    def fire(target, body, scheduled):
+        ok, _, error = send(urls[target], body, timeout)
+        stage.record((time.perf_counter() - scheduled) * 1000, ok, error)
+
+    start = time.perf_counter()
+    next_at, i = start, 0
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        while next_at < start + duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            target, body = workload[i % len(workload)]
+            pool.submit(fire, target, body, next_at)
+            i += 1
+            next_at += rng.expovariate(rate)
+    stage.finished = time.perf_counter()
+
+
+def saturation(stages: list, max_error_rate: float, slo_ms: float) -> dict:
+    """Best stage that kept errors and p95 within bounds."""
+    healthy = [s for s in stages if s["ok"] and s["error_rate"] <= max_error_rate
+               and (slo_ms is None or (s["p95_ms"] or 0) <= slo_ms)]
+    if not healthy:
+        return None
+    best = max(healthy, key=lambda s: s["throughput_rps"])
+    return {"stage": best["stage"], "throughput_rps": best["throughput_rps"], "p95_ms": best["p95_ms"]}
+
+
+# ---------------------------
+# STAND-IN SERVERS
+# ---------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_standin_servers(targets: list) -> dict:
+    """Run the real services in background threads with tiny random models."""
+    os.environ.setdefault(TINY_MODELS_ENV, "1")
+    from backend.service_loading import CLINICALBERT_API_PATH, NOTES_API_PATH, load_service_module
+
+    urls = {}
+    if "notes" in targets:
+        from werkzeug.serving import make_server
+        notes_api = load_service_module(NOTES_API_PATH, "clinical_notes_api")
+        port = _free_port()
+        server = make_server("127.0.0.1", port, notes_api.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls["notes"] = f"http://127.0.0.1:{port}/query"
+    if "clinicalbert" in targets:
+        import uvicorn
+        bert_api = load_service_module(CLINICALBERT_API_PATH, "clinicalbert_api")
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(bert_api.app, host="127.0.0.1", port=port, log_level="warning"))
+        server.install_signal_handlers = lambda: None  # not allowed outside the main thread
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+        urls["clinicalbert"] = f"http://127.0.0.1:{port}/clinical-query"
+    return urls
+
+
+def parse_ramp(spec: str) -> list:
+    stages = []
+    for part in spec.split(","):
+        value, seconds = part.split(":")
+        stages.append((float(value), float(seconds)))
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay or synthesize load against the AI-Clinic APIs.")
+    parser.add_argument("--target", choices=["notes", "clinicalbert", "both"], default="both")
+    parser.add_argument("--notes-url", default="http://127.0.0.1:5000/query")
+    parser.add_argument("--clinicalbert-url", default="http://127.0.0.1:8000/clinical-query")
+    parser.add_argument("--standin", action="store_true", help="serve both APIs locally with tiny models")
+    parser.add_argument("--replay", help="JSONL request log to replay (cycled if shorter than the run)")
+    parser.add_argument("--synthesize", type=int, default=200, help="synthetic requests when not replaying")
+    parser.add_argument("--patient-id", help="patient_id sent to /query (default: the patient with the most notes)")
+    parser.add_argument("--data-dir", help="FHIR data directory the default patient is picked from")
+    parser.add_argument("--concurrency", type=int, help="closed loop with this many workers")
+    parser.add_argument("--rate", type=float, help="open loop at this many requests/s (Poisson arrivals)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per stage")
+    parser.add_argument("--ramp", help='stages as "value:seconds,..." (rate for open loop, workers for closed loop)')
+    parser.add_argument("--max-inflight", type=int, default=256, help="open-loop client thread cap")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--slo-ms", type=float, help="p95 bound used to pick the saturation throughput")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here")
+    args = parser.parse_args()
+
+    targets = ["notes", "clinicalbert"] if args.target == "both" else [args.target]
+    patient_id = args.patient_id
+    if "notes" in targets and not patient_id:
+        patient_id = default_patient_id(args.data_dir)
+        print(f"Sending /query requests for patient {patient_id}")
+    if args.replay:
+        workload = load_replay(args.replay, targets, patient_id)
+    else:
+        workload = synthesize(args.synthesize, targets, args.seed, patient_id)
+    urls = start_standin_servers(targets) if args.standin else {"notes": args.notes_url, "clinicalbert": args.clinicalbert_url}
+
+    closed = args.concurrency is not None and args.rate is None
+    if args.ramp:
+        stages = parse_ramp(args.ramp)
+    else:
+        stages = [(args.concurrency if closed else (args.rate or 1.0), args.duration)]
+
+    rng = random.Random(args.seed)
+    results = []
+    for value, seconds in stages:
+        name = f"{'concurrency' if closed else 'rate'}={value:g}"
+        stage = StageRecorder(name, value)
+        if closed:
+            run_closed_loop(workload, urls, int(value), seconds, args.timeout, stage)
+        else:
+            run_open_loop(workload, urls, value, seconds, args.timeout, stage, args.max_inflight, rng)
+        summary = stage.summary()
+        results.append(summary)
+        print(f"{name:<18} sent {summary['sent']:>6}  ok {summary['ok']:>6}  err {summary['error_rate']:>7.2%}  "
+              f"{summary['throughput_rps']:>8} rps  p50 {summary['p50_ms']} ms  p95 {summary['p95_ms']} ms  "
+              f"p99 {summary['p99_ms']} ms")
+
+    report = {
+        "mode": "closed" if closed else "open",
+        "targets": {t: urls[t] for t in targets},
+        "requests_in_workload": len(workload),
+        "stages": results,
+        "saturation": saturation(results, args.max_error_rate, args.slo_ms),
+    }
+    if report["saturation"]:
+        print(f"Saturation throughput: {report['saturation']['throughput_rps']} rps ({report['saturation']['stage']})")
+    else:
+        print("No stage stayed within the error/latency bounds")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Memory held per patient after loading FHIR data: raw dict bundle vs compact records.
+
+Each representation is loaded in its own spawned process and measured with
+tracemalloc (Python heap still allocated once loading is done) and peak RSS.
+
+Usage:
+    python benchmarks/memory_per_patient.py
+    python benchmarks/memory_per_patient.py --patients 200
+    python benchmarks/memory_per_patient.py --data-dir data
+
+Results (synthetic corpus, 100 patients, seed 42, Python 3.11, Linux x86_64):
+
+    representation                          heap MB   KB/patient   peak RSS MB
+    load_all_fhir() - raw dict bundle         241.9       2477.4         586.6
+    load_records()  - compact records          10.7        109.5          62.4
+
+That is ~23x less per patient. Much of it is Claims and ExplanationOfBenefits,
+which have no record type; the raw dicts of just the seven covered resource
+types take 93.1 MB, so the records themselves are ~9x smaller than the dicts
+they replace.
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.run_benchmarks import peak_rss_mb
+
+
+def _load_raw(data_dir: str):
+    from backend import fhir_loading
+    fhir_loading.DATA_DIR = data_dir
+    return fhir_loading.load_all_fhir()
+
+
+def _load_records(data_dir: str):
+    from backend.fhir_records import load_records
+    return load_records(data_dir)
+
+
+LOADERS = {
+    "load_all_fhir() - raw dict bundle": _load_raw,
+    "load_records()  - compact records": _load_records,
+}
+
+
+def _measure(name: str, data_dir: str, results):
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        loaded = LOADERS[name](data_dir)
+    heap, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results.put({"name": name, "heap_bytes": heap, "peak_rss_mb": peak_rss_mb(), "size": len(loaded)})
+
+
+def count_patients(data_dir: str) -> int:
+    from backend.fhir_records import load_records
+    with contextlib.redirect_stdout(io.StringIO()):
+        return sum(1 for _ in load_records(data_dir).patients())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", help="existing FHIR directory (default: generate a synthetic corpus)")
+    parser.add_argument("--patients", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        data_dir = args.data_dir
+        if not data_dir:
+            from datagenv2.fhir_bundle_gen import generate_corpus
+            data_dir = os.path.join(scratch, "fhir")
+            with contextlib.redirect_stdout(io.StringIO()):
+                generate_corpus(data_dir, args.patients, workers=1, seed=42)
+        patients = count_patients(data_dir)
+
+        ctx = multiprocessing.get_context("spawn")
+        print(f"{'representation':<38} {'heap MB':>9} {'KB/patient':>12} {'peak RSS MB':>13}")
+        for name in LOADERS:
+            results = ctx.Queue()
+            proc = ctx.Process(target=_measure, args=(name, data_dir, results))
+            proc.start()
+            result = results.get()
+            proc.join()
+            heap_mb = result["heap_bytes"] / (1024 * 1024)
+            per_patient_kb = result["heap_bytes"] / 1024 / max(1, patients)
+            print(f"{name:<38} {heap_mb:>9.1f} {per_patient_kb:>12.1f} {result['peak_rss_mb']:>13}")
+        print(f"({patients} patients in {data_dir})")
+
+
+if __name__ == "__main__":
+    main()
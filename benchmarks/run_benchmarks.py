@@ -0,0 +1,343 @@
+"""
+Offline benchmark suite for the AI-Clinic hot paths.
+
+Every case runs in its own spawned process so the peak RSS reported for it is
+not polluted by other cases. Models are tiny randomly initialized stand-ins of
+the real architectures unless --real-models is given (see backend/model_loading.py),
+and the FHIR corpus is generated deterministically with datagenv2/fhir_bundle_gen.py,
+so runs are reproducible without network access.
+
+Usage:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --cases load_all_fhir summarize_bundle --patients 200
+    python benchmarks/run_benchmarks.py --out benchmarks/results/after.json --compare benchmarks/results/before.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from backend.model_loading import TINY_MODELS_ENV
+
+CASES = {}
+
+
+def case(name: str):
+    """Register a benchmark case. The function gets the run config and returns
+    (operation, iterations); operation is called with the iteration number."""
+    def register(fn):
+        CASES[name] = fn
+        return fn
+    return register
+
+
+# ---------------------------
+# CASES
+# ---------------------------
+@case("load_all_fhir")
+def _load_all_fhir(config):
+    from backend import fhir_loading
+    fhir_loading.DATA_DIR = config["data_dir"]
+    return lambda i: fhir_loading.load_all_fhir(), config["iterations_slow"]
+
+
+@case("summarize_bundle")
+def _summarize_bundle(config):
+    from backend import fhir_loading
+    fhir_loading.DATA_DIR = config["data_dir"]
+    bundle = fhir_loading.load_all_fhir()
+    return lambda i: fhir_loading.summarize_bundle(bundle), config["iterations_slow"]
+
+
+def _streamlit_app(config):
+    from backend.service_loading import STREAMLIT_APP_PATH, load_service_module
+    os.chdir(config["work_dir"])  # app.py writes clinic.db into the working directory
+    app = load_service_module(STREAMLIT_APP_PATH, "ai_clinic_app")
+    app.init_db()
+    return app
+
+
+@case("app.add_patient")
+def _app_add_patient(config):
+    app = _streamlit_app(config)
+    return (lambda i: app.add_patient(f"Patient {i}", 40 + i % 40, "Female", "Hypertension",
+                                      "Headache", "Lisinopril", "Dr. Bench"), config["iterations"])
+
+
+@case("app.get_patients")
+def _app_get_patients(config):
+    app = _streamlit_app(config)
+    for i in range(config["seed_rows"]):
+        app.add_patient(f"Patient {i}", 30 + i % 50, "Male", "Diabetes", "Fatigue", "Metformin", "Dr. Bench")
+    return lambda i: app.get_patients(), config["iterations"]
+
+
+@case("app.save_ai_query")
+def _app_save_ai_query(config):
+    app = _streamlit_app(config)
+    return (lambda i: app.save_ai_query("bench", f"Query {i}", "Response text", "google/flan-t5-small"),
+            config["iterations"])
+
+
+@case("app.get_ai_history")
+def _app_get_ai_history(config):
+    app = _streamlit_app(config)
+    for i in range(config["seed_rows"]):
+        app.save_ai_query("bench", f"Query {i}", "Response text", "google/flan-t5-small")
+    return lambda i: app.get_ai_history("bench"), config["iterations"]
+
+
+# Phrases that occur in Synthea note text, so retrieval has something to return.
+NOTE_KEYWORDS = ["plan", "treatment"]
+
+
+def _notes_api(config):
+    from backend import fhir_loading
+    from backend.service_loading import NOTES_API_PATH, load_service_module
+    fhir_loading.DATA_DIR = config["data_dir"]
+    return load_service_module(NOTES_API_PATH, "clinical_notes_api")
+
+
+def _notes_patient(api) -> str:
+    """The patient with the most notes, so retrieval has the most to search."""
+    counts = Counter(note.patient_id for note in api.get_note_index().list_notes())
+    return counts.most_common(1)[0][0] if counts else "none"
+
+
+@case("get_fhir_notes")
+def _get_fhir_notes(config):
+    api = _notes_api(config)
+    patient_id = _notes_patient(api)
+    return lambda i: api.get_fhir_notes(NOTE_KEYWORDS, patient_id=patient_id), config["iterations"]
+
+
+@case("summarize_notes")
+def _summarize_notes(config):
+    api = _notes_api(config)
+    text = api.get_fhir_notes(NOTE_KEYWORDS, patient_id=_notes_patient(api))
+    return lambda i: api.summarize_notes(text), config["iterations_model"]
+
+
+@case("clinicalbert.clinical_query")
+def _clinicalbert(config):
+    from backend.service_loading import CLINICALBERT_API_PATH, load_service_module
+    api = load_service_module(CLINICALBERT_API_PATH, "clinicalbert_api")
+    req = api.QueryRequest(
+        fhir_record={"patient": {"resourceType": "Patient", "name": [{"given": ["Audrie782"], "family": "Kub800"}]}},
+        question="Is the patient at risk of myocardial infarction given chest pain and hypertension?",
+    )
+    return lambda i: asyncio.run(api.clinical_query(req)), config["iterations_model"]
+
+
+def _auth(config):
+    from backend import auth
+    auth.USERS_FILE = os.path.join(config["work_dir"], "users.json")
+    return auth
+
+
+@case("auth.sign_up")
+def _auth_sign_up(config):
+    auth = _auth(config)
+    return lambda i: auth.sign_up(f"user{i}", "secret123"), config["iterations"]
+
+
+@case("auth.login")
+def _auth_login(config):
+    auth = _auth(config)
+    for i in range(config["seed_rows"]):
+        auth.sign_up(f"user{i}", "secret123")
+    return lambda i: auth.login(f"user{i % config['seed_rows']}", "secret123"), config["iterations"]
+
+
+# ---------------------------
+# RUNNER
+# ---------------------------
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes.
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _run_case(name: str, config: dict, results):
+    """Child process body: set up one case, time it, and report back."""
+    os.environ.setdefault(TINY_MODELS_ENV, config["tiny_models"])
+    random.seed(0)
+    try:
+        import torch
+        torch.manual_seed(0)
+        torch.set_num_threads(config["threads"])
+    except ImportError:
+        pass
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            op, iterations = CASES[name](config)
+            op(-1)  # warm-up, not timed
+            latencies = []
+            started = time.perf_counter()
+            for i in range(iterations):
+                t0 = time.perf_counter()
+                op(i)
+                latencies.append((time.perf_counter() - t0) * 1000)
+            elapsed = time.perf_counter() - started
+    except Exception as e:
+        results.put({"case": name, "error": f"{type(e).__name__}: {e}"})
+        return
+    latencies.sort()
+    results.put({
+        "case": name,
+        "iterations": iterations,
+        "throughput_ops_s": round(iterations / elapsed, 3) if elapsed else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+
+def run_case(name: str, config: dict, timeout: float) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=_run_case, args=(name, config, results))
+    proc.start()
+    try:
+        return results.get(timeout=timeout)
+    except Exception:
+        return {"case": name, "error": f"timed out after {timeout}s or crashed (exit code {proc.exitcode})"}
+    finally:
+        proc.join(5)
+        if proc.is_alive():
+            proc.kill()
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Return human-readable regressions: p50/p95 slower or throughput lower by more than threshold."""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or "error" in result or "error" in base:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if base[metric] and result[metric] > base[metric] * (1 + threshold):
+                regressions.append(f"{name}: {metric} {base[metric]} -> {result[metric]}")
+        if base["throughput_ops_s"] and result["throughput_ops_s"] < base["throughput_ops_s"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {base['throughput_ops_s']} -> {result['throughput_ops_s']} ops/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline AI-Clinic benchmark suite.")
+    parser.add_argument("--cases", nargs="*", default=list(CASES), help=f"subset of: {', '.join(CASES)}")
+    parser.add_argument("--data-dir", help="FHIR corpus to use (default: generate a synthetic one)")
+    parser.add_argument("--patients", type=int, default=20, help="patients in the generated corpus")
+    parser.add_argument("--iterations", type=int, default=200, help="iterations for cheap cases")
+    parser.add_argument("--iterations-model", type=int, default=20, help="iterations for model cases")
+    parser.add_argument("--iterations-slow", type=int, default=5, help="iterations for corpus-wide cases")
+    parser.add_argument("--seed-rows", type=int, default=500, help="rows pre-inserted for read cases")
+    parser.add_argument("--threads", type=int, default=1, help="torch intra-op threads per case")
+    parser.add_argument("--real-models", action="store_true", help="try real weights, fall back to tiny ones")
+    parser.add_argument("--timeout", type=float, default=900)
+    parser.add_argument("--out", help="where to write results JSON (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix="ai-clinic-bench-") as scratch:
+        data_dir = args.data_dir
+        if not data_dir:
+            from datagenv2.fhir_bundle_gen import generate_corpus
+            data_dir = os.path.join(scratch, "fhir")
+            with contextlib.redirect_stdout(io.StringIO()):
+                generate_corpus(data_dir, args.patients, workers=1, seed=42)
+
+        report = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "git_commit": _git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "tiny_models": not args.real_models,
+                "data_dir": args.data_dir or f"synthetic:{args.patients} patients, seed 42",
+            },
+            "results": {},
+        }
+        for name in args.cases:
+            work_dir = os.path.join(scratch, name)
+            os.makedirs(work_dir, exist_ok=True)
+            config = {
+                "data_dir": os.path.abspath(data_dir),
+                "work_dir": work_dir,
+                "iterations": args.iterations,
+                "iterations_model": args.iterations_model,
+                "iterations_slow": args.iterations_slow,
+                "seed_rows": args.seed_rows,
+                "threads": args.threads,
+                "tiny_models": "auto" if args.real_models else "1",
+            }
+            result = run_case(name, config, args.timeout)
+            report["results"][name] = {k: v for k, v in result.items() if k != "case"}
+            if "error" in result:
+                print(f"{name:<30} ERROR {result['error']}")
+            else:
+                print(f"{name:<30} {result['throughput_ops_s']:>10} ops/s  p50 {result['p50_ms']:>9} ms  "
+                      f"p95 {result['p95_ms']:>9} ms  p99 {result['p99_ms']:>9} ms  rss {result['peak_rss_mb']} MB")
+
+    out = args.out or os.path.join(REPO_ROOT, "benchmarks", "results", f"{datetime.now():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {out}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for line in regressions:
+            print(f"❌ Regression: {line}")
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
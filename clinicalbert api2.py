@@ -1,41 +1,218 @@
-from fastapi import FastAPI
+import threading
+from typing import Optional
+
+import torch
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from pydantic import BaseModel
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from fhir.resources.patient import Patient
+from backend import metrics
+from backend.fhir_loading import load_all_fhir
+from backend.fhir_validation import FHIRValidationError, validate_patient
+from backend.model_loading import load_pretrained
+from backend.patient_store import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, Page, PatientStore, content_etag, etag_matches,
+                                   to_bundle)
+from backend.patient_summaries import get_summary, source_hash, summary_text
+from backend.singleflight import SingleFlight, flight_key
+from backend.timeline import to_timestamp
+from backend.token_store import get_store, patient_header
 
 # Load ClinicalBERT model and tokenizer
 model_name = "emilyalsentzer/Bio_ClinicalBERT"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSequenceClassification.from_pretrained(model_name)
+tokenizer, model = load_pretrained(model_name, AutoModelForSequenceClassification, AutoTokenizer)
+
+# Pre-tokenized patient headers of the FHIR data (see backend.token_store.INGEST_SOURCES);
+# other patients' headers are tokenized once and kept in the store's runtime LRU
+token_store = get_store(model_name, tokenizer)
+# Some hub tokenizers report an unbounded model_max_length; the position embeddings are the real limit
+MAX_INPUT_TOKENS = min(tokenizer.model_max_length, model.config.max_position_embeddings)
 
 # Function to parse relevant patient info from FHIR JSON
-def parse_fhir_record(fhir_json):
-    patient = Patient(**fhir_json.get("patient", {}))
-    patient_name = patient.name[0].given[0] if patient.name else "Unknown"
+# Light validation (the default) checks and extracts only the fields used below;
+# strict validation builds the full fhir.resources Patient model first.
+# Results are cached per patient id + version, so repeat calls skip validation.
+def parse_fhir_record(fhir_json, strict: bool = False, version: str = None):
+    patient_info = validate_patient(fhir_json.get("patient", {}), "strict" if strict else None, version)
     # Extract other relevant clinical info here if needed
-    return {"patient_name": patient_name}
+    return patient_info
 
 # FastAPI app and request body schema
+# Either send the record inline (fhir_record) or name a patient in the loaded data (patient_id)
 class QueryRequest(BaseModel):
-    fhir_record: dict
     question: str
+    fhir_record: Optional[dict] = None
+    patient_id: Optional[str] = None
 
 app = FastAPI()
+# Compress larger responses (FHIR bundles) for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
-@app.post("/clinical-query")
-async def clinical_query(req: QueryRequest):
-    # Parse patient info from FHIR record
-    patient_info = parse_fhir_record(req.fhir_record)
-    
-    # Create input text combining patient data and clinical question
-    text_input = f"Patient name: {patient_info['patient_name']}. Question: {req.question}"
-    
-    # Tokenize input and run ClinicalBERT model
-    inputs = tokenizer(text_input, return_tensors="pt", truncation=True)
+# Read API over the FHIR data directory, indexed by patient and resource type on first use
+_patient_store = None
+_patient_store_lock = threading.Lock()
+
+def get_patient_store() -> PatientStore:
+    global _patient_store
+    with _patient_store_lock:
+        if _patient_store is None:
+            _patient_store = PatientStore.from_bundle(load_all_fhir())
+            _patient_store.timeline()
+    return _patient_store
+
+def conditional_response(request: Request, content: dict, etag: str):
+    # 304 without a body when the client already holds this version
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(content, headers={"ETag": etag}, media_type="application/fhir+json")
+
+# Name under which this service's spans and counters are reported at /metrics
+SERVICE = "clinicalbert_api"
+
+# Identical model inputs that overlap in time share one forward pass
+classifier_flight = SingleFlight(SERVICE)
+
+@app.middleware("http")
+async def count_requests(request: Request, call_next):
+    response = await call_next(request)
+    # The router records the matched route in the scope
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else metrics.UNMATCHED_ENDPOINT
+    metrics.REQUESTS.inc(SERVICE, endpoint, response.status_code)
+    return response
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/patients/{patient_id}")
+def read_patient(patient_id: str, request: Request):
+    store = get_patient_store()
+    patient = store.patient(patient_id)
+    if patient is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return conditional_response(request, patient, store.etag([patient]))
+
+@app.get("/patients/{patient_id}/summary")
+def read_patient_summary(patient_id: str, request: Request):
+    # Precomputed by `python -m backend.patient_summaries`, so this is a primary-key lookup;
+    # patients that haven't been materialized yet get the same text summary computed on the spot.
+    # The ETag covers the whole body, so a model summary filled in later is not hidden behind a 304
+    summary = get_summary(patient_id)
+    if summary is None:
+        store = get_patient_store()
+        if store.patient(patient_id) is None:
+            raise HTTPException(status_code=404, detail="Patient not found")
+        resources = store.resources(patient_id)
+        summary = {"patient_id": patient_id, "text_summary": summary_text(resources), "model_summary": None,
+                   "source_hash": source_hash(resources)}
+    summary["materialized"] = "updated_at" in summary
+    return conditional_response(request, summary, content_etag(summary))
+
+@app.get("/patients/{patient_id}/timeline")
+def read_patient_timeline(
+    patient_id: str,
+    request: Request,
+    start: Optional[str] = Query(None, description="ISO date/time; resources overlapping [start, end]"),
+    end: Optional[str] = Query(None),
+    types: Optional[str] = Query(None, alias="_type", description="comma-separated resource types"),
+    last: Optional[int] = Query(None, alias="_last", ge=1, le=MAX_PAGE_SIZE,
+                                description="the N most recent of one _type, up to end"),
+):
+    # Date-range view of a patient's record from the temporal index, as a searchset Bundle
+    store = get_patient_store()
+    if store.patient(patient_id) is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    for name, value in (("start", start), ("end", end)):
+        if value is not None and to_timestamp(value) is None:
+            raise HTTPException(status_code=400, detail=f"Invalid {name} date: {value}")
+    type_list = [t for t in types.split(",") if t] if types else None
+    timeline = store.timeline()
+    if last is not None:
+        if not type_list or len(type_list) != 1:
+            raise HTTPException(status_code=400, detail="_last needs exactly one _type")
+        resources = timeline.most_recent(patient_id, type_list[0], last, before=end)
+    else:
+        resources = timeline.overlapping(patient_id, start, end, types=type_list)
+    etag = store.etag(resources, patient_id, start, end, types, last)
+    page = Page(resources, len(resources), None, etag)
+    return conditional_response(request, to_bundle(page, str(request.url), base_url=str(request.base_url)), etag)
+
+@app.get("/patients/{patient_id}/{resource_type}")
+def search_patient_resources(
+    patient_id: str,
+    resource_type: str,
+    request: Request,
+    since: Optional[str] = Query(None, alias="_since", description="only resources dated at or after this ISO date"),
+    count: int = Query(DEFAULT_PAGE_SIZE, alias="_count", ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, alias="_cursor", description="from the previous page's next link"),
+):
+    # One page of a patient's resources of a type, oldest first, as a searchset Bundle
+    store = get_patient_store()
+    if store.patient(patient_id) is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    try:
+        page = store.search(patient_id, resource_type, since=since, count=count, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    next_url = str(request.url.include_query_params(_cursor=page.next_cursor)) if page.next_cursor else None
+    bundle = to_bundle(page, str(request.url), next_url, base_url=str(request.base_url))
+    return conditional_response(request, bundle, page.etag)
+
+@app.get("/patients/{patient_id}/{resource_type}/{resource_id}")
+def read_patient_resource(patient_id: str, resource_type: str, resource_id: str, request: Request):
+    # One resource, at the URL Bundle entries give as their fullUrl
+    store = get_patient_store()
+    resource = store.read(patient_id, resource_type, resource_id)
+    if resource is None:
+        raise HTTPException(status_code=404, detail="Resource not found")
+    return conditional_response(request, resource, store.etag([resource]))
+
+def classify(input_ids: list) -> list:
+    inputs = {"input_ids": torch.tensor([input_ids]), "attention_mask": torch.ones(1, len(input_ids), dtype=torch.long)}
     outputs = model(**inputs)
-    
+    metrics.record_model_call(SERVICE, batch_size=1, tokens_in=len(input_ids), tokens_out=0)
     # Extract model outputs (logits here, adjust based on use case)
-    logits = outputs.logits.detach().cpu().numpy().tolist()
+    return outputs.logits.detach().cpu().numpy().tolist()
+
+@app.post("/clinical-query")
+async def clinical_query(req: QueryRequest, timings: bool = False, strict: bool = False):
+    version = None
+    if req.patient_id:
+        store = get_patient_store()
+        patient = store.patient(req.patient_id)
+        if patient is None:
+            raise HTTPException(status_code=404, detail="Patient not found")
+        fhir_record = {"patient": patient}
+        version = store.version(patient)
+    elif req.fhir_record is not None:
+        fhir_record = req.fhir_record
+    else:
+        raise HTTPException(status_code=422, detail="Provide either fhir_record or patient_id")
+    
+    with metrics.request_scope(SERVICE) as breakdown:
+        # Parse patient info from FHIR record (?strict=true for full FHIR validation)
+        with metrics.span(SERVICE, "fhir_parse"):
+            try:
+                patient_info = parse_fhir_record(fhir_record, strict, version)
+            except FHIRValidationError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+        
+        # Create input combining patient data and clinical question: the patient
+        # text comes from the token store, only the question is tokenized here
+        patient_text = patient_header(patient_info['patient_name'])
+        with metrics.span(SERVICE, "tokenization"):
+            question_ids = tokenizer(f" Question: {req.question}", add_special_tokens=False)["input_ids"]
+        with metrics.span(SERVICE, "input_assembly"):
+            input_ids = token_store.assemble([patient_text], max_length=MAX_INPUT_TOKENS, suffix_ids=question_ids)
+        
+        # Run ClinicalBERT model (off the event loop, so identical requests can join it)
+        with metrics.span(SERVICE, "model_forward"):
+            logits = await classifier_flight.do_async(flight_key(model_name, input_ids), classify, input_ids)
     
     # Return raw logits (replace with further processing as needed)
-    return {"response_logits": logits}
+    response = {"response_logits": logits}
+    # ?timings=true adds a per-stage latency breakdown (ms)
+    if timings:
+        response["timings_ms"] = metrics.timings_ms(breakdown)
+    return response
@@ -0,0 +1,494 @@
+"""
+Synthetic Synthea-shaped FHIR bundle generator for scale testing.
+
+The real corpus in data/ only has a handful of patients, which is not enough to
+see how load_all_fhir(), summarize_bundle() or any retrieval index behave at
+10k-100k patients. This script writes transaction Bundles with the same layout
+Synthea uses (one file per patient, plus hospitalInformation*/practitionerInformation*
+bundles that patients reference by identifier) and roughly the same resource mix
+per encounter as our real files.
+
+Usage:
+    python datagenv2/fhir_bundle_gen.py --patients 10000 --out data/synthetic --workers 8
+    python datagenv2/fhir_bundle_gen.py --target-gb 50 --out /scratch/fhir50g
+    python datagenv2/fhir_bundle_gen.py --patients 500 --profile-from data
+"""
+import argparse
+import base64
+import collections
+import copy
+import glob
+import json
+import math
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from multiprocessing import Pool
+
+# Median resources per encounter measured on the Synthea bundles in data/.
+# Encounter and DocumentReference are always 1:1 in Synthea output.
+DEFAULT_PROFILE = {
+    "encounters_median": 25,
+    "per_encounter": {
+        "Condition": 0.9,
+        "Observation": 6.5,
+        "Procedure": 2.7,
+        "Immunization": 0.4,
+        "DiagnosticReport": 1.7,
+        "MedicationRequest": 0.27,
+        "SupplyDelivery": 0.4,
+        "Device": 0.15,
+        "ImagingStudy": 0.1,
+        "CarePlan": 0.08,
+    },
+}
+
+FIRST_NAMES = ["Audrie", "Branden", "Dewitt", "Kasey", "Nickolas", "Russel", "Salvador",
+               "Selina", "Stacee", "Stan", "Annita", "Augustina", "Maria", "James", "Priya",
+               "Chen", "Fatima", "Lucas", "Olivia", "Noah"]
+LAST_NAMES = ["Kub", "Hartmann", "Murazik", "Smitham", "Turner", "Heidenreich", "Thiel",
+              "Howell", "Nienow", "Glover", "Botsford", "O'Hara", "Schmidt", "Nguyen",
+              "Patel", "Garcia", "Okafor", "Larsen", "Rossi", "Kim"]
+CITIES = ["Boston", "Worcester", "Springfield", "Randolph", "Fitchburg", "Quincy", "Lowell"]
+
+SNOMED = "http://snomed.info/sct"
+LOINC = "http://loinc.org"
+RXNORM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+CVX = "http://hl7.org/fhir/sid/cvx"
+NPI = "http://hl7.org/fhir/sid/us-npi"
+SYNTHEA = "https://github.com/synthetichealth/synthea"
+
+ENCOUNTER_TYPES = [
+    ("AMB", "410620009", "Well child visit (procedure)"),
+    ("AMB", "162673000", "General examination of patient (procedure)"),
+    ("AMB", "185349003", "Encounter for check up (procedure)"),
+    ("AMB", "390906007", "Follow-up encounter (procedure)"),
+    ("EMER", "50849002", "Emergency room admission (procedure)"),
+    ("IMP", "32485007", "Hospital admission (procedure)"),
+]
+CONDITIONS = [
+    ("44054006", "Diabetes mellitus type 2 (disorder)"),
+    ("38341003", "Essential hypertension (disorder)"),
+    ("195662009", "Acute viral pharyngitis (disorder)"),
+    ("444814009", "Viral sinusitis (disorder)"),
+    ("10509002", "Acute bronchitis (disorder)"),
+    ("55822004", "Hyperlipidemia (disorder)"),
+    ("431855005", "Chronic kidney disease stage 1 (disorder)"),
+    ("314529007", "Medication review due (situation)"),
+    ("73595000", "Stress (finding)"),
+    ("162864005", "Body mass index 30+ - obesity (finding)"),
+    ("195967001", "Asthma (disorder)"),
+    ("22298006", "Myocardial infarction (disorder)"),
+]
+MEDICATIONS = [
+    ("860975", "24 HR metformin hydrochloride 500 MG Extended Release Oral Tablet"),
+    ("314076", "lisinopril 10 MG Oral Tablet"),
+    ("243670", "aspirin 81 MG Oral Tablet"),
+    ("895994", "120 ACTUAT fluticasone propionate 0.044 MG/ACTUAT Metered Dose Inhaler"),
+    ("316049", "hydrochlorothiazide 25 MG Oral Tablet"),
+    ("197591", "Diazepam 5 MG Oral Tablet"),
+]
+# (loinc, display, unit, mean, sd, category)
+OBSERVATIONS = [
+    ("8302-2", "Body Height", "cm", 165.0, 12.0, "vital-signs"),
+    ("29463-7", "Body Weight", "kg", 78.0, 15.0, "vital-signs"),
+    ("39156-5", "Body mass index (BMI) [Ratio]", "kg/m2", 27.0, 4.5, "vital-signs"),
+    ("8867-4", "Heart rate", "/min", 76.0, 10.0, "vital-signs"),
+    ("9279-1", "Respiratory rate", "/min", 15.0, 2.0, "vital-signs"),
+    ("4548-4", "Hemoglobin A1c/Hemoglobin.total in Blood", "%", 6.2, 1.4, "laboratory"),
+    ("2339-0", "Glucose [Mass/volume] in Blood", "mg/dL", 98.0, 20.0, "laboratory"),
+    ("2093-3", "Cholesterol [Mass/volume] in Serum or Plasma", "mg/dL", 190.0, 30.0, "laboratory"),
+    ("38483-4", "Creatinine [Mass/volume] in Blood", "mg/dL", 1.0, 0.25, "laboratory"),
+    ("718-7", "Hemoglobin [Mass/volume] in Blood", "g/dL", 14.0, 1.5, "laboratory"),
+]
+PROCEDURES = [
+    ("430193006", "Medication reconciliation (procedure)"),
+    ("710824005", "Assessment of health and social care needs (procedure)"),
+    ("171207006", "Depression screening (procedure)"),
+    ("428191000124101", "Documentation of current medications (procedure)"),
+    ("23426006", "Measurement of respiratory function (procedure)"),
+]
+IMMUNIZATIONS = [
+    ("08", "Hep B, adolescent or pediatric"),
+    ("140", "Influenza, seasonal, injectable, preservative free"),
+    ("113", "Td (adult) preservative free"),
+    ("208", "SARS-COV-2 (COVID-19) vaccine, mRNA, spike protein, LNP, preservative free, 30 mcg/0.3mL dose"),
+]
+PAYERS = ["Humana", "Medicare", "Medicaid", "Blue Cross Blue Shield", "Aetna", "NO_INSURANCE"]
+
+
+def profile_corpus(data_dir: str) -> dict:
+    """Measure encounters per patient and resources per encounter from real Synthea bundles."""
+    encounters = []
+    ratios = collections.defaultdict(list)
+    for path in glob.glob(os.path.join(data_dir, "*.json")):
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("resourceType") != "Bundle" or data.get("type") != "transaction":
+            continue
+        counts = collections.Counter(e["resource"]["resourceType"] for e in data.get("entry", []))
+        if not counts.get("Encounter"):
+            continue
+        encounters.append(counts["Encounter"])
+        for rtype in DEFAULT_PROFILE["per_encounter"]:
+            ratios[rtype].append(counts.get(rtype, 0) / counts["Encounter"])
+    if not encounters:
+        return copy.deepcopy(DEFAULT_PROFILE)  # callers may adjust it
+    median = lambda values: sorted(values)[len(values) // 2]
+    return {
+        "encounters_median": median(encounters),
+        "per_encounter": {rtype: round(median(values), 3) for rtype, values in ratios.items()},
+    }
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _ts(dt: datetime) -> str:
+    return dt.isoformat(timespec="seconds")
+
+
+def _concept(system: str, code: str, display: str) -> dict:
+    return {"coding": [{"system": system, "code": code, "display": display}], "text": display}
+
+
+def _ref(resource_id: str, display: str = None) -> dict:
+    ref = {"reference": f"urn:uuid:{resource_id}"}
+    if display:
+        ref["display"] = display
+    return ref
+
+
+def _entry(resource: dict) -> dict:
+    return {
+        "fullUrl": f"urn:uuid:{resource['id']}",
+        "resource": resource,
+        "request": {"method": "POST", "url": resource["resourceType"]},
+    }
+
+
+def _poisson(rng: random.Random, lam: float) -> int:
+    # Knuth's method is fine for the small per-encounter rates we use.
+    limit, k, p = math.exp(-lam), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limit:
+            return k
+        k += 1
+
+
+def generate_provider_bundles(n_orgs: int, seed: int):
+    """Build the hospitalInformation and practitionerInformation batch bundles.
+
+    Returns (hospital_bundle, practitioner_bundle, providers) where providers is a
+    list of dicts that patient bundles use for their conditional references.
+    """
+    rng = random.Random(seed)
+    hospital_entries, practitioner_entries, providers = [], [], []
+    for i in range(n_orgs):
+        org_id, loc_id = _uuid(rng), _uuid(rng)
+        org_name = f"{rng.choice(CITIES).upper()} {rng.choice(['HEALTH CENTER', 'MEDICAL GROUP', 'HOSPITAL'])} {i}"
+        npi = str(9999900000 + rng.randint(0, 99999))
+        doctor = f"Dr. {rng.choice(FIRST_NAMES)}{rng.randint(1, 999)} {rng.choice(LAST_NAMES)}{rng.randint(1, 999)}"
+        hospital_entries.append({
+            "fullUrl": f"urn:uuid:{org_id}",
+            "resource": {"resourceType": "Organization", "id": org_id,
+                         "identifier": [{"system": SYNTHEA, "value": org_id}], "active": True,
+                         "type": [_concept("http://terminology.hl7.org/CodeSystem/organization-type", "prov", "Healthcare Provider")],
+                         "name": org_name},
+            "request": {"method": "POST", "url": "Organization", "ifNoneExist": f"identifier={SYNTHEA}|{org_id}"},
+        })
+        hospital_entries.append({
+            "fullUrl": f"urn:uuid:{loc_id}",
+            "resource": {"resourceType": "Location", "id": loc_id,
+                         "identifier": [{"system": SYNTHEA, "value": loc_id}], "status": "active", "name": org_name,
+                         "managingOrganization": {"identifier": {"system": SYNTHEA, "value": org_id}, "display": org_name}},
+            "request": {"method": "POST", "url": "Location", "ifNoneExist": f"identifier={SYNTHEA}|{loc_id}"},
+        })
+        practitioner_id = _uuid(rng)
+        given, family = doctor[4:].split(" ")
+        practitioner_entries.append({
+            "fullUrl": f"urn:uuid:{practitioner_id}",
+            "resource": {"resourceType": "Practitioner", "id": practitioner_id,
+                         "identifier": [{"system": NPI, "value": npi}], "active": True,
+                         "name": [{"family": family, "given": [given], "prefix": ["Dr."]}]},
+            "request": {"method": "POST", "url": "Practitioner", "ifNoneExist": f"identifier={NPI}|{npi}"},
+        })
+        providers.append({"npi": npi, "doctor": doctor, "org_id": org_id, "org_name": org_name, "loc_id": loc_id})
+    hospital = {"resourceType": "Bundle", "type": "batch", "entry": hospital_entries}
+    practitioners = {"resourceType": "Bundle", "type": "batch", "entry": practitioner_entries}
+    return hospital, practitioners, providers
+
+
+def _note_text(given: str, gender: str, when: datetime, payer: str, conditions: list, meds: list, immunizations: list) -> str:
+    lines = [
+        "", when.date().isoformat(), "",
+        "# Chief Complaint", "No complaints.", "",
+        "# History of Present Illness", f"{given} is a {gender} patient.", "",
+        "# Social History", " Patient has never smoked.", "", f"Patient currently has {payer}.", "",
+        "# Allergies", "No Known Allergies.", "",
+        "# Medications", ", ".join(meds) if meds else "No Active Medications.", "",
+        "# Assessment and Plan",
+    ]
+    lines += [f"Patient is presenting with {c.lower()}. " for c in conditions] or ["Routine visit. "]
+    lines += ["", "## Plan"]
+    if immunizations:
+        lines.append(f"Patient was given the following immunizations: {', '.join(i.lower() for i in immunizations)}. ")
+    return "\n".join(lines) + "\n"
+
+
+def generate_patient_bundle(index: int, seed: int, providers: list, profile: dict = DEFAULT_PROFILE, size_sigma: float = 0.5) -> dict:
+    """Generate one Synthea-shaped patient transaction Bundle.
+
+    The patient is fully determined by (seed, index), so shards can be produced in
+    any order by any worker. size_sigma spreads the encounter count log-normally
+    around profile["encounters_median"] to reproduce the skew of real records.
+    """
+    rng = random.Random(seed * 1_000_003 + index)
+    rates = profile["per_encounter"]
+    patient_id = _uuid(rng)
+    given = f"{rng.choice(FIRST_NAMES)}{rng.randint(1, 999)}"
+    family = f"{rng.choice(LAST_NAMES)}{rng.randint(1, 999)}"
+    gender = rng.choice(["male", "female"])
+    now = datetime(2025, 9, 17, tzinfo=timezone(timedelta(hours=5, minutes=30)))
+    birth = now - timedelta(days=rng.randint(1, 90 * 365))
+    payer = rng.choice(PAYERS)
+    provider = rng.choice(providers)
+    practitioner_ref = {"reference": f"Practitioner?identifier={NPI}|{provider['npi']}", "display": provider["doctor"]}
+    org_ref = {"reference": f"Organization?identifier={SYNTHEA}|{provider['org_id']}", "display": provider["org_name"]}
+    loc_ref = {"reference": f"Location?identifier={SYNTHEA}|{provider['loc_id']}", "display": provider["org_name"]}
+    subject = _ref(patient_id)
+
+    entries = [_entry({
+        "resourceType": "Patient", "id": patient_id,
+        "meta": {"profile": ["http://hl7.org/fhir/us/core/StructureDefinition/us-core-patient"]},
+        "identifier": [{"system": SYNTHEA, "value": patient_id}],
+        "name": [{"use": "official", "family": family, "given": [given]}],
+        "gender": gender, "birthDate": birth.date().isoformat(),
+        "address": [{"city": rng.choice(CITIES), "state": "MA", "country": "US"}],
+    })]
+
+    n_encounters = max(1, int(round(profile["encounters_median"] * math.exp(rng.gauss(0, size_sigma)))))
+    span_days = max(1, (now - birth).days)
+    visit_days = sorted(rng.sample(range(span_days), min(n_encounters, span_days)))
+    chronic = rng.sample(CONDITIONS, k=rng.randint(0, 3))
+    active_meds = []
+
+    for day in visit_days:
+        start = birth + timedelta(days=day, hours=rng.randint(8, 17))
+        end = start + timedelta(minutes=rng.choice([15, 30, 45, 60, 240]))
+        enc_class, enc_code, enc_display = rng.choice(ENCOUNTER_TYPES)
+        enc_id = _uuid(rng)
+        period = {"start": _ts(start), "end": _ts(end)}
+        enc_ref = _ref(enc_id)
+        entries.append(_entry({
+            "resourceType": "Encounter", "id": enc_id, "status": "finished",
+            "class": {"system": "http://terminology.hl7.org/CodeSystem/v3-ActCode", "code": enc_class},
+            "type": [_concept(SNOMED, enc_code, enc_display)],
+            "subject": _ref(patient_id, f"{given} {family}"),
+            "participant": [{"period": period, "individual": practitioner_ref}],
+            "period": period, "location": [{"location": loc_ref}], "serviceProvider": org_ref,
+        }))
+
+        encounter_conditions = []
+        for _ in range(_poisson(rng, rates.get("Condition", 0))):
+            code, display = rng.choice(chronic) if chronic and rng.random() < 0.4 else rng.choice(CONDITIONS)
+            encounter_conditions.append(display)
+            condition = {
+                "resourceType": "Condition", "id": _uuid(rng),
+                "clinicalStatus": _concept("http://terminology.hl7.org/CodeSystem/condition-clinical", "active", "Active"),
+                "code": _concept(SNOMED, code, display), "subject": subject, "encounter": enc_ref,
+                "onsetDateTime": _ts(start), "recordedDate": _ts(start),
+            }
+            if rng.random() < 0.5:
+                condition["abatementDateTime"] = _ts(start + timedelta(days=rng.randint(7, 120)))
+            entries.append(_entry(condition))
+
+        observation_ids = []
+        for _ in range(_poisson(rng, rates.get("Observation", 0))):
+            code, display, unit, mean, sd, category = rng.choice(OBSERVATIONS)
+            obs_id = _uuid(rng)
+            observation_ids.append((obs_id, code, display))
+            entries.append(_entry({
+                "resourceType": "Observation", "id": obs_id, "status": "final",
+                "category": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/observation-category", "code": category}]}],
+                "code": _concept(LOINC, code, display), "subject": subject, "encounter": enc_ref,
+                "effectiveDateTime": _ts(start), "issued": _ts(start),
+                "valueQuantity": {"value": round(max(0.0, rng.gauss(mean, sd)), 2), "unit": unit,
+                                  "system": "http://unitsofmeasure.org", "code": unit},
+            }))
+
+        for _ in range(_poisson(rng, rates.get("DiagnosticReport", 0))):
+            results = rng.sample(observation_ids, k=min(len(observation_ids), rng.randint(1, 4))) if observation_ids else []
+            entries.append(_entry({
+                "resourceType": "DiagnosticReport", "id": _uuid(rng), "status": "final",
+                "code": _concept(LOINC, "51990-0", "Basic metabolic panel - Blood"), "subject": subject,
+                "encounter": enc_ref, "effectiveDateTime": _ts(start), "issued": _ts(start),
+                "performer": [org_ref], "result": [_ref(obs_id, display) for obs_id, _, display in results],
+            }))
+
+        for _ in range(_poisson(rng, rates.get("Procedure", 0))):
+            code, display = rng.choice(PROCEDURES)
+            entries.append(_entry({
+                "resourceType": "Procedure", "id": _uuid(rng), "status": "completed",
+                "code": _concept(SNOMED, code, display), "subject": subject, "encounter": enc_ref,
+                "performedPeriod": period, "location": loc_ref,
+            }))
+
+        given_immunizations = []
+        for _ in range(_poisson(rng, rates.get("Immunization", 0))):
+            code, display = rng.choice(IMMUNIZATIONS)
+            given_immunizations.append(display)
+            entries.append(_entry({
+                "resourceType": "Immunization", "id": _uuid(rng), "status": "completed",
+                "vaccineCode": _concept(CVX, code, display), "patient": subject, "encounter": enc_ref,
+                "occurrenceDateTime": _ts(start), "primarySource": True, "location": loc_ref,
+            }))
+
+        for _ in range(_poisson(rng, rates.get("MedicationRequest", 0))):
+            code, display = rng.choice(MEDICATIONS)
+            active_meds.append(display)
+            entries.append(_entry({
+                "resourceType": "MedicationRequest", "id": _uuid(rng),
+                "status": rng.choice(["active", "completed", "stopped"]), "intent": "order",
+                "medicationCodeableConcept": _concept(RXNORM, code, display), "subject": subject,
+                "encounter": enc_ref, "authoredOn": _ts(start), "requester": practitioner_ref,
+            }))
+            entries.extend(_claim_entries(rng, patient_id, period, org_ref, loc_ref, [(RXNORM, code, display)], enc_ref, payer))
+
+        for rtype in ("SupplyDelivery", "Device", "ImagingStudy", "CarePlan"):
+            for _ in range(_poisson(rng, rates.get(rtype, 0))):
+                entries.append(_entry({"resourceType": rtype, "id": _uuid(rng), "status": "completed",
+                                       "subject" if rtype != "SupplyDelivery" else "patient": subject}))
+
+        note = _note_text(given, gender, start, payer, encounter_conditions, active_meds[-3:], given_immunizations)
+        entries.append(_entry({
+            "resourceType": "DocumentReference", "id": _uuid(rng), "status": "superseded",
+            "type": {"coding": [{"system": LOINC, "code": "34117-2", "display": "History and physical note"},
+                                {"system": LOINC, "code": "51847-2", "display": "Evaluation + Plan note"}]},
+            "category": [{"coding": [{"system": "http://hl7.org/fhir/us/core/CodeSystem/us-core-documentreference-category",
+                                      "code": "clinical-note", "display": "Clinical Note"}]}],
+            "subject": subject, "date": _ts(start), "author": [practitioner_ref], "custodian": org_ref,
+            "content": [{"attachment": {"contentType": "text/plain; charset=utf-8",
+                                        "data": base64.b64encode(note.encode("utf-8")).decode("ascii")}}],
+            "context": {"encounter": [enc_ref], "period": period},
+        }))
+
+        items = [(SNOMED, enc_code, enc_display)] + [(LOINC, code, display) for _, code, display in observation_ids[:3]]
+        entries.extend(_claim_entries(rng, patient_id, period, org_ref, loc_ref, items, enc_ref, payer))
+
+    entries.append(_entry({
+        "resourceType": "Provenance", "id": _uuid(rng), "recorded": _ts(now),
+        "target": [{"reference": e["fullUrl"]} for e in entries],
+        "agent": [{"who": practitioner_ref, "onBehalfOf": org_ref}],
+    }))
+    return {"resourceType": "Bundle", "type": "transaction", "entry": entries}
+
+
+def _claim_entries(rng: random.Random, patient_id: str, period: dict, org_ref: dict, loc_ref: dict, items: list, enc_ref: dict, payer: str) -> list:
+    """A Claim and its matching ExplanationOfBenefit, as bundle entries."""
+    claim_id = _uuid(rng)
+    claim_items = [{"sequence": i + 1, "productOrService": _concept(system, code, display),
+                    "encounter": [enc_ref], "net": {"value": round(rng.uniform(50, 900), 2), "currency": "USD"}}
+                   for i, (system, code, display) in enumerate(items)]
+    claim = {
+        "resourceType": "Claim", "id": claim_id, "status": "active", "use": "claim",
+        "type": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/claim-type", "code": "professional"}]},
+        "patient": _ref(patient_id), "billablePeriod": period, "created": period["end"],
+        "provider": org_ref, "facility": loc_ref, "insurance": [{"sequence": 1, "focal": True, "coverage": {"display": payer}}],
+        "item": claim_items,
+        "total": {"value": round(sum(item["net"]["value"] for item in claim_items), 2), "currency": "USD"},
+    }
+    eob = {
+        "resourceType": "ExplanationOfBenefit", "id": _uuid(rng), "status": "active", "use": "claim",
+        "type": claim["type"], "patient": _ref(patient_id), "billablePeriod": period, "created": period["end"],
+        "insurer": {"display": payer}, "provider": org_ref, "facility": loc_ref, "claim": _ref(claim_id),
+        "outcome": "complete", "insurance": [{"focal": True, "coverage": {"display": payer}}],
+        "item": [dict(item, adjudication=[{"category": {"coding": [{"code": "submitted"}]}, "amount": item["net"]}])
+                 for item in claim_items],
+        "total": [{"category": {"coding": [{"code": "submitted"}]}, "amount": claim["total"]}],
+    }
+    return [_entry(claim), _entry(eob)]
+
+
+def _write_shard(args):
+    """Worker: generate and write the patients in [start, stop). Returns (patients, bytes)."""
+    start, stop, seed, providers, profile, size_sigma, out_dir = args
+    written = 0
+    for index in range(start, stop):
+        bundle = generate_patient_bundle(index, seed, providers, profile, size_sigma)
+        patient = bundle["entry"][0]["resource"]
+        name = patient["name"][0]
+        path = os.path.join(out_dir, f"{name['given'][0]}_{name['family']}_{patient['id']}.json")
+        payload = json.dumps(bundle, indent=2)
+        with open(path, "w") as f:
+            f.write(payload)
+        written += len(payload)
+    return stop - start, written
+
+
+def estimate_patient_bytes(seed: int, providers: list, profile: dict, size_sigma: float, sample: int = 20) -> float:
+    """Average serialized size of a patient file, measured on a small pilot sample."""
+    sizes = [len(json.dumps(generate_patient_bundle(i, seed, providers, profile, size_sigma), indent=2))
+             for i in range(sample)]
+    return sum(sizes) / len(sizes)
+
+
+def generate_corpus(out_dir: str, patients: int, workers: int = None, seed: int = 1758138581587,
+                    providers: int = 50, profile: dict = DEFAULT_PROFILE, size_sigma: float = 0.5,
+                    shard_size: int = 50) -> dict:
+    """Write a corpus of patient bundles plus provider bundles into out_dir in parallel."""
+    os.makedirs(out_dir, exist_ok=True)
+    hospital, practitioners, provider_list = generate_provider_bundles(providers, seed)
+    with open(os.path.join(out_dir, f"hospitalInformation{seed}.json"), "w") as f:
+        json.dump(hospital, f, indent=2)
+    with open(os.path.join(out_dir, f"practitionerInformation{seed}.json"), "w") as f:
+        json.dump(practitioners, f, indent=2)
+
+    shards = [(start, min(start + shard_size, patients), seed, provider_list, profile, size_sigma, out_dir)
+              for start in range(0, patients, shard_size)]
+    started = time.time()
+    done, total_bytes = 0, 0
+    with Pool(processes=workers or os.cpu_count()) as pool:
+        for count, written in pool.imap_unordered(_write_shard, shards):
+            done += count
+            total_bytes += written
+            print(f"  {done}/{patients} patients, {total_bytes / 1e9:.2f} GB", end="\r", flush=True)
+    elapsed = time.time() - started
+    print(f"\n✅ Generated {done} patients ({total_bytes / 1e9:.2f} GB) in {elapsed:.1f}s into {out_dir}")
+    return {"patients": done, "bytes": total_bytes, "seconds": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Synthea-shaped FHIR bundles for scale testing.")
+    parser.add_argument("--out", default=os.path.join("data", "synthetic"), help="output directory")
+    parser.add_argument("--patients", type=int, default=1000, help="number of patient bundles to write")
+    parser.add_argument("--target-gb", type=float, help="size the corpus to roughly this many GB (overrides --patients)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=1758138581587)
+    parser.add_argument("--providers", type=int, default=50, help="organizations/practitioners to reference")
+    parser.add_argument("--encounters-median", type=int, help="median encounters per patient")
+    parser.add_argument("--size-sigma", type=float, default=0.5,
+                        help="log-normal spread of encounters per patient (0 = every patient the same size)")
+    parser.add_argument("--profile-from", help="directory of real Synthea bundles to copy the resource mix from")
+    args = parser.parse_args()
+
+    profile = profile_corpus(args.profile_from) if args.profile_from else copy.deepcopy(DEFAULT_PROFILE)
+    if args.encounters_median:
+        profile["encounters_median"] = args.encounters_median
+
+    patients = args.patients
+    if args.target_gb:
+        _, _, provider_list = generate_provider_bundles(args.providers, args.seed)
+        per_patient = estimate_patient_bytes(args.seed, provider_list, profile, args.size_sigma)
+        patients = max(1, int(args.target_gb * 1e9 / per_patient))
+        print(f"~{per_patient / 1e6:.2f} MB per patient -> {patients} patients for {args.target_gb} GB")
+
+    generate_corpus(args.out, patients, args.workers, args.seed, args.providers, profile, args.size_sigma)
+
+
+if __name__ == "__main__":
+    main()